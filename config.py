@@ -2,6 +2,7 @@
 Configuração do projeto e contrato das planilhas Excel (polpa e extrato).
 """
 import os
+import tempfile
 from pathlib import Path
 
 # Carrega variáveis do .env (se existir)
@@ -18,6 +19,115 @@ DB_NAME = os.getenv("DB_NAME", "dashboard_mangas")
 POLPA_COLLECTION = "polpa"
 EXTRATO_COLLECTION = "extrato"
 UPLOADS_LOG_COLLECTION = "uploads_log"
+# Entradas do log mais antigas que isso vão para o arquivo resumido (scripts.arquivar_uploads)
+UPLOADS_LOG_ARQUIVO_COLLECTION = "uploads_log_arquivo"
+UPLOADS_RETENCAO_DIAS = int(os.getenv("UPLOADS_RETENCAO_DIAS", "365"))
+SKETCHES_COLLECTION = "sketches"
+# Anomalias detectadas no upload: cada competência importada comparada com as
+# ANOMALIAS_HISTORICO_MESES anteriores (desvio robusto acima de ANOMALIAS_Z)
+ANOMALIAS_COLLECTION = "anomalias_upload"
+ANOMALIAS_HISTORICO_MESES = int(os.getenv("ANOMALIAS_HISTORICO_MESES", "12"))
+ANOMALIAS_Z = float(os.getenv("ANOMALIAS_Z", "4"))
+# Eventos de upload (coleção capped, lida por /api/events) e versão dos dados por tipo
+EVENTOS_COLLECTION = "eventos"
+VERSOES_COLLECTION = "versoes_dados"
+EVENTOS_CAPPED_BYTES = int(os.getenv("EVENTOS_CAPPED_BYTES", str(4 * 1024 * 1024)))
+EVENTOS_HEARTBEAT_S = int(os.getenv("EVENTOS_HEARTBEAT_S", "15"))
+# Cache das respostas de leitura por versão dos dados (entradas antigas expiram pelo TTL) e
+# aquecimento das visões padrão do dashboard depois de cada upload
+CACHE_CONSULTAS = os.getenv("CACHE_CONSULTAS", "true").lower() in ("1", "true", "sim")
+CACHE_COLLECTION = "cache_consultas"
+CACHE_TTL_S = int(os.getenv("CACHE_TTL_S", str(7 * 24 * 3600)))
+CACHE_AQUECER_MESES = int(os.getenv("CACHE_AQUECER_MESES", "12"))
+
+# Layout de armazenamento das linhas: "linhas" (um documento por linha da planilha) ou
+# "buckets" (linhas agrupadas por tipo/group_id/competencia/canal, campos em arrays paralelos)
+STORAGE_MODE = os.getenv("STORAGE_MODE", "linhas")
+POLPA_BUCKETS_COLLECTION = "polpa_buckets"
+EXTRATO_BUCKETS_COLLECTION = "extrato_buckets"
+BUCKET_MAX_LINHAS = int(os.getenv("BUCKET_MAX_LINHAS", "1000"))
+
+# Gravação de uma competência: lotes não ordenados de INSERCAO_LOTE documentos enviados por
+# INSERCAO_THREADS conexões em paralelo; lote que falhar por erro transitório é reenviado até
+# INSERCAO_TENTATIVAS vezes. Write concern das inserções: INSERCAO_W ("majority" ou nº de nós)
+# e INSERCAO_J (journal); vazios = write concern padrão do servidor, o mesmo da remoção.
+INSERCAO_LOTE = int(os.getenv("INSERCAO_LOTE", "10000"))
+INSERCAO_THREADS = int(os.getenv("INSERCAO_THREADS", "4"))
+INSERCAO_TENTATIVAS = int(os.getenv("INSERCAO_TENTATIVAS", "3"))
+INSERCAO_W = os.getenv("INSERCAO_W", "")
+INSERCAO_J = os.getenv("INSERCAO_J", "")
+# Vazão máxima da gravação por worker (documentos/s somando os uploads em andamento; 0 = sem limite)
+# e espera máxima de cada lote por leituras em andamento no worker (0 = não cede)
+INSERCAO_DOCS_POR_S = int(os.getenv("INSERCAO_DOCS_POR_S", "0"))
+INSERCAO_ESPERA_LEITURA_MS = int(os.getenv("INSERCAO_ESPERA_LEITURA_MS", "200"))
+
+# Admissão dos uploads por worker: UPLOADS_CONCORRENTES processando e até UPLOADS_FILA_MAX
+# esperando a vez; além disso o upload é recusado com 429 (Retry-After)
+UPLOADS_CONCORRENTES = max(1, int(os.getenv("UPLOADS_CONCORRENTES", "1")))
+UPLOADS_FILA_MAX = int(os.getenv("UPLOADS_FILA_MAX", "2"))
+
+# Particionamento por group_id: "nenhum" (todos na mesma coleção), "group_id" (uma coleção por
+# group_id: polpa__<group_id>) ou "hash" (group_ids distribuídos em PARTICOES_HASH coleções).
+# Linhas sem group_id ficam na coleção base. Migrar dados existentes: scripts.particionar_group_id
+PARTICIONAMENTO = os.getenv("PARTICIONAMENTO", "nenhum")
+PARTICOES_HASH = int(os.getenv("PARTICOES_HASH", "16"))
+
+# Pool de conexões e timeouts do MongoClient
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "60000"))
+# Compressão do protocolo: "zstd" e "snappy" exigem os pacotes zstandard/python-snappy
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+MONGO_APP_NAME = os.getenv("MONGO_APP_NAME", "dashboard-mangas-api")
+
+# Leituras analíticas: preferência de leitura e staleness máximo (segundos, mínimo 90)
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "secondaryPreferred")
+MONGO_MAX_STALENESS_S = int(os.getenv("MONGO_MAX_STALENESS_S", "90"))
+
+# Limites das consultas de leitura: tempo máximo no servidor (maxTimeMS), com orçamento por rota
+# (ex.: "/api/comparativo=30000,/api/geografia/regioes=20000") e spill em disco para $group/$sort grandes
+QUERY_MAX_TIME_MS = int(os.getenv("QUERY_MAX_TIME_MS", "15000"))
+QUERY_MAX_TIME_MS_ROTAS = {
+    rota.strip(): int(ms)
+    for rota, _, ms in (item.partition("=") for item in os.getenv("QUERY_MAX_TIME_MS_ROTAS", "").split(","))
+    if rota.strip() and ms.strip()
+}
+QUERY_ALLOW_DISK_USE = os.getenv("QUERY_ALLOW_DISK_USE", "true").lower() in ("1", "true", "sim")
+
+# Perfil por requisição (?profile=1 com o cabeçalho X-Perfil-Token): amostragem do Python a cada
+# PERFIL_INTERVALO_MS, comandos ao MongoDB com duração e explain (até PERFIL_MAX_EXPLAIN) e etapas
+# da ingestão. Sem PERFIL_TOKEN o parâmetro é ignorado.
+PERFIL_TOKEN = os.getenv("PERFIL_TOKEN", "")
+PERFIL_INTERVALO_MS = float(os.getenv("PERFIL_INTERVALO_MS", "5"))
+PERFIL_MAX_EXPLAIN = int(os.getenv("PERFIL_MAX_EXPLAIN", "20"))
+
+# Índice de bitmaps em memória (por competência) para filtros combinados de dimensão nos endpoints.
+# Seleções maiores que BITMAP_MAX_IDS linhas viram filtro por campo no próprio $match.
+BITMAP_INDEX = os.getenv("BITMAP_INDEX", "true").lower() in ("1", "true", "sim")
+BITMAP_MAX_IDS = int(os.getenv("BITMAP_MAX_IDS", "20000"))
+BITMAP_VERIFICAR_S = float(os.getenv("BITMAP_VERIFICAR_S", "5"))
+
+# Servidor HTTP: com WEB_WORKERS > 1 o uvicorn sobe vários processos (cada um com seu MongoClient)
+# Réplica só de leitura: não registra os endpoints de upload nem carrega pandas/openpyxl,
+# e não cria índices na subida (usuário do Mongo pode ser só leitura)
+READ_ONLY = os.getenv("READ_ONLY", "false").lower() in ("1", "true", "sim")
+
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8002"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+WEB_GRACEFUL_TIMEOUT_S = int(os.getenv("WEB_GRACEFUL_TIMEOUT_S", "30"))
+
+# Métricas por worker; METRICAS_DIR (diretório compartilhado) permite a visão de todos os workers
+METRICAS_DIR = os.getenv(
+    "METRICAS_DIR",
+    os.path.join(tempfile.gettempdir(), "dashboard-mangas-metricas") if WEB_WORKERS > 1 else "",
+)
+METRICAS_JANELA = int(os.getenv("METRICAS_JANELA", "1000"))
+METRICAS_INTERVALO_S = int(os.getenv("METRICAS_INTERVALO_S", "5"))
 
 # Tipos de planilha aceitos
 TIPOS_VALIDOS = ["polpa", "extrato"]
@@ -56,3 +166,9 @@ COLUNAS_EXTRATO = [
 
 # Extensões aceitas
 ALLOWED_EXTENSIONS = {".xlsx", ".xls", ".csv"}
+
+# Máximo de itens no relatório de erros por linha devolvido no upload
+ERROS_LINHA_MAX = int(os.getenv("ERROS_LINHA_MAX", "200"))
+
+# Prévia (dry_run) do upload: lê no máximo estas linhas por aba e extrapola o restante
+DRY_RUN_MAX_LINHAS = int(os.getenv("DRY_RUN_MAX_LINHAS", "20000"))
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef } from "react"
 import {
   LineChart,
   Line,
@@ -37,6 +37,13 @@ type UploadEntry = {
   linhas_substituidas: number
 }
 
+type UploadEvent = {
+  tipo: Tipo
+  group_id: string | null
+  competencia: string
+  versao: number
+}
+
 export default function Dashboard() {
   const [tipo, setTipo] = useState<Tipo>("polpa")
   const [periods, setPeriods] = useState<string[]>([])
@@ -48,6 +55,32 @@ export default function Dashboard() {
   const [uploads, setUploads] = useState<UploadEntry[]>([])
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState<string | null>(null)
+  // Versão dos dados recebida por SSE: muda quando um upload afeta o período exibido
+  const [versao, setVersao] = useState(0)
+  const [versaoUploads, setVersaoUploads] = useState(0)
+  const filtrosRef = useRef({ fromComp, toComp, periods })
+  filtrosRef.current = { fromComp, toComp, periods }
+
+  useEffect(() => {
+    const es = new EventSource(`${API_BASE}/api/events?tipo=${tipo}`)
+    es.addEventListener("upload", (e) => {
+      const ev = JSON.parse((e as MessageEvent).data) as UploadEvent
+      const { fromComp, toComp, periods } = filtrosRef.current
+      const noPeriodo = (!fromComp || ev.competencia >= fromComp) && (!toComp || ev.competencia <= toComp)
+      if (noPeriodo || !periods.includes(ev.competencia)) setVersao(ev.versao)
+      else setVersaoUploads(ev.versao)
+    })
+    return () => es.close()
+  }, [tipo])
+
+  // Upload fora do período exibido: só a lista de uploads muda
+  useEffect(() => {
+    if (!versaoUploads) return
+    fetch(`${API_BASE}/api/uploads?limit=30`)
+      .then((r) => r.json())
+      .then((d) => setUploads(d.uploads || []))
+      .catch(() => {})
+  }, [versaoUploads])
 
   useEffect(() => {
     let cancelled = false
@@ -91,7 +124,7 @@ export default function Dashboard() {
     return () => {
       cancelled = true
     }
-  }, [tipo, fromComp, toComp])
+  }, [tipo, fromComp, toComp, versao])
 
   if (loading && !metrics) {
     return (
@@ -1,7 +1,24 @@
-from fastapi import FastAPI
+import time
+
+# antes dos demais imports: mede a importação da aplicação (reportada em /health/metricas)
+_inicio_importacao = time.perf_counter()
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, NetworkTimeout
+
+from config import READ_ONLY, WEB_HOST, WEB_PORT, WEB_WORKERS, WEB_GRACEFUL_TIMEOUT_S, METRICAS_INTERVALO_S
+from services import metricas
+from services.admissao import ContarLeituras
+from services.db import conectar, fechar, garantir_indices, status_db
+from services.limites import CancelarAoDesconectar
+from services.perfil import PerfilarRequisicao
 
-from routes.uploads import router as uploads_router
 from routes.metrics import router as metrics_router
 from routes.geografia import router as geografia_router
 from routes.financeiro import router as financeiro_router
@@ -9,8 +26,44 @@ from routes.canal import router as canal_router
 from routes.segmentos import router as segmentos_router
 from routes.qualidade import router as qualidade_router
 from routes.analise import router as analise_router
+from routes.comparativo import router as comparativo_router
+from routes.previsao import router as previsao_router
+from routes.cruzamento import router as cruzamento_router
+from routes.eventos import router as eventos_router
+
+logger = logging.getLogger(__name__)
+_importacao_ms = (time.perf_counter() - _inicio_importacao) * 1000
+
 
-app = FastAPI(title="Dashboard Mangas API", version="1.0.0")
+async def _publicar_metricas_periodicamente():
+    while True:
+        try:
+            metricas.publicar()
+        except OSError as e:
+            logger.warning("Falha ao publicar métricas do worker: %s", e)
+        await asyncio.sleep(METRICAS_INTERVALO_S)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Roda em cada worker, depois do fork: o MongoClient é criado aqui, no processo que o usa.
+    # Se o Mongo estiver fora, a API sobe e /health indica "indisponivel".
+    inicio = time.perf_counter()
+    try:
+        conectar()
+        if not READ_ONLY:
+            garantir_indices()
+    except Exception as e:
+        logger.warning("MongoDB indisponível na inicialização: %s", e)
+    metricas.registrar_inicializacao(importacao_ms=_importacao_ms, conexao_ms=(time.perf_counter() - inicio) * 1000)
+    tarefa_metricas = asyncio.create_task(_publicar_metricas_periodicamente())
+    yield
+    tarefa_metricas.cancel()
+    metricas.remover_publicacao()
+    fechar()
+
+
+app = FastAPI(title="Dashboard Mangas API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,17 +74,76 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(ExecutionTimeout)
+@app.exception_handler(NetworkTimeout)
+async def consulta_excedeu_tempo(request: Request, exc: Exception):
+    """maxTimeMS (ou timeout de socket) estourado: 504 em vez de erro genérico."""
+    metricas.incrementar("consultas_timeout")
+    logger.warning("Consulta excedeu o tempo limite em %s: %s", request.url.path, exc)
+    return JSONResponse(
+        status_code=504,
+        content={"erros": ["A consulta excedeu o tempo limite. Reduza o período (from_comp/to_comp) ou os filtros."]},
+    )
+
+
+@app.exception_handler(ConnectionFailure)
+async def banco_indisponivel(request: Request, exc: Exception):
+    """MongoDB fora do ar ou pool esgotado: 503."""
+    metricas.incrementar("db_indisponivel")
+    logger.warning("MongoDB indisponível em %s: %s", request.url.path, exc)
+    return JSONResponse(status_code=503, content={"erros": ["Banco de dados indisponível. Tente novamente."]})
+
+
+@app.middleware("http")
+async def medir_requisicoes(request: Request, call_next):
+    inicio = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    # sem rota (404, scanners): um rótulo fixo, para não criar uma série de latência por caminho
+    nome = f"{request.method} {route.path}" if route else f"{request.method} <sem rota>"
+    metricas.registrar_latencia(nome, (time.perf_counter() - inicio) * 1000)
+    metricas.incrementar("http_requisicoes")
+    if response.status_code >= 500:
+        metricas.incrementar("http_5xx")
+    return response
+
+
+# ?profile=1 (com X-Perfil-Token): perfil de Python, MongoDB e etapas da ingestão na resposta
+app.add_middleware(PerfilarRequisicao)
+
+# GETs em andamento: a gravação dos uploads cede a eles (services.admissao)
+app.add_middleware(ContarLeituras)
+
+# Registrado por último = mais externo: acompanha a conexão durante toda a requisição e
+# cancela as consultas de GET /api/* quando o cliente desconecta
+app.add_middleware(CancelarAoDesconectar)
+
+
 @app.get("/")
 async def root():
     return {"message": "API Dashboard Mangas. Upload de Excel + métricas. Acesse /docs para documentação."}
 
 
 @app.get("/health")
-async def health_check():
-    return {"status": "ok"}
+def health_check():
+    """Readiness: latência do MongoDB e uso do pool de conexões. 503 se o banco não responder."""
+    db = status_db()
+    if not db["ok"]:
+        return JSONResponse(status_code=503, content={"status": "indisponivel", "db": db})
+    return {"status": "ok", "db": db}
+
+
+@app.get("/health/metricas")
+def metricas_workers():
+    """Métricas do worker que atendeu (pid, contadores, latências p50/p95/p99) e dos demais workers."""
+    workers = metricas.snapshot_workers()
+    return {"worker": workers[0], "workers": workers, "total_workers": len(workers)}
+
 
+if not READ_ONLY:
+    from routes.uploads import router as uploads_router
 
-app.include_router(uploads_router)
+    app.include_router(uploads_router)
 app.include_router(metrics_router)
 app.include_router(geografia_router)
 app.include_router(financeiro_router)
@@ -39,7 +151,18 @@ app.include_router(canal_router)
 app.include_router(segmentos_router)
 app.include_router(qualidade_router)
 app.include_router(analise_router)
+app.include_router(comparativo_router)
+app.include_router(previsao_router)
+app.include_router(cruzamento_router)
+app.include_router(eventos_router)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    # Com mais de um worker o uvicorn precisa da app como import string
+    uvicorn.run(
+        "main:app" if WEB_WORKERS > 1 else app,
+        host=WEB_HOST,
+        port=WEB_PORT,
+        workers=WEB_WORKERS,
+        timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT_S,
+    )
@@ -1,12 +1,18 @@
 """
-Endpoints de análise avançada: preço médio, logística, desconto (polpa), concentração, tipo solvente, certificação (extrato).
+Endpoints de análise avançada: preço médio, logística, desconto, lotes distintos (polpa), concentração, tipo solvente, certificação (extrato).
 """
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Depends, Query
 from typing import Optional, Literal
 
-from services.db import get_collection
+from services.consultas import estagios_iniciais, estagios_resumo, soma_registros
+from services import hll
+from services.db import get_read_collection
+from services.filtros import filtro_dimensoes, filtros_dimensao
+from services.limites import agregar
+from services.perfil import RotaPerfilada
+from services.sketches import mesclar_distintos
 
-router = APIRouter(prefix="/api", tags=["analise"])
+router = APIRouter(prefix="/api", tags=["analise"], route_class=RotaPerfilada)
 
 
 def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id: Optional[str]):
@@ -23,23 +29,25 @@ def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id:
 
 
 @router.get("/analise/preco-medio-periodo")
-async def get_preco_medio_periodo(
+def get_preco_medio_periodo(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Preço unitário médio por competência. Polpa: BRL/kg; Extrato: BRL/L."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
     campo = "preco_unitario_brl_kg" if tipo == "polpa" else "preco_unitario_brl_l"
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais(tipo, match, [campo]),
         {"$match": {campo: {"$exists": True, "$ne": None}}},
         {"$group": {"_id": "$competencia", "preco_medio": {"$avg": f"${campo}"}, "registros": {"$sum": 1}}},
         {"$sort": {"_id": 1}},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     dados = [
         {"periodo": r["_id"], "preco_medio": round(float(r.get("preco_medio") or 0), 2), "registros": r["registros"]}
         for r in cur
@@ -48,27 +56,29 @@ async def get_preco_medio_periodo(
 
 
 @router.get("/analise/polpa-logistica-desconto")
-async def get_polpa_logistica_desconto(
+def get_polpa_logistica_desconto(
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Polpa: logística total e desconto total por competência."""
-    sales = get_collection("polpa")
+    sales = get_read_collection("polpa", group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes("polpa", match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_resumo("polpa", match, ["logistica_brl", "desconto_brl"]),
         {
             "$group": {
                 "_id": "$competencia",
                 "logistica_total": {"$sum": {"$ifNull": ["$logistica_brl", 0]}},
                 "desconto_total": {"$sum": {"$ifNull": ["$desconto_brl", 0]}},
-                "registros": {"$sum": 1},
+                "registros": soma_registros(),
             }
         },
         {"$sort": {"_id": 1}},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     dados = []
     for r in cur:
         dados.append({
@@ -80,22 +90,50 @@ async def get_polpa_logistica_desconto(
     return {"dados": dados}
 
 
+@router.get("/analise/polpa-lotes-distintos")
+def get_polpa_lotes_distintos(
+    group_id: Optional[str] = Query(None),
+    from_comp: Optional[str] = Query(None),
+    to_comp: Optional[str] = Query(None),
+    agrupar_por: Literal["periodo", "total", "canal", "regiao_destino", "cliente_segmento"] = Query("periodo"),
+):
+    """
+    Polpa: quantidade aproximada de lote_id distintos (HyperLogLog gravado no upload).
+    Lotes repetidos entre meses/canais contam uma vez no total; erro padrão em erro_padrao_pct.
+    """
+    match = _filtro_periodo(from_comp, to_comp, group_id)
+    dimensao = "total" if agrupar_por in ("total", "periodo") else agrupar_por
+    grupos = mesclar_distintos("polpa", "lote_id", dimensao, agrupar_por == "periodo", match)
+    dados = []
+    for chave, regs in grupos.items():
+        item = {} if agrupar_por == "total" else {agrupar_por: chave if chave is not None else "(não informado)"}
+        item["lotes_distintos"] = hll.estimar(regs)
+        dados.append(item)
+    if agrupar_por == "periodo":
+        dados.sort(key=lambda d: d["periodo"])
+    else:
+        dados.sort(key=lambda d: -d["lotes_distintos"])
+    return {"dados": dados, "agrupar_por": agrupar_por, "erro_padrao_pct": round(hll.ERRO_PADRAO * 100, 2)}
+
+
 @router.get("/analise/extrato-concentracao")
-async def get_extrato_concentracao(
+def get_extrato_concentracao(
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Extrato: concentração ativa média (%) por competência."""
-    sales = get_collection("extrato")
+    sales = get_read_collection("extrato", group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes("extrato", match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais("extrato", match, ["concentracao_ativa_pct"]),
         {"$match": {"concentracao_ativa_pct": {"$exists": True, "$ne": None}}},
         {"$group": {"_id": "$competencia", "concentracao_media": {"$avg": "$concentracao_ativa_pct"}, "registros": {"$sum": 1}}},
         {"$sort": {"_id": 1}},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     dados = [
         {"periodo": r["_id"], "concentracao_media": round(float(r.get("concentracao_media") or 0), 2), "registros": r["registros"]}
         for r in cur
@@ -104,22 +142,24 @@ async def get_extrato_concentracao(
 
 
 @router.get("/analise/extrato-tipo-solvente")
-async def get_extrato_tipo_solvente(
+def get_extrato_tipo_solvente(
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
     limit: int = Query(10, ge=1, le=20),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Extrato: receita e registros por tipo_solvente (para Pie/Bar)."""
-    sales = get_collection("extrato")
+    sales = get_read_collection("extrato", group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes("extrato", match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais("extrato", match, ["tipo_solvente", "receita"]),
         {"$group": {"_id": "$tipo_solvente", "receita": {"$sum": "$receita"}, "registros": {"$sum": 1}}},
         {"$sort": {"receita": -1}},
         {"$limit": limit},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     itens = [
         {"tipo_solvente": r["_id"] or "(não informado)", "receita": float(r["receita"] or 0), "registros": r["registros"]}
         for r in cur
@@ -128,22 +168,24 @@ async def get_extrato_tipo_solvente(
 
 
 @router.get("/analise/extrato-certificacao")
-async def get_extrato_certificacao(
+def get_extrato_certificacao(
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
     limit: int = Query(10, ge=1, le=20),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Extrato: receita e registros por certificacao_exigida (para Pie/Bar)."""
-    sales = get_collection("extrato")
+    sales = get_read_collection("extrato", group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes("extrato", match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais("extrato", match, ["certificacao_exigida", "receita"]),
         {"$group": {"_id": "$certificacao_exigida", "receita": {"$sum": "$receita"}, "registros": {"$sum": 1}}},
         {"$sort": {"receita": -1}},
         {"$limit": limit},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     itens = [
         {"certificacao": str(r["_id"]) if r["_id"] is not None else "(não informado)", "receita": float(r["receita"] or 0), "registros": r["registros"]}
         for r in cur
@@ -152,26 +194,30 @@ async def get_extrato_certificacao(
 
 
 @router.get("/analise/receita-quantidade-periodo")
-async def get_receita_quantidade_periodo(
+def get_receita_quantidade_periodo(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Receita e quantidade por competência (para ComposedChart dual axis)."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
-    group = {"_id": "$competencia", "receita": {"$sum": "$receita"}, "registros": {"$sum": 1}}
-    if tipo == "polpa":
-        group["quantidade_kg"] = {"$sum": "$quantidade_kg"}
-    else:
-        group["quantidade_litros"] = {"$sum": "$quantidade_litros"}
+    match.update(filtro_dimensoes(tipo, match, filtros))
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
+    group = {
+        "_id": "$competencia",
+        "receita": {"$sum": "$receita"},
+        "registros": soma_registros(),
+        campo_qtd: {"$sum": f"${campo_qtd}"},
+    }
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_resumo(tipo, match, ["receita", campo_qtd]),
         {"$group": group},
         {"$sort": {"_id": 1}},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     dados = []
     for r in cur:
         item = {"periodo": r["_id"], "receita": float(r.get("receita") or 0)}
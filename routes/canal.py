@@ -1,13 +1,17 @@
 """
 Endpoints de análise por canal: ranking (receita e registros), receita por mês por canal.
 """
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Depends, Query
 from typing import Optional, Literal
 from collections import defaultdict
 
-from services.db import get_collection
+from services.consultas import estagios_resumo, soma_registros
+from services.db import get_read_collection
+from services.filtros import filtro_dimensoes, filtros_dimensao
+from services.limites import agregar
+from services.perfil import RotaPerfilada
 
-router = APIRouter(prefix="/api", tags=["canal"])
+router = APIRouter(prefix="/api", tags=["canal"], route_class=RotaPerfilada)
 
 
 def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id: Optional[str]):
@@ -24,23 +28,25 @@ def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id:
 
 
 @router.get("/canal/ranking")
-async def get_canal_ranking(
+def get_canal_ranking(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
     limit: int = Query(15, ge=1, le=50),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Ranking de canais por receita, com quantidade de registros por canal."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
-        {"$group": {"_id": "$canal", "receita": {"$sum": "$receita"}, "registros": {"$sum": 1}}},
+        *estagios_resumo(tipo, match, ["receita"]),
+        {"$group": {"_id": "$canal", "receita": {"$sum": "$receita"}, "registros": soma_registros()}},
         {"$sort": {"receita": -1}},
         {"$limit": limit},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     canais = [
         {"canal": r["_id"] or "(não informado)", "receita": float(r["receita"] or 0), "registros": r["registros"] or 0}
         for r in cur
@@ -49,39 +55,41 @@ async def get_canal_ranking(
 
 
 @router.get("/canal/receita-por-mes")
-async def get_canal_receita_por_mes(
+def get_canal_receita_por_mes(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
     limit_canais: int = Query(5, ge=1, le=10),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """
     Receita por competência (mês) para os top N canais.
     Retorna lista de { canal, dados: [ { periodo, receita } ] }.
     """
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
 
     # Primeiro: top canais por receita total
     pipe_top = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_resumo(tipo, match, ["receita"]),
         {"$group": {"_id": "$canal", "receita": {"$sum": "$receita"}}},
         {"$sort": {"receita": -1}},
         {"$limit": limit_canais},
     ]
-    top_canais = [r["_id"] or "(não informado)" for r in sales.aggregate(pipe_top)]
+    top_canais = [r["_id"] or "(não informado)" for r in agregar(sales, pipe_top)]
     if not top_canais:
         return {"canais": [], "tipo": tipo}
 
     # Agrupar por competência e canal
     pipe_ts = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_resumo(tipo, match, ["receita"]),
         {"$match": {"canal": {"$in": top_canais}}},
         {"$group": {"_id": {"competencia": "$competencia", "canal": "$canal"}, "receita": {"$sum": "$receita"}}},
     ]
     by_canal: dict[str, list[dict]] = defaultdict(list)
-    for r in sales.aggregate(pipe_ts):
+    for r in agregar(sales, pipe_ts):
         comp = r["_id"]["competencia"]
         canal = r["_id"]["canal"] or "(não informado)"
         by_canal[canal].append({"periodo": comp, "receita": float(r["receita"] or 0)})
@@ -0,0 +1,168 @@
+"""
+Endpoints de comparação entre períodos: variação mês a mês (MoM), ano a ano (YoY) e médias móveis.
+Tudo em um único pipeline com $setWindowFields (MongoDB 5.0+).
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional, Literal
+
+from services.consultas import estagios_iniciais, estagios_resumo
+from services.db import get_read_collection
+from services.filtros import filtro_dimensoes, filtros_dimensao
+from services.limites import agregar
+from services.perfil import RotaPerfilada
+
+router = APIRouter(prefix="/api", tags=["comparativo"], route_class=RotaPerfilada)
+
+JANELAS_MEDIA = (3, 6, 12)
+
+
+def _deslocar_competencia(competencia: str, meses: int) -> str:
+    try:
+        ano, mes = (int(p) for p in competencia.split("-"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail={"erros": [f"Competência inválida: {competencia} (use YYYY-MM)"]})
+    total = ano * 12 + (mes - 1) + meses
+    return f"{total // 12:04d}-{total % 12 + 1:02d}"
+
+
+def _acumuladores(tipo: str, metrica: str) -> tuple[str, dict, dict]:
+    """
+    (campo, numerador, denominador) por competência; valor = numerador / denominador.
+    receita/quantidade: soma do mês (denominador 1) -> média móvel = média dos meses com dado.
+    nps: +100 promotor (9-10), -100 detrator (0-6) sobre respostas -> NPS real, ponderado nas janelas.
+    """
+    if metrica == "nps":
+        nota = "$nps_0a10"
+        numerador = {
+            "$sum": {
+                "$cond": [
+                    {"$not": [{"$isNumber": nota}]},
+                    0,
+                    {"$cond": [{"$gte": [nota, 9]}, 100, {"$cond": [{"$lte": [nota, 6]}, -100, 0]}]},
+                ]
+            }
+        }
+        return "nps_0a10", numerador, {"$sum": {"$cond": [{"$isNumber": nota}, 1, 0]}}
+    campo = "receita" if metrica == "receita" else ("quantidade_kg" if tipo == "polpa" else "quantidade_litros")
+    return campo, {"$sum": f"${campo}"}, {"$max": 1}
+
+
+def _janela(inicio: int, fim: int) -> dict:
+    """Janela em meses relativos ao mes_idx da linha (meses ausentes não ocupam posição)."""
+    return {"range": [inicio, fim]}
+
+
+def _razao(num: str, den: str) -> dict:
+    return {"$cond": [{"$gt": [den, 0]}, {"$divide": [num, den]}, None]}
+
+
+def _variacao_pct(atual: str, anterior: str) -> dict:
+    return {
+        "$cond": [
+            {"$and": [{"$isNumber": anterior}, {"$isNumber": atual}, {"$ne": [anterior, 0]}]},
+            {"$multiply": [{"$divide": [{"$subtract": [atual, anterior]}, {"$abs": anterior}]}, 100]},
+            None,
+        ]
+    }
+
+
+def _arred(v) -> Optional[float]:
+    return round(float(v), 2) if v is not None else None
+
+
+@router.get("/comparativo")
+def get_comparativo(
+    tipo: Literal["polpa", "extrato"] = Query(...),
+    metrica: Literal["receita", "quantidade", "nps"] = Query("receita"),
+    agrupar_por: Literal["total", "canal", "cliente_segmento"] = Query("total"),
+    group_id: Optional[str] = Query(None),
+    from_comp: Optional[str] = Query(None),
+    to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
+):
+    """
+    Por competência (e canal/segmento): valor, valor do mês anterior e do mesmo mês do ano anterior,
+    variação MoM/YoY em % e médias móveis de 3, 6 e 12 meses. Meses sem dado não entram nas médias.
+    O filtro from_comp é ampliado 12 meses para trás para as janelas e aplicado depois do cálculo.
+    """
+    campo, numerador, denominador = _acumuladores(tipo, metrica)
+    match: dict = {}
+    if from_comp or to_comp:
+        match["competencia"] = {}
+        if from_comp:
+            match["competencia"]["$gte"] = _deslocar_competencia(from_comp, -max(JANELAS_MEDIA))
+        if to_comp:
+            match["competencia"]["$lte"] = to_comp
+    if group_id:
+        match["group_id"] = group_id
+    match.update(filtro_dimensoes(tipo, match, filtros))
+
+    dimensao = None if agrupar_por == "total" else agrupar_por
+    if metrica != "nps" and dimensao in (None, "canal"):
+        iniciais = estagios_resumo(tipo, match, [campo])
+    else:
+        iniciais = estagios_iniciais(tipo, match, [campo] + ([dimensao] if dimensao else []))
+
+    pipeline = [
+        *iniciais,
+        {
+            "$group": {
+                "_id": {"competencia": "$competencia", "grupo": f"${dimensao}" if dimensao else None},
+                "num": numerador,
+                "den": denominador,
+            }
+        },
+        {
+            "$set": {
+                "valor": _razao("$num", "$den"),
+                "mes_idx": {
+                    "$add": [
+                        {"$multiply": [{"$toInt": {"$substrBytes": ["$_id.competencia", 0, 4]}}, 12]},
+                        {"$toInt": {"$substrBytes": ["$_id.competencia", 5, 2]}},
+                    ]
+                },
+            }
+        },
+        {
+            "$setWindowFields": {
+                "partitionBy": "$_id.grupo",
+                "sortBy": {"mes_idx": 1},
+                "output": {
+                    "anterior": {"$push": "$valor", "window": _janela(-1, -1)},
+                    "ano_anterior": {"$push": "$valor", "window": _janela(-12, -12)},
+                    **{f"num_{n}": {"$sum": "$num", "window": _janela(-(n - 1), 0)} for n in JANELAS_MEDIA},
+                    **{f"den_{n}": {"$sum": "$den", "window": _janela(-(n - 1), 0)} for n in JANELAS_MEDIA},
+                },
+            }
+        },
+        {"$set": {"anterior": {"$first": "$anterior"}, "ano_anterior": {"$first": "$ano_anterior"}}},
+    ]
+    if from_comp:
+        pipeline.append({"$match": {"_id.competencia": {"$gte": from_comp}}})
+    pipeline += [
+        {
+            "$project": {
+                "_id": 0,
+                "periodo": "$_id.competencia",
+                "grupo": "$_id.grupo",
+                "valor": 1,
+                "valor_mes_anterior": "$anterior",
+                "valor_ano_anterior": "$ano_anterior",
+                "mom_pct": _variacao_pct("$valor", "$anterior"),
+                "yoy_pct": _variacao_pct("$valor", "$ano_anterior"),
+                **{f"media_movel_{n}": _razao(f"$num_{n}", f"$den_{n}") for n in JANELAS_MEDIA},
+            }
+        },
+        {"$sort": {"grupo": 1, "periodo": 1}},
+    ]
+
+    dados = []
+    for r in agregar(get_read_collection(tipo, group_id), pipeline):
+        item = {"periodo": r["periodo"]}
+        if dimensao:
+            item[dimensao] = r.get("grupo") if r.get("grupo") is not None else "(não informado)"
+        for k in ("valor", "valor_mes_anterior", "valor_ano_anterior", "mom_pct", "yoy_pct",
+                  *(f"media_movel_{n}" for n in JANELAS_MEDIA)):
+            item[k] = _arred(r.get(k))
+        dados.append(item)
+    return {"dados": dados, "tipo": tipo, "metrica": metrica, "campo": campo, "agrupar_por": agrupar_por}
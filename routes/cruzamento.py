@@ -0,0 +1,192 @@
+"""
+Tabela cruzada: duas (ou três) dimensões × uma medida numa única agregação, devolvida como
+matriz densa (rótulos das linhas/colunas + valores) para heatmaps. O corte top-K de cada eixo
+é feito no servidor, pelo total da medida no eixo (competência: os K meses mais recentes).
+"""
+from typing import Literal, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from services.cache import em_cache
+from services.consultas import CAMPOS_BUCKET, estagios_iniciais, estagios_resumo, soma_registros
+from services.db import get_read_collection
+from services.filtros import NAO_INFORMADO, filtro_dimensoes, filtros_dimensao
+from services.limites import agregar
+from services.perfil import RotaPerfilada
+
+router = APIRouter(prefix="/api", tags=["cruzamento"], route_class=RotaPerfilada)
+
+Dimensao = Literal["competencia", "canal", "regiao_destino", "cliente_segmento", "tipo_solvente", "certificacao_exigida"]
+DIMENSOES_EXTRATO = ("tipo_solvente", "certificacao_exigida")
+OUTROS = "(outros)"
+
+
+def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id: Optional[str]):
+    match = {}
+    if from_comp or to_comp:
+        match["competencia"] = {}
+        if from_comp:
+            match["competencia"]["$gte"] = from_comp
+        if to_comp:
+            match["competencia"]["$lte"] = to_comp
+    if group_id:
+        match["group_id"] = group_id
+    return match
+
+
+def _acumuladores(tipo: str, medida: str, resumo: bool) -> tuple[list[str], dict, Optional[dict]]:
+    """
+    (campos lidos, numerador, denominador); valor = numerador, ou numerador / denominador no NPS.
+    resumo: pipeline sobre estagios_resumo (contagem de registros por soma_registros).
+    """
+    if medida == "nps":
+        nota = "$nps_0a10"
+        numerador = {
+            "$sum": {
+                "$cond": [
+                    {"$not": [{"$isNumber": nota}]},
+                    0,
+                    {"$cond": [{"$gte": [nota, 9]}, 100, {"$cond": [{"$lte": [nota, 6]}, -100, 0]}]},
+                ]
+            }
+        }
+        return ["nps_0a10"], numerador, {"$sum": {"$cond": [{"$isNumber": nota}, 1, 0]}}
+    if medida == "registros":
+        return [], soma_registros() if resumo else {"$sum": 1}, None
+    campo = "receita" if medida == "receita" else ("quantidade_kg" if tipo == "polpa" else "quantidade_litros")
+    return [campo], {"$sum": f"${campo}"}, None
+
+
+def _top(totais: np.ndarray, rotulos: list, k: int, cronologico: bool) -> np.ndarray:
+    """Índices mantidos no eixo: maiores totais (ou os k mais recentes, na competência), na ordem de exibição."""
+    if cronologico:
+        ordem = np.argsort(np.array([str(r) for r in rotulos]), kind="stable")
+        return ordem[-k:]
+    return np.argsort(-totais, kind="stable")[:k]
+
+
+def _rotulo(v) -> str:
+    return NAO_INFORMADO if v is None else str(v)
+
+
+def _valores(num: np.ndarray, den: Optional[np.ndarray], inteiro: bool = False) -> list:
+    """Matriz (ou vetor) em listas; NPS sem respostas = None."""
+    if inteiro:
+        return np.rint(num).astype(np.int64).tolist()
+    if den is None:
+        return np.round(num, 2).tolist()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        v = np.where(den > 0, num / np.where(den > 0, den, 1), np.nan)
+    return np.vectorize(lambda x: None if np.isnan(x) else round(float(x), 2), otypes=[object])(v).tolist()
+
+
+@router.get("/cruzamento")
+@em_cache
+def get_cruzamento(
+    tipo: Literal["polpa", "extrato"] = Query(...),
+    linhas: Dimensao = Query(..., description="Dimensão das linhas"),
+    colunas: Dimensao = Query(..., description="Dimensão das colunas"),
+    camadas: Optional[Dimensao] = Query(None, description="Terceira dimensão: uma matriz por valor"),
+    medida: Literal["receita", "quantidade", "registros", "nps"] = Query("receita"),
+    top_linhas: int = Query(20, ge=1, le=200),
+    top_colunas: int = Query(20, ge=1, le=200),
+    top_camadas: int = Query(10, ge=1, le=50),
+    agrupar_outros: bool = Query(False, description="Somar o que ficou fora do top-K em '(outros)'"),
+    group_id: Optional[str] = Query(None),
+    from_comp: Optional[str] = Query(None),
+    to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
+):
+    """
+    Medida por (linha, coluna[, camada]) em matriz densa: valores[i][j] (ou valores[c][i][j]),
+    com 0 (ou null no NPS) onde não há linhas. Os totais de cada eixo e o total geral consideram
+    todos os dados do filtro, inclusive o que ficou fora do top-K.
+    """
+    eixos = [d for d in (linhas, colunas, camadas) if d]
+    if len(set(eixos)) != len(eixos):
+        raise HTTPException(status_code=400, detail={"erros": ["linhas, colunas e camadas devem ser dimensões diferentes"]})
+    if tipo == "polpa" and any(d in DIMENSOES_EXTRATO for d in eixos):
+        raise HTTPException(status_code=400, detail={"erros": [f"{', '.join(DIMENSOES_EXTRATO)} só existem no extrato"]})
+
+    match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
+    resumo = medida != "nps" and all(d in CAMPOS_BUCKET for d in eixos)
+    campos, numerador, denominador = _acumuladores(tipo, medida, resumo)
+    if resumo:
+        iniciais = estagios_resumo(tipo, match, campos)
+    else:
+        iniciais = estagios_iniciais(tipo, match, [*campos, *eixos])
+    grupo = {"num": numerador}
+    if denominador:
+        grupo["den"] = denominador
+    pipeline = [*iniciais, {"$group": {"_id": {f"d{i}": f"${d}" for i, d in enumerate(eixos)}, **grupo}}]
+    resultados = list(agregar(get_read_collection(tipo, group_id), pipeline))
+
+    # matriz densa (camada × linha × coluna) acumulada com bincount; sem camadas, uma só camada
+    dims = [camadas, linhas, colunas]
+    rotulos: list[list] = []
+    codigos: list[np.ndarray] = []
+    for dim in dims:
+        if dim is None:
+            rotulos.append([None])
+            codigos.append(np.zeros(len(resultados), dtype=np.int64))
+            continue
+        valores = [r["_id"].get(f"d{eixos.index(dim)}") for r in resultados]
+        unicos = sorted(set(valores), key=lambda v: (v is None, str(v)))
+        pos = {v: k for k, v in enumerate(unicos)}
+        rotulos.append(unicos)
+        codigos.append(np.array([pos[v] for v in valores], dtype=np.int64))
+    forma = tuple(len(r) for r in rotulos)
+    plano = np.ravel_multi_index(codigos, forma) if resultados else np.zeros(0, dtype=np.int64)
+
+    def acumular(chave: str) -> np.ndarray:
+        pesos = [float(r[chave] or 0) for r in resultados]
+        return np.bincount(plano, weights=pesos, minlength=int(np.prod(forma))).reshape(forma)
+
+    num = acumular("num")
+    den = acumular("den") if denominador else None
+    # totais de cada eixo com todos os dados, antes do corte
+    marginais = [
+        (num.sum(axis=outros), den.sum(axis=outros) if den is not None else None)
+        for outros in ((1, 2), (0, 2), (0, 1))
+    ]
+    contagem = medida == "registros"
+    total = _valores(np.array([num.sum()]), np.array([den.sum()]) if den is not None else None, contagem)[0]
+
+    def reduzir(m: np.ndarray, eixo: int, manter: np.ndarray, resto: np.ndarray) -> np.ndarray:
+        partes = [np.take(m, manter, axis=eixo)]
+        if agrupar_outros and resto.any():
+            partes.append(np.compress(resto, m, axis=eixo).sum(axis=eixo, keepdims=True))
+        return np.concatenate(partes, axis=eixo)
+
+    resposta = {"tipo": tipo, "medida": medida}
+    limites = (top_camadas, top_linhas, top_colunas)
+    for eixo, nome in ((1, "linhas"), (2, "colunas"), (0, "camadas")):
+        if dims[eixo] is None:
+            continue
+        m_num, m_den = marginais[eixo]
+        # ordem do eixo pela medida (no NPS, pelas respostas)
+        manter = _top(m_den if m_den is not None else m_num, rotulos[eixo], limites[eixo], dims[eixo] == "competencia")
+        resto = np.ones(forma[eixo], dtype=bool)
+        resto[manter] = False
+        num = reduzir(num, eixo, manter, resto)
+        den = reduzir(den, eixo, manter, resto) if den is not None else None
+        nomes = [_rotulo(rotulos[eixo][i]) for i in manter]
+        if agrupar_outros and resto.any():
+            nomes.append(OUTROS)
+        resposta[nome] = {
+            "dimensao": dims[eixo],
+            "rotulos": nomes,
+            "totais": _valores(
+                reduzir(m_num, 0, manter, resto),
+                reduzir(m_den, 0, manter, resto) if m_den is not None else None,
+                contagem,
+            ),
+            "fora_do_top": int(resto.sum()),
+        }
+    resposta["total"] = total
+    if not camadas:
+        num, den = num[0], den[0] if den is not None else None
+    resposta["valores"] = _valores(num, den, contagem)
+    return resposta
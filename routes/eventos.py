@@ -0,0 +1,75 @@
+"""
+Server-Sent Events: avisa o dashboard quando um upload termina, para recarregar só os painéis afetados.
+"""
+import asyncio
+import json
+from typing import Optional, Literal
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from config import EVENTOS_HEARTBEAT_S
+from services import eventos
+from services.perfil import RotaPerfilada
+
+router = APIRouter(prefix="/api", tags=["eventos"], route_class=RotaPerfilada)
+
+
+def _formatar(evento: dict) -> str:
+    dados = {k: v for k, v in evento.items() if k not in ("_id", "criado_em")}
+    dados["criado_em"] = evento["criado_em"].isoformat()
+    return f"id: {evento['_id']}\nevent: {evento['evento']}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+@router.get("/events")
+async def stream_eventos(
+    request: Request,
+    tipo: Optional[Literal["polpa", "extrato"]] = Query(None, description="Só eventos deste tipo"),
+    group_id: Optional[str] = Query(None, description="Só eventos deste group_id"),
+):
+    """
+    Fluxo SSE com um evento "upload" por competência importada: tipo, group_id, competencia,
+    versao (nova versão dos dados do tipo), linhas e KPIs da competência antes/depois.
+    Reconexões com Last-Event-ID recebem os eventos perdidos (enquanto estiverem na coleção capped).
+    """
+    try:
+        ultimo_id = ObjectId(request.headers["last-event-id"]) if "last-event-id" in request.headers else None
+    except InvalidId:
+        ultimo_id = None
+
+    def aceita(evento: dict) -> bool:
+        return (tipo is None or evento["tipo"] == tipo) and (group_id is None or evento.get("group_id") == group_id)
+
+    async def fluxo():
+        fila = eventos.transmissor.assinar()
+        try:
+            yield "retry: 5000\n\n"
+            # a fila já recebe os eventos ao vivo durante o replay; os repetidos são descartados pelo _id
+            repetidos: set = set()
+            if ultimo_id is not None:
+                for evento in await run_in_threadpool(eventos.desde, ultimo_id):
+                    repetidos.add(evento["_id"])
+                    if aceita(evento):
+                        yield _formatar(evento)
+            while True:
+                try:
+                    evento = await asyncio.wait_for(fila.get(), EVENTOS_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if evento["_id"] in repetidos:
+                    repetidos.discard(evento["_id"])
+                    continue
+                if aceita(evento):
+                    yield _formatar(evento)
+        finally:
+            eventos.transmissor.cancelar(fila)
+
+    return StreamingResponse(
+        fluxo(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,12 +1,24 @@
 """
 Endpoints de visão financeira: resumo, receita por tipo, série temporal, ticket médio.
 """
-from fastapi import APIRouter, Query
+import datetime
+from fastapi import APIRouter, Depends, Query
 from typing import Optional, Literal
 
-from services.db import get_collection
+from services.consultas import (
+    Granularidade,
+    chave_periodo,
+    filtro_datas,
+    estagios_periodo,
+    estagios_resumo,
+    soma_registros,
+)
+from services.db import get_read_collection
+from services.filtros import filtro_dimensoes, filtros_dimensao
+from services.limites import agregar
+from services.perfil import RotaPerfilada
 
-router = APIRouter(prefix="/api", tags=["financeiro"])
+router = APIRouter(prefix="/api", tags=["financeiro"], route_class=RotaPerfilada)
 
 
 def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id: Optional[str]):
@@ -23,11 +35,12 @@ def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id:
 
 
 @router.get("/financeiro/resumo")
-async def get_financeiro_resumo(
+def get_financeiro_resumo(
     tipo: Literal["polpa", "extrato", "todos"] = Query("todos"),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """
     Resumo financeiro do período: receita total, registros, ticket médio, quantidade.
@@ -36,14 +49,20 @@ async def get_financeiro_resumo(
     match = _filtro_periodo(from_comp, to_comp, group_id)
 
     if tipo == "todos":
-        polpa = get_collection("polpa")
-        extrato = get_collection("extrato")
-        pipe = [
-            {"$match": match} if match else {"$match": {}},
-            {"$group": {"_id": None, "receita": {"$sum": "$receita"}, "registros": {"$sum": 1}}},
+        polpa = get_read_collection("polpa", group_id)
+        extrato = get_read_collection("extrato", group_id)
+        match_p = {**match, **filtro_dimensoes("polpa", match, filtros)}
+        match_e = {**match, **filtro_dimensoes("extrato", match, filtros)}
+        pipe_p = [
+            *estagios_resumo("polpa", match_p, ["receita"]),
+            {"$group": {"_id": None, "receita": {"$sum": "$receita"}, "registros": soma_registros()}},
+        ]
+        pipe_e = [
+            *estagios_resumo("extrato", match_e, ["receita"]),
+            {"$group": {"_id": None, "receita": {"$sum": "$receita"}, "registros": soma_registros()}},
         ]
-        r_polpa = next(polpa.aggregate(pipe), None)
-        r_extrato = next(extrato.aggregate(pipe), None)
+        r_polpa = next(agregar(polpa, pipe_p), None)
+        r_extrato = next(agregar(extrato, pipe_e), None)
         receita_polpa = float(r_polpa["receita"] or 0) if r_polpa else 0
         receita_extrato = float(r_extrato["receita"] or 0) if r_extrato else 0
         receita_total = receita_polpa + receita_extrato
@@ -60,16 +79,21 @@ async def get_financeiro_resumo(
             "tipo": tipo,
         }
 
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
-        {"$group": {"_id": None, "receita": {"$sum": "$receita"}, "registros": {"$sum": 1}}},
+        *estagios_resumo(tipo, match, ["receita", campo_qtd]),
+        {
+            "$group": {
+                "_id": None,
+                "receita": {"$sum": "$receita"},
+                "registros": soma_registros(),
+                campo_qtd: {"$sum": f"${campo_qtd}"},
+            }
+        },
     ]
-    if tipo == "polpa":
-        pipeline[1]["$group"]["quantidade_kg"] = {"$sum": "$quantidade_kg"}
-    else:
-        pipeline[1]["$group"]["quantidade_litros"] = {"$sum": "$quantidade_litros"}
-    row = next(sales.aggregate(pipeline), None)
+    row = next(agregar(sales, pipeline), None)
     if not row:
         out = {
             "receita_total": 0,
@@ -103,32 +127,41 @@ async def get_financeiro_resumo(
 
 
 @router.get("/financeiro/receita-por-periodo")
-async def get_financeiro_receita_por_periodo(
+def get_financeiro_receita_por_periodo(
     tipo: Literal["polpa", "extrato", "todos"] = Query("todos"),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    granularidade: Granularidade = Query("mes", description="dia, semana ou mes"),
+    from_data: Optional[datetime.date] = Query(None, description="data_pedido inicial (YYYY-MM-DD)"),
+    to_data: Optional[datetime.date] = Query(None, description="data_pedido final, inclusiva (YYYY-MM-DD)"),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """
-    Receita por competência (mês). Se tipo=todos, retorna receita_polpa e receita_extrato por período.
+    Receita por período: mês (competência), semana ou dia (data_pedido).
+    Se tipo=todos, retorna receita_polpa e receita_extrato por período.
     """
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_datas(granularidade, from_data, to_data))
+    periodo = chave_periodo(granularidade)
 
     if tipo == "todos":
-        polpa = get_collection("polpa")
-        extrato = get_collection("extrato")
+        polpa = get_read_collection("polpa", group_id)
+        extrato = get_read_collection("extrato", group_id)
+        match_p = {**match, **filtro_dimensoes("polpa", match, filtros)}
+        match_e = {**match, **filtro_dimensoes("extrato", match, filtros)}
         pipe_p = [
-            {"$match": match} if match else {"$match": {}},
-            {"$group": {"_id": "$competencia", "receita": {"$sum": "$receita"}}},
+            *estagios_periodo("polpa", match_p, granularidade, ["receita"]),
+            {"$group": {"_id": periodo, "receita": {"$sum": "$receita"}}},
             {"$sort": {"_id": 1}},
         ]
         pipe_e = [
-            {"$match": match} if match else {"$match": {}},
-            {"$group": {"_id": "$competencia", "receita": {"$sum": "$receita"}}},
+            *estagios_periodo("extrato", match_e, granularidade, ["receita"]),
+            {"$group": {"_id": periodo, "receita": {"$sum": "$receita"}}},
             {"$sort": {"_id": 1}},
         ]
-        by_period_p = {r["_id"]: float(r["receita"] or 0) for r in polpa.aggregate(pipe_p)}
-        by_period_e = {r["_id"]: float(r["receita"] or 0) for r in extrato.aggregate(pipe_e)}
+        by_period_p = {r["_id"]: float(r["receita"] or 0) for r in agregar(polpa, pipe_p)}
+        by_period_e = {r["_id"]: float(r["receita"] or 0) for r in agregar(extrato, pipe_e)}
         periodos = sorted(set(by_period_p) | set(by_period_e))
         dados = []
         for p in periodos:
@@ -138,19 +171,17 @@ async def get_financeiro_receita_por_periodo(
                 "receita_polpa": by_period_p.get(p, 0),
                 "receita_extrato": by_period_e.get(p, 0),
             })
-        return {"dados": dados, "tipo": tipo}
+        return {"dados": dados, "tipo": tipo, "granularidade": granularidade}
 
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
-        {"$group": {"_id": "$competencia", "receita": {"$sum": "$receita"}}},
+        *estagios_periodo(tipo, match, granularidade, ["receita", campo_qtd]),
+        {"$group": {"_id": periodo, "receita": {"$sum": "$receita"}, campo_qtd: {"$sum": f"${campo_qtd}"}}},
         {"$sort": {"_id": 1}},
     ]
-    if tipo == "polpa":
-        pipeline[1]["$group"]["quantidade_kg"] = {"$sum": "$quantidade_kg"}
-    else:
-        pipeline[1]["$group"]["quantidade_litros"] = {"$sum": "$quantidade_litros"}
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     dados = []
     for r in cur:
         item = {"periodo": r["_id"], "receita": float(r["receita"] or 0)}
@@ -159,4 +190,4 @@ async def get_financeiro_receita_por_periodo(
         else:
             item["quantidade_litros"] = float(r.get("quantidade_litros") or 0)
         dados.append(item)
-    return {"dados": dados, "tipo": tipo}
+    return {"dados": dados, "tipo": tipo, "granularidade": granularidade}
@@ -1,12 +1,17 @@
 """
 Endpoints de geografia: receita e métricas por macro região do Brasil (Norte, Nordeste, Centro-Oeste, Sudeste, Sul).
 """
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Depends, Query
 from typing import Optional, Literal
 
-from services.db import get_collection
+from services.consultas import estagios_iniciais
+from services.cache import em_cache
+from services.db import get_read_collection
+from services.filtros import filtro_dimensoes, filtros_dimensao
+from services.limites import agregar
+from services.perfil import RotaPerfilada
 
-router = APIRouter(prefix="/api", tags=["geografia"])
+router = APIRouter(prefix="/api", tags=["geografia"], route_class=RotaPerfilada)
 
 # Mapeamento: regiao_destino (como vem na base) -> macro região IBGE
 REGIAO_PARA_MACRO: dict[str, str] = {
@@ -96,27 +101,34 @@ def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id:
 
 
 @router.get("/geografia/regioes")
-async def get_geografia_regioes(
+@em_cache(aquecer=True)
+def get_geografia_regioes(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """
     Retorna receita, quantidade e registros por macro região do Brasil (Norte, Nordeste, Centro-Oeste, Sudeste, Sul).
     Útil para colorir mapa e comparar regiões.
     """
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
-        {"$group": {"_id": "$regiao_destino", "receita": {"$sum": "$receita"}, "count": {"$sum": 1}}},
+        *estagios_iniciais(tipo, match, ["regiao_destino", "receita", campo_qtd]),
+        {
+            "$group": {
+                "_id": "$regiao_destino",
+                "receita": {"$sum": "$receita"},
+                "count": {"$sum": 1},
+                campo_qtd: {"$sum": f"${campo_qtd}"},
+            }
+        },
     ]
-    if tipo == "polpa":
-        pipeline[1]["$group"]["quantidade_kg"] = {"$sum": "$quantidade_kg"}
-    else:
-        pipeline[1]["$group"]["quantidade_litros"] = {"$sum": "$quantidade_litros"}
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
 
     # Agrupar por macro região
     macro_totals: dict[str, dict] = {}
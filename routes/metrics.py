@@ -1,12 +1,32 @@
 """
 Endpoints de leitura para o dashboard: métricas por tipo (polpa ou extrato).
 """
-from fastapi import APIRouter, Query
+import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Optional, Literal
 
-from services.db import get_collection, get_uploads_log_collection
+from services.consultas import (
+    Granularidade,
+    chave_periodo,
+    filtro_datas,
+    estagios_iniciais,
+    estagios_periodo,
+    estagios_resumo,
+    soma_registros,
+)
+from services.cache import em_cache
+from services.db import (
+    get_anomalias_collection,
+    get_read_collection,
+    get_uploads_log_arquivo_collection,
+    get_uploads_log_collection,
+)
+from services.filtros import filtro_dimensoes, filtros_dimensao
+from services.historico import ORDEM, codificar_cursor, filtro_cursor, filtro_historico
+from services.limites import agregar, buscar
+from services.perfil import RotaPerfilada
 
-router = APIRouter(prefix="/api", tags=["metrics"])
+router = APIRouter(prefix="/api", tags=["metrics"], route_class=RotaPerfilada)
 
 
 def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id: Optional[str]):
@@ -23,30 +43,31 @@ def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id:
 
 
 @router.get("/metrics")
-async def get_metrics(
+@em_cache(aquecer=True)
+def get_metrics(
     tipo: Literal["polpa", "extrato"] = Query(..., description="polpa ou extrato"),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """KPIs agregados no período (receita total, quantidade, registros)."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_resumo(tipo, match, ["receita", campo_qtd]),
         {
             "$group": {
                 "_id": None,
                 "receita_total": {"$sum": "$receita"},
-                "registros": {"$sum": 1},
+                "registros": soma_registros(),
+                campo_qtd: {"$sum": f"${campo_qtd}"},
             }
         },
     ]
-    if tipo == "polpa":
-        pipeline[1]["$group"]["quantidade_kg"] = {"$sum": "$quantidade_kg"}
-    else:
-        pipeline[1]["$group"]["quantidade_litros"] = {"$sum": "$quantidade_litros"}
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     row = next(cur, None)
     if not row:
         out = {"receita_total": 0, "registros": 0, "from": from_comp, "to": to_comp, "tipo": tipo}
@@ -70,25 +91,35 @@ async def get_metrics(
 
 
 @router.get("/timeseries/revenue")
-async def get_timeseries_revenue(
+@em_cache(aquecer=True)
+def get_timeseries_revenue(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    granularidade: Granularidade = Query("mes", description="dia, semana ou mes"),
+    from_data: Optional[datetime.date] = Query(None, description="data_pedido inicial (YYYY-MM-DD)"),
+    to_data: Optional[datetime.date] = Query(None, description="data_pedido final, inclusiva (YYYY-MM-DD)"),
+    filtros: dict = Depends(filtros_dimensao),
 ):
-    """Receita por mês (competência) para gráfico de linha."""
-    sales = get_collection(tipo)
+    """Receita por período para gráfico de linha: mês (competência), semana ou dia (data_pedido)."""
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_datas(granularidade, from_data, to_data))
+    match.update(filtro_dimensoes(tipo, match, filtros))
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
-        {"$group": {"_id": "$competencia", "receita": {"$sum": "$receita"}}},
+        *estagios_periodo(tipo, match, granularidade, ["receita", campo_qtd]),
+        {
+            "$group": {
+                "_id": chave_periodo(granularidade),
+                "receita": {"$sum": "$receita"},
+                campo_qtd: {"$sum": f"${campo_qtd}"},
+            }
+        },
         {"$sort": {"_id": 1}},
     ]
-    if tipo == "polpa":
-        pipeline[1]["$group"]["quantidade_kg"] = {"$sum": "$quantidade_kg"}
-    else:
-        pipeline[1]["$group"]["quantidade_litros"] = {"$sum": "$quantidade_litros"}
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     dados = []
     for r in cur:
         item = {"periodo": r["_id"], "receita": float(r["receita"] or 0)}
@@ -97,94 +128,166 @@ async def get_timeseries_revenue(
         else:
             item["quantidade_litros"] = float(r.get("quantidade_litros") or 0)
         dados.append(item)
-    return {"dados": dados, "tipo": tipo}
+    return {"dados": dados, "tipo": tipo, "granularidade": granularidade}
 
 
 @router.get("/top-canais")
-async def get_top_canais(
+@em_cache(aquecer=True)
+def get_top_canais(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
     limit: int = Query(10, ge=1, le=50),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Ranking de canais por receita."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_resumo(tipo, match, ["receita"]),
         {"$group": {"_id": "$canal", "receita": {"$sum": "$receita"}}},
         {"$sort": {"receita": -1}},
         {"$limit": limit},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     canais = [{"canal": r["_id"], "receita": float(r["receita"] or 0)} for r in cur]
     return {"canais": canais, "tipo": tipo}
 
 
 @router.get("/top-regioes")
-async def get_top_regioes(
+@em_cache(aquecer=True)
+def get_top_regioes(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
     limit: int = Query(10, ge=1, le=50),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Ranking de regiões por receita."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais(tipo, match, ["regiao_destino", "receita"]),
         {"$group": {"_id": "$regiao_destino", "receita": {"$sum": "$receita"}}},
         {"$sort": {"receita": -1}},
         {"$limit": limit},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     regioes = [{"regiao": r["_id"], "receita": float(r["receita"] or 0)} for r in cur]
     return {"regioes": regioes, "tipo": tipo}
 
 
 @router.get("/periods")
-async def get_periods(
+@em_cache(aquecer=True)
+def get_periods(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Lista competências disponíveis para o tipo."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = {"group_id": group_id} if group_id else {}
+    match.update(filtro_dimensoes(tipo, match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_resumo(tipo, match),
         {"$group": {"_id": "$competencia"}},
         {"$sort": {"_id": -1}},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     periodos = [r["_id"] for r in cur]
     return {"periodos": periodos, "tipo": tipo}
 
 
 @router.get("/uploads")
-async def get_uploads_history(
+def get_uploads_history(
     tipo: Optional[Literal["polpa", "extrato"]] = Query(None, description="Filtrar por tipo"),
     group_id: Optional[str] = Query(None),
+    from_comp: Optional[str] = Query(None, description="Competência inicial (YYYY-MM)"),
+    to_comp: Optional[str] = Query(None, description="Competência final (YYYY-MM)"),
+    source_file: Optional[str] = Query(None, description="Nome exato do arquivo enviado"),
+    sheet_name: Optional[str] = Query(None, description="Nome exato da aba (upload de todas as abas)"),
+    cursor: Optional[str] = Query(None, description="Valor de 'proximo' da página anterior"),
     limit: int = Query(50, ge=1, le=200),
 ):
-    """Histórico de uploads (competência, tipo, data, linhas importadas)."""
+    """
+    Histórico de uploads, do mais recente para o mais antigo (competência, tipo, data, linhas,
+    tempos por etapa). Paginado por cursor: passe o 'proximo' da resposta para a página seguinte.
+    """
     uploads = get_uploads_log_collection()
-    match = {}
-    if tipo:
-        match["tipo"] = tipo
-    if group_id:
-        match["group_id"] = group_id
-    cursor = uploads.find(match).sort("uploaded_at", -1).limit(limit)
+    match = filtro_historico(tipo, group_id, from_comp, to_comp, source_file, sheet_name)
+    if cursor:
+        try:
+            match = {"$and": [match, filtro_cursor(cursor)]}
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail={"erros": [str(e)]})
+    # um a mais para saber se existe próxima página
+    docs = list(buscar(uploads, match).sort(ORDEM).limit(limit + 1))
     lista = []
-    for doc in cursor:
+    for doc in docs[:limit]:
         lista.append({
             "competencia": doc.get("competencia"),
             "tipo": doc.get("tipo"),
             "group_id": doc.get("group_id"),
             "source_file": doc.get("source_file"),
+            "sheet_name": doc.get("sheet_name"),
             "uploaded_at": doc.get("uploaded_at").isoformat() if doc.get("uploaded_at") else None,
             "linhas_importadas": doc.get("linhas_importadas", 0),
             "linhas_substituidas": doc.get("linhas_substituidas", 0),
+            "linhas_com_erro": doc.get("linhas_com_erro", 0),
+            "etapas_ms": doc.get("etapas_ms"),
+            "escrita": doc.get("escrita"),
+            "anomalias": doc.get("anomalias"),
+        })
+    proximo = codificar_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return {"uploads": lista, "proximo": proximo}
+
+
+@router.get("/uploads/arquivo")
+def get_uploads_arquivo(
+    tipo: Optional[Literal["polpa", "extrato"]] = Query(None, description="Filtrar por tipo"),
+    group_id: Optional[str] = Query(None),
+    from_comp: Optional[str] = Query(None),
+    to_comp: Optional[str] = Query(None),
+):
+    """Resumo dos uploads já retirados do histórico (retenção), por tipo/group_id/competência."""
+    filtro = {f"_id.{k}": v for k, v in filtro_historico(tipo, group_id, from_comp, to_comp).items()}
+    lista = []
+    for doc in buscar(get_uploads_log_arquivo_collection(), filtro).sort("_id.competencia", -1):
+        lista.append({
+            **doc["_id"],
+            "uploads": doc.get("uploads", 0),
+            "primeiro_upload": doc["primeiro_upload"].isoformat() if doc.get("primeiro_upload") else None,
+            "ultimo_upload": doc["ultimo_upload"].isoformat() if doc.get("ultimo_upload") else None,
+            "linhas_importadas": doc.get("linhas_importadas", 0),
+            "linhas_com_erro": doc.get("linhas_com_erro", 0),
+            "arquivos": doc.get("arquivos", []),
+        })
+    return {"arquivo": lista}
+
+
+@router.get("/anomalias")
+def get_anomalias(
+    tipo: Optional[Literal["polpa", "extrato"]] = Query(None, description="Filtrar por tipo"),
+    group_id: Optional[str] = Query(None),
+    from_comp: Optional[str] = Query(None),
+    to_comp: Optional[str] = Query(None),
+    todas: bool = Query(False, description="Incluir competências verificadas sem anomalias"),
+):
+    """
+    Anomalias detectadas no último upload de cada competência (desvio em relação ao histórico,
+    valores da dimensão ausentes ou novos), da competência mais recente para a mais antiga.
+    """
+    filtro = filtro_historico(tipo, group_id, from_comp, to_comp)
+    if not todas:
+        filtro["anomalias.0"] = {"$exists": True}
+    lista = []
+    for doc in buscar(get_anomalias_collection(), filtro, {"_id": 0}).sort([("competencia", -1), ("tipo", 1)]):
+        lista.append({
+            **doc,
+            "detectado_em": doc["detectado_em"].isoformat() if doc.get("detectado_em") else None,
         })
-    return {"uploads": lista}
+    return {"competencias": lista}
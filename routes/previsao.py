@@ -0,0 +1,163 @@
+"""
+Previsão de receita e quantidade para os próximos meses (total, por canal ou por segmento),
+a partir da série mensal agregada no banco (mesmo agrupamento de /comparativo).
+"""
+import json
+import math
+from typing import Literal, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, Query
+
+from services.consultas import estagios_iniciais, estagios_resumo
+from services.db import get_read_collection
+from services.eventos import versao_atual
+from services.filtros import filtro_dimensoes, filtros_dimensao
+from services.limites import agregar
+from services.perfil import RotaPerfilada
+from services.previsao import ajustar, modelo_em_cache, prever
+
+router = APIRouter(prefix="/api", tags=["previsao"], route_class=RotaPerfilada)
+
+METRICAS = ("receita", "quantidade")
+
+
+def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id: Optional[str]):
+    match = {}
+    if from_comp or to_comp:
+        match["competencia"] = {}
+        if from_comp:
+            match["competencia"]["$gte"] = from_comp
+        if to_comp:
+            match["competencia"]["$lte"] = to_comp
+    if group_id:
+        match["group_id"] = group_id
+    return match
+
+
+def _somar_meses(competencia: str, meses: int) -> str:
+    ano, mes = map(int, competencia.split("-"))
+    total = ano * 12 + mes - 1 + meses
+    return f"{total // 12:04d}-{total % 12 + 1:02d}"
+
+
+def _arred(v) -> Optional[float]:
+    return None if v is None or math.isnan(v) else round(float(v), 2)
+
+
+def _serie_mensal(
+    tipo: str,
+    group_id: Optional[str],
+    agrupar_por: str,
+    from_comp: Optional[str],
+    to_comp: Optional[str],
+    filtros: dict,
+) -> tuple[list[str], list, np.ndarray]:
+    """
+    (meses, grupos, y): receita e quantidade por competência e grupo, em meses consecutivos
+    (meses sem venda = 0). y tem uma linha por grupo e métrica (receita, quantidade).
+    """
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
+    match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
+    dimensao = None if agrupar_por == "total" else agrupar_por
+    if dimensao in (None, "canal"):
+        iniciais = estagios_resumo(tipo, match, ["receita", campo_qtd])
+    else:
+        iniciais = estagios_iniciais(tipo, match, ["receita", campo_qtd, dimensao])
+    pipeline = [
+        *iniciais,
+        {
+            "$group": {
+                "_id": {"competencia": "$competencia", "grupo": f"${dimensao}" if dimensao else None},
+                "receita": {"$sum": "$receita"},
+                "quantidade": {"$sum": f"${campo_qtd}"},
+            }
+        },
+    ]
+    linhas = [r for r in agregar(get_read_collection(tipo, group_id), pipeline) if r["_id"].get("competencia")]
+    if not linhas:
+        return [], [], np.zeros((0, 0))
+
+    competencias = sorted({r["_id"]["competencia"] for r in linhas})
+    meses = [competencias[0]]
+    while meses[-1] < competencias[-1]:
+        meses.append(_somar_meses(meses[-1], 1))
+    grupos = sorted({r["_id"].get("grupo") for r in linhas}, key=lambda g: (g is None, str(g)))
+    pos_mes = {c: i for i, c in enumerate(meses)}
+    pos_grupo = {g: i for i, g in enumerate(grupos)}
+    y = np.zeros((len(grupos) * len(METRICAS), len(meses)))
+    for r in linhas:
+        linha = pos_grupo[r["_id"].get("grupo")] * len(METRICAS)
+        coluna = pos_mes[r["_id"]["competencia"]]
+        for k, metrica in enumerate(METRICAS):
+            y[linha + k, coluna] = float(r[metrica] or 0)
+    return meses, grupos, y
+
+
+@router.get("/previsao")
+def get_previsao(
+    tipo: Literal["polpa", "extrato"] = Query(...),
+    agrupar_por: Literal["total", "canal", "cliente_segmento"] = Query("total"),
+    horizonte: int = Query(3, ge=1, le=12, description="Meses à frente (padrão: próximo trimestre)"),
+    nivel: float = Query(0.8, gt=0, lt=1, description="Nível de confiança dos intervalos (ex.: 0.8, 0.95)"),
+    group_id: Optional[str] = Query(None),
+    from_comp: Optional[str] = Query(None, description="Início do histórico usado no ajuste"),
+    to_comp: Optional[str] = Query(None, description="Fim do histórico usado no ajuste"),
+    filtros: dict = Depends(filtros_dimensao),
+):
+    """
+    Receita e quantidade previstas para os próximos `horizonte` meses após o último mês com dado,
+    com intervalo de confiança, por grupo. Modelo por série: Holt ou Holt-Winters (ver services.previsao).
+    O ajuste é reaproveitado até o próximo upload do tipo.
+    """
+    chave = (
+        tipo, group_id, agrupar_por, from_comp, to_comp,
+        json.dumps(filtros, sort_keys=True, default=str), versao_atual(tipo),
+    )
+
+    def ajustar_modelo():
+        meses, grupos, y = _serie_mensal(tipo, group_id, agrupar_por, from_comp, to_comp, filtros)
+        return {"meses": meses, "grupos": grupos, "ajuste": ajustar(y) if meses else None}
+
+    modelo = modelo_em_cache(chave, ajustar_modelo)
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
+    resposta = {
+        "tipo": tipo,
+        "agrupar_por": agrupar_por,
+        "campo_quantidade": campo_qtd,
+        "horizonte": horizonte,
+        "nivel": nivel,
+        "historico": None,
+        "series": [],
+    }
+    meses = modelo["meses"]
+    if not meses:
+        return resposta
+
+    ajuste = modelo["ajuste"]
+    p = prever(ajuste, horizonte, nivel)
+    periodos = [_somar_meses(meses[-1], h) for h in range(1, horizonte + 1)]
+    resposta["historico"] = {"de": meses[0], "ate": meses[-1], "meses": len(meses)}
+    for i, grupo in enumerate(modelo["grupos"]):
+        item = {} if agrupar_por == "total" else {agrupar_por: grupo if grupo is not None else "(não informado)"}
+        for k, metrica in enumerate(METRICAS):
+            s = i * len(METRICAS) + k
+            serie = {
+                "modelo": str(ajuste["modelo"][s]),
+                "previsao": [
+                    {
+                        "periodo": periodo,
+                        "valor": _arred(p["valor"][s, h]),
+                        "inferior": _arred(p["inferior"][s, h]),
+                        "superior": _arred(p["superior"][s, h]),
+                    }
+                    for h, periodo in enumerate(periodos)
+                ],
+                "total_horizonte": _arred(p["valor"][s].sum()),
+            }
+            if "alfa" in ajuste:
+                serie["parametros"] = {k: round(float(ajuste[k][s]), 3) for k in ("alfa", "beta", "gama")}
+            item[metrica] = serie
+        resposta["series"].append(item)
+    return resposta
@@ -1,12 +1,22 @@
 """
 Endpoints de qualidade e NPS: índices e satisfação por período/canal.
+NPS real e distribuições (percentis, histogramas) vêm dos sketches gravados no upload.
 """
-from fastapi import APIRouter, Query
+import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Optional, Literal
 
-from services.db import get_collection
+from services.consultas import Granularidade, chave_periodo, filtro_datas, estagios_iniciais
+from services.cache import em_cache
+from services.db import get_read_collection
+from services.filtros import filtro_dimensoes, filtros_dimensao
+from services.limites import agregar
+from services.perfil import RotaPerfilada
+from services.sketches import HISTOGRAMAS, faixas, mesclar, nps, percentis
 
-router = APIRouter(prefix="/api", tags=["qualidade"])
+router = APIRouter(prefix="/api", tags=["qualidade"], route_class=RotaPerfilada)
+
+AgruparPor = Literal["total", "periodo", "canal", "cliente_segmento", "regiao_destino"]
 
 
 def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id: Optional[str]):
@@ -23,45 +33,53 @@ def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id:
 
 
 @router.get("/qualidade/nps-por-periodo")
-async def get_nps_por_periodo(
+def get_nps_por_periodo(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    granularidade: Granularidade = Query("mes", description="dia, semana ou mes"),
+    from_data: Optional[datetime.date] = Query(None, description="data_pedido inicial (YYYY-MM-DD)"),
+    to_data: Optional[datetime.date] = Query(None, description="data_pedido final, inclusiva (YYYY-MM-DD)"),
+    filtros: dict = Depends(filtros_dimensao),
 ):
-    """NPS médio por competência (mês)."""
-    sales = get_collection(tipo)
+    """NPS médio por período: mês (competência), semana ou dia (data_pedido)."""
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_datas(granularidade, from_data, to_data))
+    match.update(filtro_dimensoes(tipo, match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais(tipo, match, ["data_pedido", "nps_0a10"]),
         {"$match": {"nps_0a10": {"$ne": None, "$exists": True}}},
-        {"$group": {"_id": "$competencia", "nps_medio": {"$avg": "$nps_0a10"}, "registros": {"$sum": 1}}},
+        {"$group": {"_id": chave_periodo(granularidade), "nps_medio": {"$avg": "$nps_0a10"}, "registros": {"$sum": 1}}},
         {"$sort": {"_id": 1}},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     dados = [{"periodo": r["_id"], "nps_medio": round(float(r["nps_medio"] or 0), 2), "registros": r["registros"]} for r in cur]
-    return {"dados": dados, "tipo": tipo}
+    return {"dados": dados, "tipo": tipo, "granularidade": granularidade}
 
 
 @router.get("/qualidade/nps-por-canal")
-async def get_nps_por_canal(
+def get_nps_por_canal(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
     limit: int = Query(10, ge=1, le=20),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """NPS médio por canal (ranking por receita)."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais(tipo, match, ["nps_0a10", "receita"]),
         {"$match": {"nps_0a10": {"$ne": None, "$exists": True}}},
         {"$group": {"_id": "$canal", "nps_medio": {"$avg": "$nps_0a10"}, "receita": {"$sum": "$receita"}, "registros": {"$sum": 1}}},
         {"$sort": {"receita": -1}},
         {"$limit": limit},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     canais = [
         {"canal": r["_id"] or "(não informado)", "nps_medio": round(float(r["nps_medio"] or 0), 2), "receita": float(r["receita"] or 0), "registros": r["registros"]}
         for r in cur
@@ -70,19 +88,21 @@ async def get_nps_por_canal(
 
 
 @router.get("/qualidade/indices-por-periodo")
-async def get_indices_por_periodo(
+def get_indices_por_periodo(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Índices de qualidade médios por competência. Polpa: qualidade 1-10, perda %. Extrato: cor 1-10, pureza 1-10."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
 
     if tipo == "polpa":
         pipeline = [
-            {"$match": match} if match else {"$match": {}},
+            *estagios_iniciais(tipo, match, ["indice_qualidade_1a10", "perda_processamento_pct"]),
             {
                 "$group": {
                     "_id": "$competencia",
@@ -93,7 +113,7 @@ async def get_indices_por_periodo(
             },
             {"$sort": {"_id": 1}},
         ]
-        cur = sales.aggregate(pipeline)
+        cur = agregar(sales, pipeline)
         dados = []
         for r in cur:
             dados.append({
@@ -105,7 +125,7 @@ async def get_indices_por_periodo(
         return {"dados": dados, "tipo": tipo}
 
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais(tipo, match, ["indice_cor_1a10", "indice_pureza_1a10"]),
         {
             "$group": {
                 "_id": "$competencia",
@@ -116,7 +136,7 @@ async def get_indices_por_periodo(
         },
         {"$sort": {"_id": 1}},
     ]
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     dados = []
     for r in cur:
         dados.append({
@@ -126,3 +146,63 @@ async def get_indices_por_periodo(
             "registros": r["registros"],
         })
     return {"dados": dados, "tipo": tipo}
+
+
+def _mesclar_sketches(tipo: str, campo: str, agrupar_por: str, match: dict) -> list[tuple]:
+    """Histogramas somados por grupo, ordenados (período crescente ou maior volume primeiro)."""
+    dimensao = "total" if agrupar_por in ("total", "periodo") else agrupar_por
+    grupos = mesclar(tipo, campo, dimensao, agrupar_por == "periodo", match)
+    if agrupar_por == "periodo":
+        return sorted(grupos.items(), key=lambda kv: kv[0])
+    return sorted(grupos.items(), key=lambda kv: -kv[1]["n"])
+
+
+@router.get("/qualidade/nps")
+@em_cache(aquecer=True)
+def get_nps_real(
+    tipo: Literal["polpa", "extrato"] = Query(...),
+    group_id: Optional[str] = Query(None),
+    from_comp: Optional[str] = Query(None),
+    to_comp: Optional[str] = Query(None),
+    agrupar_por: AgruparPor = Query("periodo"),
+):
+    """NPS real (% promotores 9-10 − % detratores 0-6) por período, dimensão ou total, a partir dos sketches."""
+    match = _filtro_periodo(from_comp, to_comp, group_id)
+    dados = []
+    for chave, h in _mesclar_sketches(tipo, "nps_0a10", agrupar_por, match):
+        item = {} if agrupar_por == "total" else {agrupar_por: chave if chave is not None else "(não informado)"}
+        item.update(nps(h["contagens"]))
+        dados.append(item)
+    return {"dados": dados, "tipo": tipo, "agrupar_por": agrupar_por}
+
+
+@router.get("/qualidade/distribuicao")
+def get_distribuicao(
+    tipo: Literal["polpa", "extrato"] = Query(...),
+    campo: Literal[tuple(HISTOGRAMAS)] = Query(..., description="nps_0a10 ou índice de qualidade"),
+    group_id: Optional[str] = Query(None),
+    from_comp: Optional[str] = Query(None),
+    to_comp: Optional[str] = Query(None),
+    agrupar_por: AgruparPor = Query("total"),
+    percentis_: str = Query("50,90", alias="percentis", description="Ex.: 25,50,75,90"),
+    histograma: bool = Query(False, description="Incluir contagens por faixa"),
+):
+    """Média, percentis e (opcional) histograma de um campo de qualidade, a partir dos sketches."""
+    try:
+        ps = [float(p) for p in percentis_.split(",") if p.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail={"erros": ["percentis deve ser lista de números, ex.: 50,90"]})
+    if any(p < 0 or p > 100 for p in ps):
+        raise HTTPException(status_code=400, detail={"erros": ["percentis devem estar entre 0 e 100"]})
+
+    match = _filtro_periodo(from_comp, to_comp, group_id)
+    dados = []
+    for chave, h in _mesclar_sketches(tipo, campo, agrupar_por, match):
+        item = {} if agrupar_por == "total" else {agrupar_por: chave if chave is not None else "(não informado)"}
+        item["registros"] = h["n"]
+        item["media"] = round(h["soma"] / h["n"], 3) if h["n"] else None
+        item.update(percentis(campo, h["contagens"], ps))
+        if histograma:
+            item["histograma"] = {"faixas": faixas(campo), "contagens": h["contagens"].tolist()}
+        dados.append(item)
+    return {"dados": dados, "tipo": tipo, "campo": campo, "agrupar_por": agrupar_por}
@@ -1,13 +1,18 @@
 """
 Endpoints de análise por segmento de cliente (cliente_segmento).
 """
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Depends, Query
 from typing import Optional, Literal
 from collections import defaultdict
 
-from services.db import get_collection
+from services.consultas import estagios_iniciais
+from services.cache import em_cache
+from services.db import get_read_collection
+from services.filtros import filtro_dimensoes, filtros_dimensao
+from services.limites import agregar
+from services.perfil import RotaPerfilada
 
-router = APIRouter(prefix="/api", tags=["segmentos"])
+router = APIRouter(prefix="/api", tags=["segmentos"], route_class=RotaPerfilada)
 
 
 def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id: Optional[str]):
@@ -24,27 +29,34 @@ def _filtro_periodo(from_comp: Optional[str], to_comp: Optional[str], group_id:
 
 
 @router.get("/segmentos/ranking")
-async def get_segmentos_ranking(
+@em_cache(aquecer=True)
+def get_segmentos_ranking(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
     limit: int = Query(15, ge=1, le=50),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Ranking de segmentos de cliente por receita e registros."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
     pipeline = [
-        {"$match": match} if match else {"$match": {}},
-        {"$group": {"_id": "$cliente_segmento", "receita": {"$sum": "$receita"}, "registros": {"$sum": 1}}},
+        *estagios_iniciais(tipo, match, ["cliente_segmento", "receita", campo_qtd]),
+        {
+            "$group": {
+                "_id": "$cliente_segmento",
+                "receita": {"$sum": "$receita"},
+                "registros": {"$sum": 1},
+                campo_qtd: {"$sum": f"${campo_qtd}"},
+            }
+        },
         {"$sort": {"receita": -1}},
         {"$limit": limit},
     ]
-    if tipo == "polpa":
-        pipeline[1]["$group"]["quantidade_kg"] = {"$sum": "$quantidade_kg"}
-    else:
-        pipeline[1]["$group"]["quantidade_litros"] = {"$sum": "$quantidade_litros"}
-    cur = sales.aggregate(pipeline)
+    cur = agregar(sales, pipeline)
     segmentos = []
     for r in cur:
         item = {
@@ -61,34 +73,36 @@ async def get_segmentos_ranking(
 
 
 @router.get("/segmentos/receita-por-mes")
-async def get_segmentos_receita_por_mes(
+def get_segmentos_receita_por_mes(
     tipo: Literal["polpa", "extrato"] = Query(...),
     group_id: Optional[str] = Query(None),
     from_comp: Optional[str] = Query(None),
     to_comp: Optional[str] = Query(None),
     limit_segmentos: int = Query(5, ge=1, le=10),
+    filtros: dict = Depends(filtros_dimensao),
 ):
     """Receita por competência para os top N segmentos."""
-    sales = get_collection(tipo)
+    sales = get_read_collection(tipo, group_id)
     match = _filtro_periodo(from_comp, to_comp, group_id)
+    match.update(filtro_dimensoes(tipo, match, filtros))
 
     pipe_top = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais(tipo, match, ["cliente_segmento", "receita"]),
         {"$group": {"_id": "$cliente_segmento", "receita": {"$sum": "$receita"}}},
         {"$sort": {"receita": -1}},
         {"$limit": limit_segmentos},
     ]
-    top_segmentos = [r["_id"] or "(não informado)" for r in sales.aggregate(pipe_top)]
+    top_segmentos = [r["_id"] or "(não informado)" for r in agregar(sales, pipe_top)]
     if not top_segmentos:
         return {"segmentos": [], "tipo": tipo}
 
     pipe_ts = [
-        {"$match": match} if match else {"$match": {}},
+        *estagios_iniciais(tipo, match, ["cliente_segmento", "receita"]),
         {"$match": {"cliente_segmento": {"$in": top_segmentos}}},
         {"$group": {"_id": {"competencia": "$competencia", "segmento": "$cliente_segmento"}, "receita": {"$sum": "$receita"}}},
     ]
     by_segmento = defaultdict(list)
-    for r in sales.aggregate(pipe_ts):
+    for r in agregar(sales, pipe_ts):
         comp = r["_id"]["competencia"]
         seg = r["_id"]["segmento"] or "(não informado)"
         by_segmento[seg].append({"periodo": comp, "receita": float(r["receita"] or 0)})
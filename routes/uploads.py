@@ -1,77 +1,165 @@
 """
 Endpoint de upload de planilha Excel: polpa ou extrato.
+
+A stack de ingestão (services.excel_service/ingestao, com pandas e openpyxl) só é importada no
+primeiro upload: workers que só servem leituras não pagam esse tempo de subida nem a memória.
+
+Cada upload passa pela admissão (services.admissao): fila limitada por worker, 429 quando cheia, e
+o processamento roda no executor da ingestão, sem ocupar o event loop nem o threadpool das leituras.
 """
 import datetime
-from fastapi import APIRouter, File, Form, UploadFile, HTTPException
+import time
+from fastapi import APIRouter, BackgroundTasks, File, Form, UploadFile, HTTPException
 from typing import Optional, Literal
 
-from services.db import get_collection, get_uploads_log_collection
-from services.excel_service import (
-    validar_arquivo,
-    validar_colunas,
-    ler_excel,
-    ler_excel_todas_abas,
-    limpar_e_normalizar,
-    dataframe_para_documentos,
-)
-router = APIRouter(prefix="/api", tags=["uploads"])
+from config import DRY_RUN_MAX_LINHAS
+from services import admissao, bitmaps
+from services.armazenamento import totais_competencia
+from services.cache import aquecer
+from services.db import get_uploads_log_collection
+from services.eventos import publicar_upload
+from services.perfil import RotaPerfilada, registrar_etapas
+
+router = APIRouter(prefix="/api", tags=["uploads"], route_class=RotaPerfilada)
+
+
+def _fila_cheia(e: admissao.FilaCheia) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail={
+            "erros": [f"Fila de uploads cheia. Tente novamente em {e.retry_apos_s} s."],
+            "retry_apos_s": e.retry_apos_s,
+            "fila": admissao.estado(),
+        },
+        headers={"Retry-After": str(e.retry_apos_s)},
+    )
 
 
 def montar_competencia(year: int, month: int) -> str:
     return f"{year:04d}-{month:02d}"
 
 
+def _ms_desde(inicio: float) -> float:
+    return round((time.perf_counter() - inicio) * 1000, 1)
+
+
+def _previa(
+    df, tipo: str, competencia: str, group_id: Optional[str], linhas_totais: Optional[int], linhas_lidas: int
+) -> dict:
+    """
+    Estatísticas da planilha + o que está gravado hoje para a competência e a diferença.
+    linhas_totais só é informado quando a leitura parou em DRY_RUN_MAX_LINHAS (amostra).
+    """
+    from services.excel_service import estatisticas_previa
+
+    novo = estatisticas_previa(df, tipo, linhas_totais, linhas_lidas)
+    atual = totais_competencia(tipo, competencia, group_id)
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
+    return {
+        **novo,
+        "atual": atual,
+        "delta": {
+            "registros": novo["linhas_estimadas"] - atual["registros"],
+            "receita_total": round(novo["receita_total"] - atual["receita_total"], 2),
+            campo_qtd: round(novo[campo_qtd] - atual[campo_qtd], 2),
+        },
+    }
+
+
 @router.post("/uploads")
 async def upload_planilha(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     month: int = Form(..., ge=1, le=12),
     year: int = Form(..., ge=2000, le=2100),
     tipo: Literal["polpa", "extrato"] = Form(..., description="Tipo da planilha: polpa ou extrato"),
     group_id: Optional[str] = Form(None),
+    dry_run: bool = Form(False, description="Só valida e devolve a prévia, sem gravar"),
 ):
     """
     Recebe planilha Excel (polpa ou extrato), mês e ano.
     Regra: se já existir dados para essa competência + tipo (e group_id), substitui.
+    Com dry_run=true nada é gravado: retorna contagens, receita, % de nulos por coluna e a diferença
+    para o que está gravado (planilhas grandes são avaliadas por amostra das primeiras DRY_RUN_MAX_LINHAS linhas).
+    Com a fila de uploads do worker cheia responde 429 (Retry-After).
     """
-    content = await file.read()
-    filename = file.filename or "arquivo.xlsx"
+    try:
+        async with admissao.admitir() as fila_ms:
+            content = await file.read()
+            return await admissao.executar(
+                _processar_planilha,
+                background_tasks,
+                content,
+                file.filename or "arquivo.xlsx",
+                tipo,
+                montar_competencia(year, month),
+                group_id,
+                dry_run,
+                fila_ms,
+            )
+    except admissao.FilaCheia as e:
+        raise _fila_cheia(e)
+
+
+def _processar_planilha(
+    background_tasks: BackgroundTasks,
+    content: bytes,
+    filename: str,
+    tipo: str,
+    competencia: str,
+    group_id: Optional[str],
+    dry_run: bool,
+    fila_ms: float,
+) -> dict:
+    from services.excel_service import validar_arquivo, ler_excel, validar_colunas, limpar_e_validar, contar_linhas_abas
+    from services.ingestao import importar_competencia
 
     erros = validar_arquivo(filename, content)
     if erros:
         raise HTTPException(status_code=400, detail={"erros": erros})
 
-    df, erros_leitura = ler_excel(content, filename)
+    inicio = time.perf_counter()
+    df, erros_leitura = ler_excel(content, filename, DRY_RUN_MAX_LINHAS if dry_run else None)
+    leitura_ms = _ms_desde(inicio)
     if df is None or erros_leitura:
         raise HTTPException(
             status_code=400,
             detail={"erros": erros_leitura or ["Falha ao ler planilha."]},
         )
+    linhas_lidas = len(df)
 
+    inicio = time.perf_counter()
     erros_colunas = validar_colunas(df, tipo)
     if erros_colunas:
         raise HTTPException(status_code=400, detail={"erros": erros_colunas})
 
-    df = limpar_e_normalizar(df, tipo)
+    df, erros_linhas = limpar_e_validar(df, tipo)
+    validacao_ms = _ms_desde(inicio)
     if df.empty:
         raise HTTPException(
             status_code=400,
-            detail={"erros": ["Nenhum dado válido após limpeza."]},
+            detail={"erros": ["Nenhum dado válido após limpeza."], "erros_linhas": erros_linhas},
         )
 
-    competencia = montar_competencia(year, month)
-    collection = get_collection(tipo)
-    uploads_log = get_uploads_log_collection()
+    if dry_run:
+        linhas_totais = None
+        if linhas_lidas >= DRY_RUN_MAX_LINHAS:
+            linhas_totais = next(iter(contar_linhas_abas(content, filename).values()), None)
+        return {
+            "message": "Prévia (nada foi gravado)",
+            "dry_run": True,
+            "tipo": tipo,
+            "competencia": competencia,
+            "previa": _previa(df, tipo, competencia, group_id, linhas_totais, linhas_lidas),
+            "erros": [],
+            "erros_linhas": erros_linhas,
+        }
 
-    query = {"competencia": competencia}
-    if group_id:
-        query["group_id"] = group_id
-    deleted = collection.delete_many(query)
-    deleted_count = deleted.deleted_count
+    uploads_log = get_uploads_log_collection()
 
-    docs = dataframe_para_documentos(df, competencia, filename, tipo, group_id)
-    if docs:
-        collection.insert_many(docs)
-    linhas_importadas = len(docs)
+    resultado = importar_competencia(df, tipo, competencia, filename, group_id)
+    linhas_importadas = resultado["linhas_importadas"]
+    deleted_count = resultado["linhas_substituidas"]
 
     log_entry = {
         "competencia": competencia,
@@ -81,8 +169,17 @@ async def upload_planilha(
         "uploaded_at": datetime.datetime.utcnow(),
         "linhas_importadas": linhas_importadas,
         "linhas_substituidas": deleted_count,
+        "linhas_com_erro": erros_linhas["total"],
+        "etapas_ms": {"fila": fila_ms, "leitura": leitura_ms, "validacao": validacao_ms, **resultado["etapas_ms"]},
+        "escrita": resultado["escrita"],
+        "anomalias": len(resultado["anomalias"]),
     }
     uploads_log.insert_one(log_entry)
+    registrar_etapas(f"{tipo} {competencia}", log_entry["etapas_ms"])
+    publicar_upload(tipo, competencia, group_id, linhas_importadas, deleted_count, resultado["kpis"])
+    bitmaps.invalidar(tipo)  # depois do log e da nova versão: a verificação já encontra o upload
+    # visões padrão do dashboard recalculadas depois da resposta
+    background_tasks.add_task(aquecer, tipo, group_id)
 
     return {
         "message": "Importação concluída",
@@ -90,23 +187,62 @@ async def upload_planilha(
         "competencia": competencia,
         "linhas_importadas": linhas_importadas,
         "linhas_substituidas": deleted_count,
+        "anomalias": resultado["anomalias"],
         "erros": [],
+        "erros_linhas": erros_linhas,
     }
 
 
 @router.post("/uploads/todas-abas")
 async def upload_planilha_todas_abas(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     year: int = Form(..., ge=2000, le=2100),
     group_id: Optional[str] = Form(None),
+    dry_run: bool = Form(False, description="Só valida e devolve a prévia por aba, sem gravar"),
 ):
     """
     Processa todas as abas do Excel: tipo (Polpa/Extrato) e mês são inferidos pelo nome da aba.
     Ex.: 'Polpa congelada - Jul' -> polpa, 2025-07; 'Extrato de manga - Ago' -> extrato, 2025-08.
     Informe apenas o ano (todas as abas usam esse ano).
+    Com dry_run=true nada é gravado: cada aba traz a prévia (amostra das primeiras DRY_RUN_MAX_LINHAS linhas).
+    Com a fila de uploads do worker cheia responde 429 (Retry-After).
     """
-    content = await file.read()
-    filename = file.filename or "arquivo.xlsx"
+    try:
+        async with admissao.admitir() as fila_ms:
+            content = await file.read()
+            return await admissao.executar(
+                _processar_todas_abas,
+                background_tasks,
+                content,
+                file.filename or "arquivo.xlsx",
+                year,
+                group_id,
+                dry_run,
+                fila_ms,
+            )
+    except admissao.FilaCheia as e:
+        raise _fila_cheia(e)
+
+
+def _processar_todas_abas(
+    background_tasks: BackgroundTasks,
+    content: bytes,
+    filename: str,
+    year: int,
+    group_id: Optional[str],
+    dry_run: bool,
+    fila_ms: float,
+) -> dict:
+    from services.excel_service import (
+        validar_arquivo,
+        ler_excel_todas_abas,
+        contar_linhas_abas,
+        validar_colunas,
+        limpar_e_validar,
+        juntar_relatorios,
+    )
+    from services.ingestao import importar_competencia
 
     erros = validar_arquivo(filename, content)
     if erros:
@@ -118,7 +254,9 @@ async def upload_planilha_todas_abas(
             detail={"erros": ["Upload 'todas as abas' exige arquivo .xlsx (várias abas). Para CSV use o upload normal com tipo e mês/ano."]},
         )
 
-    abas = ler_excel_todas_abas(content, filename, year)
+    inicio = time.perf_counter()
+    abas = ler_excel_todas_abas(content, filename, year, DRY_RUN_MAX_LINHAS if dry_run else None)
+    leitura_ms = _ms_desde(inicio)
     if not abas:
         raise HTTPException(
             status_code=400,
@@ -130,35 +268,54 @@ async def upload_planilha_todas_abas(
             },
         )
 
+    # contagem do arquivo só para as abas cuja leitura parou no limite (amostra)
+    truncadas = {nome for nome, df, _, _ in abas if dry_run and len(df) >= DRY_RUN_MAX_LINHAS}
+    linhas_por_aba = contar_linhas_abas(content, filename) if truncadas else {}
     uploads_log = get_uploads_log_collection()
     resumo: list[dict] = []
     erros_geral: list[str] = []
+    relatorios: list[dict] = []
+    tipos_importados: set[str] = set()
 
     for sheet_name, df, tipo, competencia in abas:
+        admissao.ceder_leituras()  # entre abas, as leituras em andamento passam na frente
+        inicio = time.perf_counter()
         erros_col = validar_colunas(df, tipo)
         if erros_col:
             erros_geral.append(f"{sheet_name} ({tipo}, {competencia}): {', '.join(erros_col)}")
             continue
-        df_limpo = limpar_e_normalizar(df, tipo)
+        df_limpo, erros_linhas = limpar_e_validar(df, tipo, sheet_name)
+        validacao_ms = _ms_desde(inicio)
+        relatorios.append(erros_linhas)
         if df_limpo.empty:
             erros_geral.append(f"{sheet_name}: nenhum dado válido após limpeza.")
             continue
-        collection = get_collection(tipo)
-        query = {"competencia": competencia}
-        if group_id:
-            query["group_id"] = group_id
-        deleted = collection.delete_many(query)
-        deleted_count = deleted.deleted_count
-        docs = dataframe_para_documentos(df_limpo, competencia, filename, tipo, group_id)
-        if docs:
-            collection.insert_many(docs)
-        linhas = len(docs)
+        if dry_run:
+            resumo.append({
+                "aba": sheet_name,
+                "tipo": tipo,
+                "competencia": competencia,
+                "previa": _previa(
+                    df_limpo,
+                    tipo,
+                    competencia,
+                    group_id,
+                    linhas_por_aba.get(sheet_name) if sheet_name in truncadas else None,
+                    len(df),
+                ),
+            })
+            continue
+        resultado = importar_competencia(df_limpo, tipo, competencia, filename, group_id)
+        linhas = resultado["linhas_importadas"]
+        deleted_count = resultado["linhas_substituidas"]
         resumo.append({
             "aba": sheet_name,
             "tipo": tipo,
             "competencia": competencia,
             "linhas_importadas": linhas,
             "linhas_substituidas": deleted_count,
+            "linhas_com_erro": erros_linhas["total"],
+            "anomalias": resultado["anomalias"],
         })
         log_entry = {
             "competencia": competencia,
@@ -169,8 +326,30 @@ async def upload_planilha_todas_abas(
             "uploaded_at": datetime.datetime.utcnow(),
             "linhas_importadas": linhas,
             "linhas_substituidas": deleted_count,
+            "linhas_com_erro": erros_linhas["total"],
+            # leitura_arquivo: todas as abas juntas (o arquivo é lido uma vez)
+            "etapas_ms": {"fila": fila_ms, "leitura_arquivo": leitura_ms, "validacao": validacao_ms, **resultado["etapas_ms"]},
+            "escrita": resultado["escrita"],
+            "anomalias": len(resultado["anomalias"]),
         }
         uploads_log.insert_one(log_entry)
+        registrar_etapas(f"{sheet_name} ({tipo} {competencia})", log_entry["etapas_ms"])
+        publicar_upload(tipo, competencia, group_id, linhas, deleted_count, resultado["kpis"])
+        bitmaps.invalidar(tipo)
+        tipos_importados.add(tipo)
+
+    if dry_run:
+        return {
+            "message": "Prévia (nada foi gravado)",
+            "dry_run": True,
+            "ano": year,
+            "abas": resumo,
+            "erros": erros_geral,
+            "erros_linhas": juntar_relatorios(relatorios),
+        }
+
+    for tipo in sorted(tipos_importados):
+        background_tasks.add_task(aquecer, tipo, group_id)
 
     return {
         "message": "Importação concluída (todas as abas processadas)",
@@ -178,4 +357,11 @@ async def upload_planilha_todas_abas(
         "abas_processadas": resumo,
         "total_linhas": sum(r["linhas_importadas"] for r in resumo),
         "erros": erros_geral,
+        "erros_linhas": juntar_relatorios(relatorios),
     }
+
+
+@router.get("/uploads/fila")
+def get_fila_uploads():
+    """Uploads processando e aguardando neste worker (limites UPLOADS_CONCORRENTES/UPLOADS_FILA_MAX)."""
+    return admissao.estado()
@@ -0,0 +1,27 @@
+"""
+Retenção do histórico de uploads: resume em uploads_log_arquivo as entradas do uploads_log mais
+antigas que UPLOADS_RETENCAO_DIAS (ou --dias) e as remove do log. Pode rodar periodicamente (cron).
+
+Uso: python -m scripts.arquivar_uploads [--dias 365]
+"""
+import argparse
+
+from config import UPLOADS_RETENCAO_DIAS
+from services.db import garantir_indices
+from services.historico import arquivar_uploads
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--dias", type=int, default=UPLOADS_RETENCAO_DIAS, help=f"Manter no log só os últimos N dias (padrão: {UPLOADS_RETENCAO_DIAS})"
+    )
+    args = parser.parse_args()
+
+    garantir_indices()
+    r = arquivar_uploads(args.dias)
+    print(f"{r['removidos']} entradas arquivadas em {r['resumos']} resumos (tipo/group_id/competência)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Carga em massa de planilhas históricas: importa todas as abas de cada .xlsx de um diretório
+(mesma regra do upload "todas as abas": tipo e mês pelo nome da aba, ano pelo nome do arquivo
+ou --ano). Os arquivos são processados em paralelo (um processo por arquivo) e gravados em
+lotes não ordenados (INSERCAO_LOTE).
+
+Se a mesma aba (tipo/competência) aparecer em mais de um arquivo, vale a do último arquivo na
+ordem dos caminhos, como se tivessem sido enviados um a um. Arquivos concluídos ficam no arquivo
+de estado (--estado): rodar de novo depois de uma interrupção continua de onde parou. Cada
+competência é substituída por inteiro, então um arquivo interrompido no meio pode ser refeito.
+
+Uso: python -m scripts.backfill DIRETORIO [--ano 2024] [--group-id G] [--processos 4] [--estado caminho.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Optional
+
+from services.db import garantir_indices, get_uploads_log_collection
+from services.eventos import publicar_upload
+from services.excel_service import abas_reconhecidas, ler_excel_todas_abas, limpar_e_validar, validar_colunas
+from services.ingestao import importar_competencia
+
+ANO_NO_NOME = re.compile(r"(?<!\d)(20\d{2})(?!\d)")
+
+
+def _ano_do_arquivo(caminho: Path, ano: Optional[int]) -> Optional[int]:
+    if ano is not None:
+        return ano
+    m = ANO_NO_NOME.search(caminho.stem)
+    return int(m.group(1)) if m else None
+
+
+def _assinatura(caminho: Path) -> dict[str, Any]:
+    st = caminho.stat()
+    return {"tamanho": st.st_size, "mtime": st.st_mtime}
+
+
+def _ler_estado(caminho: Path) -> dict[str, Any]:
+    if not caminho.exists():
+        return {}
+    return json.loads(caminho.read_text(encoding="utf-8"))
+
+
+def _gravar_estado(caminho: Path, estado: dict[str, Any]) -> None:
+    # grava num temporário e renomeia: uma interrupção nunca deixa o estado pela metade
+    tmp = caminho.with_suffix(caminho.suffix + ".tmp")
+    tmp.write_text(json.dumps(estado, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, caminho)
+
+
+def _abas_repetidas(arquivos: list[tuple[Path, int]]) -> dict[Path, set[str]]:
+    """Abas a ignorar em cada arquivo porque a mesma competência aparece num arquivo posterior."""
+    dono: dict[tuple[str, str], tuple[Path, str]] = {}
+    por_arquivo: dict[Path, list[tuple[str, tuple[str, str]]]] = {}
+    for caminho, ano in arquivos:
+        for sheet_name, tipo, competencia in abas_reconhecidas(caminho.read_bytes(), caminho.name, ano):
+            dono[(tipo, competencia)] = (caminho, sheet_name)
+            por_arquivo.setdefault(caminho, []).append((sheet_name, (tipo, competencia)))
+    return {
+        caminho: {aba for aba, chave in abas if dono[chave] != (caminho, aba)}
+        for caminho, abas in por_arquivo.items()
+    }
+
+
+def _importar_arquivo(caminho: str, ano: int, group_id: Optional[str], ignorar: set[str]) -> dict[str, Any]:
+    """Roda num processo do pool: lê, valida e grava as abas de um arquivo."""
+    inicio = time.perf_counter()
+    filename = Path(caminho).name
+    abas = ler_excel_todas_abas(Path(caminho).read_bytes(), filename, ano)
+    leitura_ms = round((time.perf_counter() - inicio) * 1000, 1)
+    uploads_log = get_uploads_log_collection()
+    linhas_total = 0
+    erros: list[str] = []
+    tipos: set[str] = set()
+    for sheet_name, df, tipo, competencia in abas:
+        if sheet_name in ignorar:
+            continue
+        marca = time.perf_counter()
+        erros_col = validar_colunas(df, tipo)
+        if erros_col:
+            erros.append(f"{sheet_name} ({tipo}, {competencia}): {', '.join(erros_col)}")
+            continue
+        df_limpo, erros_linhas = limpar_e_validar(df, tipo, sheet_name)
+        validacao_ms = round((time.perf_counter() - marca) * 1000, 1)
+        if df_limpo.empty:
+            erros.append(f"{sheet_name}: nenhum dado válido após limpeza.")
+            continue
+        resultado = importar_competencia(df_limpo, tipo, competencia, filename, group_id)
+        linhas = resultado["linhas_importadas"]
+        uploads_log.insert_one({
+            "competencia": competencia,
+            "tipo": tipo,
+            "group_id": group_id,
+            "source_file": filename,
+            "sheet_name": sheet_name,
+            "uploaded_at": datetime.datetime.utcnow(),
+            "linhas_importadas": linhas,
+            "linhas_substituidas": resultado["linhas_substituidas"],
+            "linhas_com_erro": erros_linhas["total"],
+            "origem": "backfill",
+            "etapas_ms": {"leitura_arquivo": leitura_ms, "validacao": validacao_ms, **resultado["etapas_ms"]},
+            "escrita": resultado["escrita"],
+            "anomalias": len(resultado["anomalias"]),
+        })
+        publicar_upload(tipo, competencia, group_id, linhas, resultado["linhas_substituidas"], resultado["kpis"])
+        linhas_total += linhas
+        tipos.add(tipo)
+    return {
+        "linhas": linhas_total,
+        "erros": erros,
+        "tipos": sorted(tipos),
+        "segundos": round(time.perf_counter() - inicio, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("diretorio", type=Path, help="Diretório com os .xlsx (subdiretórios incluídos)")
+    parser.add_argument("--ano", type=int, help="Ano de todas as planilhas (padrão: ano no nome do arquivo)")
+    parser.add_argument("--group-id", help="group_id gravado em todas as linhas")
+    parser.add_argument(
+        "--processos", type=int, default=os.cpu_count() or 1, help="Arquivos processados em paralelo (padrão: nº de CPUs)"
+    )
+    parser.add_argument("--estado", type=Path, help="Arquivo de estado (padrão: DIRETORIO/.backfill_estado.json)")
+    parser.add_argument("--refazer", action="store_true", help="Ignora o estado e importa todos os arquivos de novo")
+    args = parser.parse_args()
+
+    caminho_estado = args.estado or args.diretorio / ".backfill_estado.json"
+    estado = {} if args.refazer else _ler_estado(caminho_estado)
+
+    arquivos: list[tuple[Path, int]] = []
+    for caminho in sorted(args.diretorio.rglob("*.xlsx")):
+        if caminho.name.startswith("~$"):
+            continue  # arquivo de trava do Excel
+        ano = _ano_do_arquivo(caminho, args.ano)
+        if ano is None:
+            print(f"{caminho}: ano não encontrado no nome do arquivo (use --ano); ignorado")
+            continue
+        arquivos.append((caminho, ano))
+
+    ignorar = _abas_repetidas(arquivos)
+    pendentes = [(c, a) for c, a in arquivos if estado.get(str(c), {}).get("assinatura") != _assinatura(c)]
+    print(f"{len(arquivos)} arquivos, {len(arquivos) - len(pendentes)} já importados, {len(pendentes)} pendentes")
+    if not pendentes:
+        return
+
+    garantir_indices()
+    inicio = time.perf_counter()
+    linhas_total = 0
+    with ProcessPoolExecutor(max_workers=max(args.processos, 1)) as pool:
+        futuros = {
+            pool.submit(_importar_arquivo, str(c), a, args.group_id, ignorar.get(c, set())): c for c, a in pendentes
+        }
+        for futuro in as_completed(futuros):
+            caminho = futuros[futuro]
+            try:
+                r = futuro.result()
+            except Exception as e:
+                print(f"{caminho}: falhou ({e}); será refeito na próxima execução")
+                continue
+            for erro in r["erros"]:
+                print(f"{caminho}: {erro}")
+            estado[str(caminho)] = {"assinatura": _assinatura(caminho), "linhas": r["linhas"], "tipos": r["tipos"]}
+            _gravar_estado(caminho_estado, estado)
+            linhas_total += r["linhas"]
+            decorrido = time.perf_counter() - inicio
+            print(
+                f"{caminho}: {r['linhas']} linhas em {r['segundos']} s"
+                f" | total {linhas_total} linhas, {linhas_total / decorrido:,.0f} linhas/s"
+            )
+
+    decorrido = time.perf_counter() - inicio
+    print(f"Concluído: {linhas_total} linhas em {decorrido:.1f} s ({linhas_total / decorrido:,.0f} linhas/s)")
+
+
+if __name__ == "__main__":
+    main()
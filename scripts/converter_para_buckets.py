@@ -0,0 +1,24 @@
+"""
+Converte as coleções polpa/extrato (uma linha por documento) para o layout em buckets.
+Depois de rodar, suba a API com STORAGE_MODE=buckets.
+
+Uso: python -m scripts.converter_para_buckets [--tipo polpa|extrato]
+"""
+import argparse
+
+from config import TIPOS_VALIDOS
+from services.armazenamento import converter_para_buckets
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tipo", choices=TIPOS_VALIDOS, help="Converter só um tipo (padrão: todos)")
+    args = parser.parse_args()
+
+    for tipo in [args.tipo] if args.tipo else TIPOS_VALIDOS:
+        r = converter_para_buckets(tipo)
+        print(f"{tipo}: {r['linhas']} linhas empacotadas em {r['buckets']} buckets")
+
+
+if __name__ == "__main__":
+    main()
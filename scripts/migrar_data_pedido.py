@@ -0,0 +1,31 @@
+"""
+Backfill: converte data_pedido texto -> data nativa e cria os índices.
+
+Uso: python -m scripts.migrar_data_pedido [--tipo polpa|extrato]
+"""
+import argparse
+
+from config import TIPOS_VALIDOS
+from services.db import garantir_indices
+from services.eventos import proxima_versao
+from services.migracoes import migrar_data_pedido
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tipo", choices=TIPOS_VALIDOS, help="Migrar só um tipo (padrão: todos)")
+    args = parser.parse_args()
+
+    for tipo in [args.tipo] if args.tipo else TIPOS_VALIDOS:
+        r = migrar_data_pedido(tipo)
+        proxima_versao(tipo)  # invalida o cache das consultas do tipo
+        print(
+            f"{tipo}: {r['convertidos']} documentos convertidos em {r['competencias']} competências"
+            f" ({r['nao_convertidos']} com data inválida mantidos como texto)"
+        )
+    garantir_indices()
+    print("Índices garantidos.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Move as linhas (ou buckets) para a coleção física do seu group_id conforme PARTICIONAMENTO.
+Serve para ligar o particionamento numa base existente, mudar de modo (group_id <-> hash,
+PARTICOES_HASH) ou voltar tudo para a coleção única (PARTICIONAMENTO=nenhum).
+
+Copia em lotes preservando o _id e só então apaga da origem: pode ser interrompido e rodado de
+novo. Rodar com os uploads parados (durante a cópia, leituras sem group_id podem contar um lote duas vezes).
+
+Uso: python -m scripts.particionar_group_id [--tipo polpa|extrato] [--lote 5000]
+"""
+import argparse
+
+from pymongo.errors import BulkWriteError
+
+from config import TIPOS_VALIDOS
+from services.db import colecoes_do_tipo, garantir_indices, garantir_indices_colecao, get_db, nome_colecao
+from services.eventos import proxima_versao
+
+
+def _mover(origem, destino, group_id, lote: int) -> int:
+    movidos = 0
+    while True:
+        docs = list(origem.find({"group_id": group_id}).limit(lote))
+        if not docs:
+            return movidos
+        try:
+            destino.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # _id já copiado numa execução interrompida: segue para apagar da origem
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+        origem.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+        movidos += len(docs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tipo", choices=TIPOS_VALIDOS, help="Particionar só um tipo (padrão: todos)")
+    parser.add_argument("--lote", type=int, default=5000, help="Documentos por lote (padrão: 5000)")
+    args = parser.parse_args()
+
+    db = get_db()
+    for tipo in [args.tipo] if args.tipo else TIPOS_VALIDOS:
+        for origem in colecoes_do_tipo(tipo):
+            for group_id in origem.distinct("group_id"):
+                destino = db[nome_colecao(tipo, group_id)]
+                if destino.name == origem.name:
+                    continue
+                garantir_indices_colecao(destino)
+                n = _mover(origem, destino, group_id, args.lote)
+                print(f"{tipo}: group_id={group_id!r} {origem.name} -> {destino.name}: {n} documentos")
+            if origem.name != nome_colecao(tipo) and origem.estimated_document_count() == 0:
+                origem.drop()  # partição que não é mais usada no modo atual
+        proxima_versao(tipo)  # invalida o cache das consultas do tipo
+    garantir_indices()
+    print("Índices garantidos.")
+
+
+if __name__ == "__main__":
+    main()
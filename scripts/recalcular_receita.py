@@ -0,0 +1,51 @@
+"""
+Reaplica a fórmula atual da receita (services.receita.FORMULAS) nos dados já gravados, sem
+reenviar planilhas: update com pipeline no servidor, por competência e em lotes. Depois refaz os
+sketches das competências alteradas (totais por dimensão), as anomalias gravadas dessas competências
+e das posteriores (o histórico delas inclui as alteradas) e invalida o cache das consultas.
+
+Só os documentos gravados com outra versão da fórmula são alterados (--forcar: todos).
+
+Uso: python -m scripts.recalcular_receita [--tipo polpa|extrato] [--competencia YYYY-MM ...] [--lote N] [--forcar]
+"""
+import argparse
+import time
+
+from config import TIPOS_VALIDOS
+from services.db import garantir_indices
+from services.anomalias import reavaliar_anomalias
+from services.eventos import proxima_versao
+from services.migracoes import recalcular_receita
+from services.receita import formula
+from services.sketches import reconstruir_sketches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tipo", choices=TIPOS_VALIDOS, help="Recalcular só um tipo (padrão: todos)")
+    parser.add_argument("--competencia", nargs="+", help="Só estas competências (padrão: todas)")
+    parser.add_argument("--lote", type=int, default=5000, help="Documentos por update (padrão: 5000)")
+    parser.add_argument("--forcar", action="store_true", help="Recalcula também os documentos já na versão atual")
+    args = parser.parse_args()
+
+    garantir_indices()
+    for tipo in [args.tipo] if args.tipo else TIPOS_VALIDOS:
+        inicio = time.perf_counter()
+        r = recalcular_receita(tipo, args.competencia, args.forcar, max(args.lote, 1))
+        print(
+            f"{tipo}: fórmula v{r['versao']} ({formula(tipo).descricao}): {r['documentos']} documentos"
+            f" em {r['lotes']} lotes, {len(r['competencias'])} competências ({time.perf_counter() - inicio:.1f} s)"
+        )
+        if not r["competencias"]:
+            continue
+        s = reconstruir_sketches(tipo, r["competencias"])
+        anomalias = reavaliar_anomalias(tipo, r["competencias"])
+        proxima_versao(tipo)  # invalida o cache das consultas do tipo
+        print(
+            f"{tipo}: {s['sketches']} sketches refeitos em {s['competencias']} competências,"
+            f" {anomalias} resultados de anomalias refeitos"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Recalcula os sketches (histogramas de NPS e índices de qualidade, totais por dimensão) a partir
+das linhas gravadas. Necessário uma vez para dados importados antes dos sketches (ou dos totais,
+usados na detecção de anomalias) existirem.
+
+Uso: python -m scripts.reconstruir_sketches [--tipo polpa|extrato]
+"""
+import argparse
+
+from config import TIPOS_VALIDOS
+from services.db import garantir_indices
+from services.eventos import proxima_versao
+from services.sketches import reconstruir_sketches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tipo", choices=TIPOS_VALIDOS, help="Reconstruir só um tipo (padrão: todos)")
+    args = parser.parse_args()
+
+    garantir_indices()
+    for tipo in [args.tipo] if args.tipo else TIPOS_VALIDOS:
+        r = reconstruir_sketches(tipo)
+        proxima_versao(tipo)  # invalida o cache das consultas do tipo
+        print(f"{tipo}: {r['sketches']} sketches em {r['competencias']} competências")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Teste de regressão dos planos de consulta: carrega dados gerados num banco de teste de um mongod
+local, chama cada rota GET de leitura da API (com e sem período, group_id e filtro de dimensão),
+captura os comandos enviados ao MongoDB e roda explain("executionStats") no acesso de cada um
+(o $match/$sort inicial do pipeline, inclusive nos $unionWith, ou o find).
+
+Falha (código de saída 1) se alguma chamada responde 5xx (4xx é combinação de parâmetros que a
+rota não aceita e é ignorada), se nenhuma combinação de uma rota responde 200 ou se algum acesso:
+- com filtro, varre a coleção (COLLSCAN);
+- ordena em memória (SORT bloqueante);
+- examina mais de --razao-max chaves ou documentos por documento retornado;
+- com --baseline, usa outro índice ou examina 50% mais por documento do que na execução gravada
+  (gravar/atualizar a referência com --atualizar-baseline).
+
+O banco de teste (--db) é apagado e recriado a cada execução (--sem-carga reaproveita os dados).
+
+Uso: python -m scripts.verificar_planos [--mongodb-url mongodb://localhost:27017] [--db dashboard_mangas_planos]
+     [--meses 12] [--linhas 5000] [--baseline planos.json] [--atualizar-baseline]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Iterator, Optional
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+from bson import SON, json_util
+from pymongo import monitoring
+
+# sem cache e sem aquecimento: toda requisição precisa chegar ao MongoDB
+os.environ["CACHE_CONSULTAS"] = "false"
+
+GROUP_IDS = ["g1", "g2", "g3"]
+CANAIS = ["Varejo", "Atacado", "Online", "Food service"]
+REGIOES = ["SP", "RJ", "MG", "Bahia", "Pernambuco", "Paraná", "RS", "Goiás", "Amazonas"]
+SEGMENTOS = ["Food service", "Indústria", "Varejo", "Distribuidor"]
+
+# Valores para parâmetros obrigatórios além de tipo (rotas sem valor aqui são chamadas só com os padrões)
+EXEMPLOS = {"campo": "nps_0a10", "linhas": "canal", "colunas": "regiao_destino"}
+COMANDOS_LEITURA = ("aggregate", "find", "distinct")
+
+
+class _Captura(monitoring.CommandListener):
+    """Guarda os comandos de leitura enviados ao banco de teste."""
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.comandos: list[SON] = []
+
+    def started(self, event):
+        from services.perfil import comando_para_explain
+
+        if event.database_name == self.db_name and event.command_name in COMANDOS_LEITURA:
+            self.comandos.append(comando_para_explain(event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _gerar(tipo: str, competencia: str, n: int, rng: np.random.Generator) -> pd.DataFrame:
+    from config import COLUNAS_EXTRATO, COLUNAS_POLPA
+
+    ano, mes = map(int, competencia.split("-"))
+    dados: dict[str, Any] = {
+        "data_pedido": [datetime.datetime(ano, mes, d) for d in rng.integers(1, 29, n)],
+        "canal": rng.choice(CANAIS, n),
+        "regiao_destino": rng.choice(REGIOES, n),
+        "cliente_segmento": rng.choice(SEGMENTOS, n),
+        "nps_0a10": rng.integers(0, 11, n),
+    }
+    if tipo == "polpa":
+        dados.update(
+            quantidade_kg=rng.integers(1, 500, n),
+            preco_unitario_brl_kg=rng.uniform(5, 20, n).round(2),
+            logistica_brl=rng.integers(0, 50, n),
+            desconto_brl=rng.integers(0, 20, n),
+            lote_id=[f"L{i}" for i in rng.integers(1, 400, n)],
+            indice_qualidade_1a10=rng.uniform(1, 10, n).round(1),
+            perda_processamento_pct=rng.uniform(0, 15, n).round(1),
+        )
+    else:
+        dados.update(
+            quantidade_litros=rng.integers(1, 100, n),
+            preco_unitario_brl_l=rng.uniform(50, 200, n).round(2),
+            concentracao_ativa_pct=rng.uniform(5, 60, n).round(1),
+            tipo_solvente=rng.choice(["etanol", "água", "glicerina"], n),
+            indice_cor_1a10=rng.integers(1, 11, n),
+            indice_pureza_1a10=rng.uniform(1, 10, n).round(1),
+            certificacao_exigida=rng.choice(["orgânico", "nenhuma", "kosher"], n),
+        )
+    return pd.DataFrame(dados, columns=COLUNAS_POLPA if tipo == "polpa" else COLUNAS_EXTRATO)
+
+
+def _carregar(competencias: list[str], linhas: int) -> None:
+    from config import TIPOS_VALIDOS
+    from services.db import get_uploads_log_collection
+    from services.excel_service import limpar_e_validar
+    from services.ingestao import importar_competencia
+
+    rng = np.random.default_rng(42)
+    log = get_uploads_log_collection()
+    for tipo in TIPOS_VALIDOS:
+        for competencia in competencias:
+            for group_id in GROUP_IDS:
+                df, _ = limpar_e_validar(_gerar(tipo, competencia, linhas, rng), tipo)
+                r = importar_competencia(df, tipo, competencia, "planos.xlsx", group_id)
+                log.insert_one({
+                    "competencia": competencia,
+                    "tipo": tipo,
+                    "group_id": group_id,
+                    "source_file": "planos.xlsx",
+                    "uploaded_at": datetime.datetime.utcnow(),
+                    "linhas_importadas": r["linhas_importadas"],
+                    "linhas_substituidas": r["linhas_substituidas"],
+                    "linhas_com_erro": 0,
+                })
+        print(f"{tipo}: {len(competencias)} competências x {len(GROUP_IDS)} group_ids x {linhas} linhas")
+
+
+def _variantes(route, competencias: list[str]) -> Iterator[dict[str, Any]]:
+    """Parâmetros de chamada da rota: padrão, período, período + group_id, período + canal."""
+    from fastapi.dependencies.utils import get_flat_dependant
+
+    from config import TIPOS_VALIDOS
+
+    params = {p.alias: p for p in get_flat_dependant(route.dependant).query_params}
+    base = {nome: valor for nome, valor in EXEMPLOS.items() if nome in params}
+    periodo = {"from_comp": competencias[-3], "to_comp": competencias[-1]} if "from_comp" in params else {}
+    extras = [{}]
+    if periodo:
+        extras.append(periodo)
+        if "group_id" in params:
+            extras.append({**periodo, "group_id": GROUP_IDS[0]})
+        if "canal" in params:
+            extras.append({**periodo, "canal": CANAIS[0]})
+    for tipo in TIPOS_VALIDOS if "tipo" in params else [None]:
+        for extra in extras:
+            yield {**base, **({"tipo": tipo} if tipo else {}), **extra}
+
+
+def _acessos(comando: SON) -> Iterator[tuple[str, Optional[SON], bool]]:
+    """
+    (coleção, comando de acesso, tem_filtro) de cada leitura do comando. O acesso é o find, ou o
+    prefixo $match/$sort do pipeline (e de cada $unionWith); None se o pipeline não filtra nem ordena.
+    """
+    nome = comando.get("find") or comando.get("aggregate") or comando.get("distinct")
+    if "find" in comando:
+        tem_filtro = bool(comando.get("filter"))
+        yield nome, comando if tem_filtro or comando.get("sort") else None, tem_filtro
+    elif "distinct" in comando:
+        tem_filtro = bool(comando.get("query"))
+        yield nome, comando if tem_filtro else None, tem_filtro
+    else:
+        pipelines = [(nome, comando.get("pipeline", []))]
+        pipelines += [
+            (e["$unionWith"]["coll"], e["$unionWith"].get("pipeline", []))
+            for e in comando.get("pipeline", [])
+            if isinstance(e.get("$unionWith"), dict)
+        ]
+        for colecao, pipeline in pipelines:
+            prefixo = []
+            for estagio in pipeline:
+                if next(iter(estagio)) not in ("$match", "$sort"):
+                    break
+                prefixo.append(estagio)
+            tem_filtro = any(e.get("$match") for e in prefixo)
+            if not tem_filtro and not any("$sort" in e for e in prefixo):
+                yield colecao, None, False
+                continue
+            yield colecao, SON([("aggregate", colecao), ("pipeline", prefixo), ("cursor", {})]), tem_filtro
+
+
+def _verificar(resumo: dict[str, Any], tem_filtro: bool, razao_max: float, referencia: Optional[dict]) -> list[str]:
+    falhas: list[str] = []
+    if tem_filtro and "COLLSCAN" in resumo["estagios"]:
+        falhas.append("COLLSCAN com filtro")
+    if "SORT" in resumo["estagios"]:
+        falhas.append("SORT bloqueante (ordenação sem índice)")
+    for campo in ("chaves", "docs") if tem_filtro else ():
+        razao = resumo[f"{campo}_por_doc"]
+        if razao > razao_max:
+            falhas.append(f"{razao:.1f} {campo} examinados por documento retornado (máx. {razao_max})")
+        if referencia and razao > max(referencia[f"{campo}_por_doc"] * 1.5, 1.0):
+            falhas.append(f"{campo} por documento: {referencia[f'{campo}_por_doc']} -> {razao}")
+    if referencia and referencia["indices"] != resumo["indices"]:
+        falhas.append(f"índice mudou: {referencia['indices']} -> {resumo['indices']}")
+    return falhas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-url", default="mongodb://localhost:27017", help="mongod local de teste")
+    parser.add_argument("--db", default="dashboard_mangas_planos", help="Banco de teste (apagado e recriado)")
+    parser.add_argument("--meses", type=int, default=12, help="Competências geradas (padrão: 12)")
+    parser.add_argument("--linhas", type=int, default=5000, help="Linhas por competência e group_id (padrão: 5000)")
+    parser.add_argument("--sem-carga", action="store_true", help="Usa os dados já carregados no banco de teste")
+    parser.add_argument("--razao-max", type=float, default=3.0, help="Chaves/documentos examinados por retornado (padrão: 3)")
+    parser.add_argument("--baseline", type=Path, help="JSON com os planos de referência")
+    parser.add_argument("--atualizar-baseline", action="store_true", help="Grava os planos atuais em --baseline")
+    args = parser.parse_args()
+
+    # config lê o ambiente na importação: o banco de teste precisa estar definido antes
+    os.environ["MONGODB_URL"] = args.mongodb_url
+    os.environ["DB_NAME"] = args.db
+    captura = _Captura(args.db)
+    monitoring.register(captura)
+
+    from fastapi.routing import APIRoute
+    from fastapi.testclient import TestClient
+
+    from config import DB_NAME
+    from main import app
+    from services.db import garantir_indices, get_client, get_db
+    from services.perfil import resumo_explain
+
+    hoje = datetime.date.today().replace(day=1)
+    competencias = sorted(
+        f"{(hoje.year * 12 + hoje.month - 1 - i) // 12:04d}-{(hoje.month - 1 - i) % 12 + 1:02d}" for i in range(args.meses)
+    )
+    if not args.sem_carga:
+        get_client().drop_database(DB_NAME)
+        garantir_indices()
+        _carregar(competencias, args.linhas)
+    garantir_indices()
+
+    referencia = {} if args.atualizar_baseline or not args.baseline or not args.baseline.exists() else json.loads(
+        args.baseline.read_text(encoding="utf-8")
+    )
+    atual: dict[str, dict] = {}
+    falhas = 0
+    db = get_db()
+    rotas = [
+        r for r in app.routes
+        if isinstance(r, APIRoute) and "GET" in r.methods and r.path.startswith("/api/") and r.path != "/api/events"
+    ]
+    # erro não tratado vira resposta 500 (e falha da rota) em vez de interromper a verificação
+    with TestClient(app, raise_server_exceptions=False) as client:
+        for rota in sorted(rotas, key=lambda r: r.path):
+            chamadas = 0
+            for params in _variantes(rota, competencias):
+                url = f"{rota.path}?{urlencode(params, doseq=True)}" if params else rota.path
+                captura.comandos.clear()
+                resposta = client.get(url)
+                if resposta.status_code >= 500:
+                    falhas += 1
+                    print(f"FALHA {url}: resposta {resposta.status_code}: {resposta.text[:200]}")
+                    continue
+                if resposta.status_code != 200:
+                    continue  # 4xx: combinação não suportada pela rota (ex.: tipo só polpa)
+                chamadas += 1
+                vistos: set[str] = set()
+                for comando in list(captura.comandos):
+                    texto = json_util.dumps(comando)
+                    if texto in vistos:
+                        continue
+                    vistos.add(texto)
+                    for i, (colecao, acesso, tem_filtro) in enumerate(_acessos(comando)):
+                        if acesso is None:
+                            print(f"  -  {url} [{colecao}] varredura completa (sem filtro)")
+                            continue
+                        explain = db.command(SON([("explain", acesso), ("verbosity", "executionStats")]))
+                        r = resumo_explain(explain)
+                        chave = f"{url} | {colecao} | {next(iter(comando))}#{len(vistos)}.{i}"
+                        resumo = {
+                            "estagios": r["estagios"],
+                            "indices": r["indices"],
+                            "chaves_por_doc": round(r["chaves"] / max(r["retornados"], 1), 2),
+                            "docs_por_doc": round(r["docs"] / max(r["retornados"], 1), 2),
+                        }
+                        atual[chave] = resumo
+                        problemas = _verificar(resumo, tem_filtro, args.razao_max, referencia.get(chave))
+                        indices = ", ".join(resumo["indices"]) or "-"
+                        if problemas:
+                            falhas += 1
+                            print(f"FALHA {url} [{colecao}] índices: {indices}: {'; '.join(problemas)}")
+                        else:
+                            print(
+                                f"  ok {url} [{colecao}] índices: {indices}, "
+                                f"{resumo['chaves_por_doc']} chaves e {resumo['docs_por_doc']} docs por retornado"
+                            )
+            if chamadas == 0:
+                falhas += 1
+                print(f"FALHA {rota.path}: nenhuma combinação de parâmetros respondeu 200 (ver EXEMPLOS)")
+
+    if args.baseline and args.atualizar_baseline:
+        args.baseline.write_text(json.dumps(atual, indent=1, ensure_ascii=False, sort_keys=True), encoding="utf-8")
+        print(f"Referência gravada em {args.baseline} ({len(atual)} acessos)")
+    print(f"{len(atual)} acessos verificados, {falhas} falhas")
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Admissão da ingestão: uploads e leituras do dashboard dividem o mesmo worker sem que a carga de
+um upload grande derrube a latência das leituras.
+
+- No máximo UPLOADS_CONCORRENTES uploads processando por worker e até UPLOADS_FILA_MAX esperando a
+  vez; com a fila cheia o upload é recusado na hora (FilaCheia -> 429 com Retry-After).
+- O processamento (pandas, gravação, sketches) roda num executor próprio, fora do event loop e do
+  threadpool que atende os GETs síncronos.
+- Cada lote da gravação respeita INSERCAO_DOCS_POR_S e, com leituras em andamento no worker, espera
+  até INSERCAO_ESPERA_LEITURA_MS que terminem antes de ser enviado.
+"""
+import asyncio
+import contextvars
+import functools
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Optional
+
+from config import INSERCAO_DOCS_POR_S, INSERCAO_ESPERA_LEITURA_MS, UPLOADS_CONCORRENTES, UPLOADS_FILA_MAX
+from services import metricas
+from services.perfil import na_thread_da_requisicao
+
+# Rotas de leitura que não contam como carga (o fluxo SSE fica aberto indefinidamente)
+_ROTAS_IGNORADAS = ("/api/events",)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_vagas: Optional[asyncio.Semaphore] = None
+_admitidos = 0  # processando + aguardando (só alterado no event loop)
+_processando = 0
+_duracoes: deque = deque(maxlen=20)  # segundos dos últimos uploads, para estimar o Retry-After
+
+_leituras = 0
+_sem_leituras = threading.Condition()
+_lock_taxa = threading.Lock()
+_proximo_lote = 0.0  # time.monotonic() a partir do qual o próximo lote pode ser enviado
+
+
+def _reset_apos_fork() -> None:
+    global _executor, _vagas, _admitidos, _processando, _leituras, _sem_leituras, _lock_taxa, _proximo_lote
+    _executor, _vagas = None, None
+    _admitidos = _processando = _leituras = 0
+    _sem_leituras, _lock_taxa = threading.Condition(), threading.Lock()
+    _proximo_lote = 0.0
+    _duracoes.clear()
+
+
+os.register_at_fork(after_in_child=_reset_apos_fork)
+
+
+class FilaCheia(Exception):
+    def __init__(self, retry_apos_s: int):
+        super().__init__("Fila de uploads cheia")
+        self.retry_apos_s = retry_apos_s
+
+
+def estado() -> dict[str, Any]:
+    """Ocupação da fila de uploads e leituras em andamento neste worker."""
+    return {
+        "pid": os.getpid(),
+        "processando": _processando,
+        "aguardando": _admitidos - _processando,
+        "concorrentes": UPLOADS_CONCORRENTES,
+        "fila_max": UPLOADS_FILA_MAX,
+        "leituras_em_andamento": _leituras,
+    }
+
+
+def _retry_apos() -> int:
+    """Segundos até abrir vaga: duração média recente × uploads à frente / concorrência."""
+    media = sum(_duracoes) / len(_duracoes) if _duracoes else 30.0
+    return max(1, math.ceil(media * (_admitidos - _processando + 1) / UPLOADS_CONCORRENTES))
+
+
+@asynccontextmanager
+async def admitir():
+    """
+    Reserva uma vaga de upload ou levanta FilaCheia. Dentro do bloco o upload está processando;
+    o valor é a espera na fila (ms).
+    """
+    global _vagas, _admitidos, _processando
+    if _vagas is None:
+        _vagas = asyncio.Semaphore(UPLOADS_CONCORRENTES)
+    if _admitidos >= UPLOADS_CONCORRENTES + UPLOADS_FILA_MAX:
+        metricas.incrementar("uploads_recusados")
+        raise FilaCheia(_retry_apos())
+    _admitidos += 1
+    inicio = time.perf_counter()
+    try:
+        async with _vagas:
+            _processando += 1
+            espera_ms = round((time.perf_counter() - inicio) * 1000, 1)
+            inicio_processamento = time.perf_counter()
+            try:
+                yield espera_ms
+            finally:
+                _processando -= 1
+                _duracoes.append(time.perf_counter() - inicio_processamento)
+    finally:
+        _admitidos -= 1
+
+
+async def executar(funcao: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Roda funcao no executor da ingestão, com o contexto da requisição (perfil, se ativo)."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=UPLOADS_CONCORRENTES, thread_name_prefix="ingestao")
+    chamada = functools.partial(contextvars.copy_context().run, na_thread_da_requisicao(funcao), *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executor, chamada)
+
+
+def ceder_leituras() -> float:
+    """Espera (até INSERCAO_ESPERA_LEITURA_MS) não haver leituras em andamento. Retorna os segundos esperados."""
+    if INSERCAO_ESPERA_LEITURA_MS <= 0:
+        return 0.0
+    inicio = time.monotonic()
+    with _sem_leituras:
+        _sem_leituras.wait_for(lambda: _leituras == 0, timeout=INSERCAO_ESPERA_LEITURA_MS / 1000)
+    return time.monotonic() - inicio
+
+
+def aguardar_lote(documentos: int) -> float:
+    """
+    Chamado antes de cada lote da gravação: limita a vazão a INSERCAO_DOCS_POR_S (somando todos os
+    uploads do worker) e cede às leituras. Retorna os segundos esperados.
+    """
+    global _proximo_lote
+    espera = 0.0
+    if INSERCAO_DOCS_POR_S > 0:
+        with _lock_taxa:
+            agora = time.monotonic()
+            envio = max(agora, _proximo_lote)
+            _proximo_lote = envio + documentos / INSERCAO_DOCS_POR_S
+        espera = envio - agora
+        if espera > 0:
+            time.sleep(espera)
+    return espera + ceder_leituras()
+
+
+class ContarLeituras:
+    """Middleware ASGI: conta os GET /api/* em andamento (a gravação dos uploads cede a eles)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _leituras
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or not scope["path"].startswith("/api/")
+            or scope["path"] in _ROTAS_IGNORADAS
+        ):
+            await self.app(scope, receive, send)
+            return
+        with _sem_leituras:
+            _leituras += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            with _sem_leituras:
+                _leituras -= 1
+                if _leituras == 0:
+                    _sem_leituras.notify_all()
@@ -0,0 +1,183 @@
+"""
+Anomalias detectadas na ingestão: a competência importada é comparada com o histórico do mesmo
+tipo/group_id por dimensão (total, canal, cliente_segmento, regiao_destino), usando os totais e
+histogramas dos sketches (calculados uma vez no upload, nunca por consulta).
+
+Por métrica (receita, quantidade, linhas, preço médio, NPS), o desvio é robusto:
+z = (atual − mediana) / (1,4826·MAD) sobre as competências anteriores, com piso de escala pelo
+ruído amostral da célula (~1/√linhas; no NPS, 100/√linhas pontos), para que histórico curto ou
+quase constante não gere alarme. Também são sinalizados valores da dimensão que sumiram (presentes
+em quase todo o histórico) e valores novos com participação relevante.
+"""
+import datetime
+import warnings
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from config import ANOMALIAS_HISTORICO_MESES, ANOMALIAS_Z
+from services.db import get_anomalias_collection, get_sketches_collection
+from services.limites import buscar
+from services.sketches import DIMENSOES_SKETCH, nps
+
+METRICAS = ("receita", "quantidade", "linhas", "preco_medio", "nps")
+MIN_COMPETENCIAS = 3  # histórico mínimo para comparar
+MIN_LINHAS = 30  # células menores (agora ou na mediana do histórico) não são comparadas
+ESCALA_MIN_REL = 0.05  # piso da escala: pelo menos 5% da mediana
+PRESENCA_MIN = 0.75  # "ausente": estava em pelo menos 75% das competências do histórico
+PARTICIPACAO_NOVO = 0.05  # "novo": pelo menos 5% das linhas da competência
+
+
+def _metricas(doc: dict[str, Any]) -> list[float]:
+    totais = doc.get("totais") or {}
+    preco_n = totais.get("preco_n") or 0
+    h = (doc.get("histogramas") or {}).get("nps_0a10")
+    valores = {
+        "receita": totais.get("receita", np.nan),
+        "quantidade": totais.get("quantidade", np.nan),
+        "linhas": totais.get("linhas", np.nan),
+        "preco_medio": totais["preco_soma"] / preco_n if preco_n else np.nan,
+        "nps": nps(np.asarray(h["contagens"]))["nps"] if h and h["n"] >= MIN_LINHAS else np.nan,
+    }
+    return [valores[m] for m in METRICAS]
+
+
+def _numero(v: float) -> Optional[float]:
+    return None if np.isnan(v) else round(float(v), 2)
+
+
+def detectar_anomalias(
+    tipo: str, competencia: str, group_id: Optional[str], atuais: list[dict[str, Any]]
+) -> dict[str, Any]:
+    """
+    Compara os sketches da competência (atuais) com os das ANOMALIAS_HISTORICO_MESES competências
+    anteriores. Retorna {"historico": [competências usadas], "anomalias": [...]}.
+    """
+    filtro = {
+        "tipo": tipo,
+        "dimensao": {"$in": ["total", *DIMENSOES_SKETCH]},
+        "competencia": {"$lt": competencia},
+        "group_id": group_id,
+        "totais": {"$exists": True},
+    }
+    projecao = {"_id": 0, "competencia": 1, "dimensao": 1, "valor": 1, "totais": 1, "histogramas.nps_0a10": 1}
+    docs = list(buscar(get_sketches_collection(), filtro, projecao))
+    competencias = sorted({d["competencia"] for d in docs})[-ANOMALIAS_HISTORICO_MESES:]
+    if len(competencias) < MIN_COMPETENCIAS:
+        return {"historico": competencias, "anomalias": []}
+
+    # matrizes (chave × competência × métrica) e (chave × métrica); NaN = sem linhas
+    chaves = sorted(
+        {(d["dimensao"], d.get("valor")) for d in [*docs, *atuais]},
+        key=lambda k: (k[0], k[1] is None, str(k[1])),
+    )
+    pos_chave = {k: i for i, k in enumerate(chaves)}
+    pos_comp = {c: i for i, c in enumerate(competencias)}
+    hist = np.full((len(chaves), len(competencias), len(METRICAS)), np.nan)
+    for d in docs:
+        if d["competencia"] in pos_comp:
+            hist[pos_chave[(d["dimensao"], d.get("valor"))], pos_comp[d["competencia"]]] = _metricas(d)
+    atual = np.full((len(chaves), len(METRICAS)), np.nan)
+    for d in atuais:
+        atual[pos_chave[(d["dimensao"], d.get("valor"))]] = _metricas(d)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # fatias só com NaN
+        mediana = np.nanmedian(hist, axis=1)
+        mad = np.nanmedian(np.abs(hist - mediana[:, None, :]), axis=1)
+    i_linhas = METRICAS.index("linhas")
+    linhas_hist = np.nan_to_num(mediana[:, i_linhas])
+    ruido = np.maximum(ESCALA_MIN_REL, 1 / np.sqrt(np.maximum(linhas_hist, 1)))
+    piso = np.abs(np.nan_to_num(mediana)) * ruido[:, None]
+    piso[:, METRICAS.index("nps")] = 100 * ruido  # NPS em pontos
+    escala = np.maximum(1.4826 * np.nan_to_num(mad), piso)
+    escala = np.where(escala > 0, escala, 1e-9)
+    z = (atual - mediana) / escala
+
+    presenca = (~np.isnan(hist[:, :, i_linhas])).mean(axis=1)
+    linhas_atual = np.nan_to_num(atual[:, i_linhas])
+    total_atual = linhas_atual[pos_chave[("total", None)]] if ("total", None) in pos_chave else linhas_atual.sum()
+    presente = linhas_atual > 0
+    comparavel = (
+        presente[:, None]
+        & ~np.isnan(z)
+        & ((~np.isnan(hist)).sum(axis=1) >= MIN_COMPETENCIAS)
+        & (linhas_atual >= MIN_LINHAS)[:, None]
+        & (linhas_hist >= MIN_LINHAS)[:, None]
+    )
+    desvio = comparavel & (np.abs(np.nan_to_num(z)) > ANOMALIAS_Z)
+    ausente = ~presente & (presenca >= PRESENCA_MIN) & (linhas_hist >= MIN_LINHAS)
+    novo = presente & (presenca == 0) & (linhas_atual >= max(MIN_LINHAS, PARTICIPACAO_NOVO * total_atual))
+
+    anomalias: list[dict[str, Any]] = []
+    for regra, mascara in (("ausente", ausente), ("novo", novo)):
+        for k in np.flatnonzero(mascara):
+            dimensao, valor = chaves[k]
+            anomalias.append({
+                "regra": regra,
+                "dimensao": dimensao,
+                "valor": valor,
+                "metrica": "linhas",
+                "atual": _numero(linhas_atual[k]),
+                "mediana": _numero(mediana[k, i_linhas]),
+            })
+    for k, m in sorted(zip(*np.nonzero(desvio)), key=lambda km: -abs(z[km])):
+        dimensao, valor = chaves[k]
+        anomalias.append({
+            "regra": "desvio",
+            "dimensao": dimensao,
+            "valor": valor,
+            "metrica": METRICAS[m],
+            "atual": _numero(atual[k, m]),
+            "mediana": _numero(mediana[k, m]),
+            "z": round(float(z[k, m]), 1),
+            "variacao_pct": _numero((atual[k, m] / mediana[k, m] - 1) * 100) if mediana[k, m] else None,
+        })
+    return {"historico": competencias, "anomalias": anomalias}
+
+
+def gravar_anomalias(
+    tipo: str, competencia: str, group_id: Optional[str], source_file: str, resultado: dict[str, Any]
+) -> None:
+    """Substitui o resultado da competência (o último upload vale, como os dados)."""
+    chave = {"tipo": tipo, "competencia": competencia, "group_id": group_id}
+    get_anomalias_collection().replace_one(
+        chave,
+        {
+            **chave,
+            "source_file": source_file,
+            "detectado_em": datetime.datetime.utcnow(),
+            "historico": resultado["historico"],
+            "anomalias": resultado["anomalias"],
+        },
+        upsert=True,
+    )
+
+
+def reavaliar_anomalias(tipo: str, competencias: Iterable[str]) -> int:
+    """
+    Refaz, a partir dos sketches atuais, as anomalias gravadas das competências e das posteriores
+    (que as têm no histórico); usado quando os sketches mudam sem upload (ex.: nova fórmula da receita).
+    Retorna quantos resultados foram refeitos.
+    """
+    inicio = min(competencias, default=None)
+    if inicio is None:
+        return 0
+    col = get_anomalias_collection()
+    gravados = list(col.find(
+        {"tipo": tipo, "competencia": {"$gte": inicio}}, {"_id": 0, "competencia": 1, "group_id": 1, "source_file": 1}
+    ))
+    projecao = {"_id": 0, "dimensao": 1, "valor": 1, "totais": 1, "histogramas.nps_0a10": 1}
+    for doc in sorted(gravados, key=lambda d: d["competencia"]):
+        competencia, group_id = doc["competencia"], doc.get("group_id")
+        filtro = {
+            "tipo": tipo,
+            "competencia": competencia,
+            "group_id": group_id,
+            "dimensao": {"$in": ["total", *DIMENSOES_SKETCH]},
+            "totais": {"$exists": True},
+        }
+        atuais = list(buscar(get_sketches_collection(), filtro, projecao))
+        resultado = detectar_anomalias(tipo, competencia, group_id, atuais)
+        gravar_anomalias(tipo, competencia, group_id, doc.get("source_file"), resultado)
+    return len(gravados)
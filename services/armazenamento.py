@@ -0,0 +1,133 @@
+"""
+Gravação das linhas de uma competência nas coleções polpa/extrato.
+
+STORAGE_MODE=linhas: um documento por linha da planilha.
+STORAGE_MODE=buckets: linhas agrupadas por (tipo, group_id, competencia, canal) em documentos
+com os metadados uma única vez e os campos da linha como arrays paralelos em "colunas".
+"""
+import datetime
+from typing import Any
+
+from config import STORAGE_MODE, BUCKET_MAX_LINHAS
+from services.consultas import estagios_resumo, soma_registros
+from services.db import (
+    colecoes_do_tipo,
+    garantir_indices_colecao,
+    get_collection,
+    get_db,
+    get_read_collection,
+    nome_colecao,
+)
+from services.escrita import inserir_em_lotes
+from services.limites import agregar
+
+CHAVES_BUCKET = ("tipo", "group_id", "competencia", "canal")
+METADADOS_BUCKET = ("source_file", "uploaded_at", "receita_versao")
+
+
+def documentos_para_buckets(docs: list[dict[str, Any]], max_linhas: int = BUCKET_MAX_LINHAS) -> list[dict[str, Any]]:
+    """Empacota documentos-linha em buckets de até max_linhas linhas."""
+    grupos: dict[tuple, list[dict[str, Any]]] = {}
+    for d in docs:
+        grupos.setdefault(tuple(d.get(k) for k in CHAVES_BUCKET), []).append(d)
+
+    buckets: list[dict[str, Any]] = []
+    for chave, linhas in grupos.items():
+        nomes = sorted({k for d in linhas for k in d} - set(CHAVES_BUCKET) - set(METADADOS_BUCKET))
+        for i in range(0, len(linhas), max_linhas):
+            parte = linhas[i:i + max_linhas]
+            bucket: dict[str, Any] = {k: v for k, v in zip(CHAVES_BUCKET, chave) if v is not None}
+            for k in METADADOS_BUCKET:
+                bucket[k] = parte[0].get(k)
+            bucket["n"] = len(parte)
+            bucket["colunas"] = {c: [d.get(c) for d in parte] for c in nomes}
+            datas = [v for v in bucket["colunas"].get("data_pedido", []) if isinstance(v, datetime.datetime)]
+            if datas:
+                bucket["data_min"] = min(datas)
+                bucket["data_max"] = max(datas)
+            buckets.append(bucket)
+    return buckets
+
+
+def substituir_competencia(
+    tipo: str,
+    competencia: str,
+    group_id: str | None,
+    docs: list[dict[str, Any]],
+) -> tuple[int, int, dict[str, Any]]:
+    """
+    Regra de duplicidade: apaga o que existir para competência (+ group_id) e grava docs.
+    Retorna (linhas_substituidas, linhas_importadas), sempre em linhas da planilha, e as
+    estatísticas da gravação (services.escrita.inserir_em_lotes; vazio se não havia docs).
+    """
+    collection = get_collection(tipo, group_id)
+    garantir_indices_colecao(collection)
+    query: dict[str, Any] = {"competencia": competencia}
+    if group_id:
+        query["group_id"] = group_id
+
+    # sem group_id a competência é substituída para todos os group_ids (todas as partições)
+    alvos = [collection] if group_id else colecoes_do_tipo(tipo)
+    escrita: dict[str, Any] = {}
+
+    if STORAGE_MODE == "buckets":
+        deleted_count = 0
+        for alvo in alvos:
+            antes = next(alvo.aggregate([{"$match": query}, {"$group": {"_id": None, "n": {"$sum": "$n"}}}]), None)
+            alvo.delete_many(query)
+            deleted_count += antes["n"] if antes else 0
+        if docs:
+            escrita = inserir_em_lotes(collection, documentos_para_buckets(docs))
+    else:
+        deleted_count = sum(alvo.delete_many(query).deleted_count for alvo in alvos)
+        if docs:
+            escrita = inserir_em_lotes(collection, docs)
+    return deleted_count, len(docs), escrita
+
+
+def totais_competencia(tipo: str, competencia: str, group_id: str | None) -> dict[str, float]:
+    """Registros, receita e quantidade gravados hoje para a competência (+ group_id)."""
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
+    match: dict[str, Any] = {"competencia": competencia}
+    if group_id:
+        match["group_id"] = group_id
+    pipeline = [
+        *estagios_resumo(tipo, match, ["receita", campo_qtd]),
+        {
+            "$group": {
+                "_id": None,
+                "registros": soma_registros(),
+                "receita": {"$sum": "$receita"},
+                campo_qtd: {"$sum": f"${campo_qtd}"},
+            }
+        },
+    ]
+    row = next(agregar(get_read_collection(tipo, group_id), pipeline), None) or {}
+    return {
+        "registros": row.get("registros") or 0,
+        "receita_total": round(float(row.get("receita") or 0), 2),
+        campo_qtd: round(float(row.get(campo_qtd) or 0), 2),
+    }
+
+
+def converter_para_buckets(tipo: str) -> dict:
+    """
+    Copia os documentos-linha de polpa/extrato para a coleção de buckets do tipo,
+    uma competência por vez (a competência existente nos buckets é substituída).
+    Com particionamento, cada partição vai para a partição de buckets correspondente.
+    """
+    db = get_db()
+    base_linhas = nome_colecao(tipo, storage_mode="linhas")
+    base_buckets = nome_colecao(tipo, storage_mode="buckets")
+    linhas = buckets = 0
+    for origem in colecoes_do_tipo(tipo, storage_mode="linhas"):
+        destino = db[base_buckets + origem.name[len(base_linhas):]]
+        for competencia in sorted(origem.distinct("competencia")):
+            docs = list(origem.find({"competencia": competencia}, {"_id": 0}))
+            novos = documentos_para_buckets(docs)
+            destino.delete_many({"competencia": competencia})
+            if novos:
+                destino.insert_many(novos)
+            linhas += len(docs)
+            buckets += len(novos)
+    return {"tipo": tipo, "linhas": linhas, "buckets": buckets}
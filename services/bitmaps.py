@@ -0,0 +1,175 @@
+"""
+Índice de bitmaps em memória para filtros combinados de dimensão (STORAGE_MODE=linhas).
+
+Por tipo e competência guarda os _id das linhas e, para cada valor de canal, regiao_destino,
+cliente_segmento, tipo_solvente, certificacao_exigida e group_id, um bitmap compactado
+(np.packbits) das linhas com aquele valor. Qualquer conjunção de filtros (OU dentro da dimensão,
+E entre dimensões) vira uma operação de bits e uma lista de _id para o $match.
+
+Atualização: a cada BITMAP_VERIFICAR_S segundos a versão dos dados do tipo (versoes_dados, contador
+no servidor) é comparada com a do índice; se mudou, são reconstruídas as competências com upload no
+uploads_log desde a verificação anterior (com folga para relógios diferentes entre workers e
+scripts). Versão nova sem upload no log (scripts de migração) reconstrói o índice inteiro.
+
+O índice é montado a partir do primário. Se as consultas leem de secundários, nos
+MONGO_MAX_STALENESS_S segundos depois de uma mudança os _id podem não bater com a réplica: nesse
+intervalo selecionar() devolve None e o filtro é feito pelos próprios campos.
+"""
+import datetime
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import numpy as np
+from bson import ObjectId
+
+from config import BITMAP_MAX_IDS, BITMAP_VERIFICAR_S, MONGO_MAX_STALENESS_S
+from services.db import colecoes_do_tipo, get_uploads_log_collection, lendo_do_primario
+from services.eventos import estado_versao
+
+DIMENSOES_FILTRO = ("canal", "regiao_destino", "cliente_segmento", "tipo_solvente", "certificacao_exigida")
+_DIMENSOES_INDICE = (*DIMENSOES_FILTRO, "group_id")
+# folga na busca do uploads_log por uploaded_at (relógio de quem gravou x relógio deste worker)
+_FOLGA_LOG = datetime.timedelta(minutes=5)
+
+
+@dataclass
+class _Particao:
+    ids: np.ndarray  # _id das linhas (n x 12 bytes), na ordem dos bitmaps
+    bitmaps: dict[str, dict[Any, np.ndarray]] = field(default_factory=dict)
+
+
+@dataclass
+class _Indice:
+    particoes: dict[str, _Particao] = field(default_factory=dict)
+    versao: Optional[int] = None  # versão dos dados do tipo quando o índice foi atualizado
+    alterado_em: Optional[datetime.datetime] = None  # quando essa versão foi gravada
+    log_desde: Optional[datetime.datetime] = None  # uploaded_at a partir do qual procurar uploads novos
+    verificado_em: float = 0.0
+    carregado: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+_indices: dict[str, _Indice] = {"polpa": _Indice(), "extrato": _Indice()}
+
+
+def _valor_indice(v: Any) -> Any:
+    """Chave do bitmap: campo ausente, None e NaN viram None."""
+    return None if v is None or (isinstance(v, float) and v != v) else v
+
+
+def _construir_particao(tipo: str, competencia: str) -> Optional[_Particao]:
+    # só NumPy: este caminho roda nas réplicas READ_ONLY, que não carregam pandas
+    projecao = {"_id": 1, **{d: 1 for d in _DIMENSOES_INDICE}}
+    docs = [d for col in colecoes_do_tipo(tipo) for d in col.find({"competencia": competencia}, projecao)]
+    if not docs:
+        return None
+    ids = np.frombuffer(b"".join(d["_id"].binary for d in docs), dtype=np.uint8).reshape(-1, 12)
+    particao = _Particao(ids=ids)
+    for dim in _DIMENSOES_INDICE:
+        valores: dict[Any, int] = {}
+        codigos = np.fromiter(
+            (valores.setdefault(_valor_indice(d.get(dim)), len(valores)) for d in docs),
+            dtype=np.int64,
+            count=len(docs),
+        )
+        particao.bitmaps[dim] = {v: np.packbits(codigos == i) for v, i in valores.items()}
+    return particao
+
+
+def _competencias_com_upload(tipo: str, desde: datetime.datetime) -> set[str]:
+    """Competências com entrada no uploads_log a partir de `desde` (menos a folga)."""
+    filtro = {"tipo": tipo, "uploaded_at": {"$gte": desde - _FOLGA_LOG}}
+    return {e["competencia"] for e in get_uploads_log_collection().find(filtro, {"competencia": 1})}
+
+
+def _todas_competencias(tipo: str) -> set[str]:
+    return {c for col in colecoes_do_tipo(tipo) for c in col.distinct("competencia")}
+
+
+def _atualizar(tipo: str) -> _Indice:
+    """Carga inicial (todas as competências) ou reconstrução das competências com upload novo."""
+    indice = _indices[tipo]
+    if indice.carregado and time.monotonic() - indice.verificado_em < BITMAP_VERIFICAR_S:
+        return indice
+    with indice.lock:
+        if indice.carregado and time.monotonic() - indice.verificado_em < BITMAP_VERIFICAR_S:
+            return indice
+        # versão lida antes dos dados: upload concluído durante a reconstrução muda a versão de novo
+        agora = datetime.datetime.utcnow()
+        versao, alterado_em = estado_versao(tipo)
+        particoes = dict(indice.particoes)
+        if not indice.carregado:
+            competencias = _todas_competencias(tipo)
+        elif versao == indice.versao:
+            competencias = set()
+        else:
+            competencias = _competencias_com_upload(tipo, indice.log_desde or agora)
+            if not competencias:
+                particoes = {}
+                competencias = _todas_competencias(tipo)
+        for competencia in competencias:
+            particao = _construir_particao(tipo, competencia)
+            if particao is None:
+                particoes.pop(competencia, None)
+            else:
+                particoes[competencia] = particao
+        indice.particoes = particoes
+        indice.versao, indice.alterado_em, indice.log_desde = versao, alterado_em, agora
+        indice.carregado = True
+        indice.verificado_em = time.monotonic()
+    return indice
+
+
+def invalidar(tipo: str) -> None:
+    """Força a verificação da versão na próxima consulta (upload publicado por este worker)."""
+    _indices[tipo].verificado_em = 0.0
+
+
+def _competencia_no_filtro(competencia: str, filtro: Any) -> bool:
+    if filtro is None:
+        return True
+    if isinstance(filtro, dict):
+        return ("$gte" not in filtro or competencia >= filtro["$gte"]) and (
+            "$lte" not in filtro or competencia <= filtro["$lte"]
+        )
+    return competencia == filtro
+
+
+def selecionar(tipo: str, match: dict, filtros: dict[str, list]) -> Optional[list[ObjectId]]:
+    """
+    _id das linhas que atendem competência/group_id de `match` e todos os `filtros`
+    ({dimensão: [valores]}, OU dentro da dimensão). None se passar de BITMAP_MAX_IDS linhas ou se
+    a consulta lê de secundários e os dados mudaram há menos de MONGO_MAX_STALENESS_S segundos.
+    """
+    indice = _atualizar(tipo)
+    if (
+        indice.alterado_em is not None
+        and not lendo_do_primario()
+        and datetime.datetime.utcnow() - indice.alterado_em < datetime.timedelta(seconds=MONGO_MAX_STALENESS_S)
+    ):
+        return None
+    condicoes = dict(filtros)
+    if "group_id" in match:
+        condicoes["group_id"] = [match["group_id"]]
+
+    ids: list[np.ndarray] = []
+    total = 0
+    for competencia, particao in indice.particoes.items():
+        if not _competencia_no_filtro(competencia, match.get("competencia")):
+            continue
+        selecao = np.full((len(particao.ids) + 7) // 8, 0xFF, dtype=np.uint8)
+        for dim, valores in condicoes.items():
+            por_valor = particao.bitmaps.get(dim, {})
+            alguma = np.zeros_like(selecao)
+            for v in valores:
+                if v in por_valor:
+                    alguma |= por_valor[v]
+            selecao &= alguma
+        linhas = np.unpackbits(selecao, count=len(particao.ids)).astype(bool)
+        total += int(linhas.sum())
+        if total > BITMAP_MAX_IDS:
+            return None
+        ids.append(particao.ids[linhas])
+    return [ObjectId(linha.tobytes()) for parte in ids for linha in parte]
@@ -0,0 +1,162 @@
+"""
+Cache das respostas dos endpoints de leitura, por versão dos dados.
+
+A chave junta o handler, os parâmetros e a versão dos dados do tipo (versoes_dados, incrementada a
+cada upload): um upload invalida tudo do tipo sem apagar nada, e as entradas antigas expiram pelo
+índice TTL. As respostas ficam na coleção cache_consultas, compartilhada entre os workers.
+
+Depois de cada upload, aquecer() recalcula em segundo plano as visões padrão do dashboard
+(sem período, histórico completo e últimos CACHE_AQUECER_MESES meses), lendo do primário.
+"""
+import datetime
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from fastapi.params import Depends
+from pydantic.fields import FieldInfo
+from pymongo.errors import PyMongoError
+
+from config import CACHE_CONSULTAS, CACHE_AQUECER_MESES, MONGO_MAX_STALENESS_S, TIPOS_VALIDOS
+from services import metricas, perfil
+from services.db import (
+    colecoes_do_tipo,
+    get_cache_collection,
+    get_collection,
+    ler_do_primario,
+    lendo_do_primario,
+)
+from services.eventos import estado_versao
+from services.filtros import filtros_dimensao
+
+logger = logging.getLogger(__name__)
+
+# handlers marcados com em_cache(aquecer=True): as visões padrão recalculadas após o upload
+_aquecer: list[Callable] = []
+
+
+def _versao(parametros: dict[str, Any]) -> tuple[str, Optional[datetime.datetime]]:
+    """Versão dos dados lidos pelo handler (tipo=todos ou sem tipo: os dois) e quando mudou por último."""
+    tipo = parametros.get("tipo")
+    estados = [estado_versao(t) for t in ((tipo,) if tipo in TIPOS_VALIDOS else TIPOS_VALIDOS)]
+    mudancas = [atualizado_em for _, atualizado_em in estados if atualizado_em]
+    return ".".join(str(v) for v, _ in estados), max(mudancas) if mudancas else None
+
+
+def _pode_gravar(atualizado_em: Optional[datetime.datetime]) -> bool:
+    """
+    Lendo de secundário logo depois de um upload, o resultado pode ainda não ter os dados novos:
+    só grava se a última mudança for mais antiga que o staleness máximo.
+    """
+    if atualizado_em is None or lendo_do_primario():
+        return True
+    idade = datetime.datetime.utcnow() - atualizado_em
+    return idade.total_seconds() > MONGO_MAX_STALENESS_S
+
+
+def em_cache(func: Callable | None = None, *, aquecer: bool = False):
+    """Decorator dos handlers de leitura (a assinatura continua a do handler para o FastAPI)."""
+    if func is None:
+        return functools.partial(em_cache, aquecer=aquecer)
+    nome = f"{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(**parametros):
+        if not CACHE_CONSULTAS or perfil.ativo():
+            return func(**parametros)
+        versao, atualizado_em = _versao(parametros)
+        chave = hashlib.sha1(
+            f"{nome}|{json.dumps(parametros, sort_keys=True, default=str)}|{versao}".encode()
+        ).hexdigest()
+        col = get_cache_collection()
+        doc = col.find_one({"_id": chave}, {"resposta": 1})
+        if doc:
+            metricas.incrementar("cache_hits")
+            return json.loads(doc["resposta"])
+        metricas.incrementar("cache_misses")
+        resposta = func(**parametros)
+        if _pode_gravar(atualizado_em):
+            try:
+                # JSON em texto: as respostas podem ter chaves com "." ou "$" (nomes de canal, região)
+                col.replace_one(
+                    {"_id": chave},
+                    {
+                        "handler": nome,
+                        "versao": versao,
+                        "resposta": json.dumps(resposta, default=str),
+                        "criado_em": datetime.datetime.utcnow(),
+                    },
+                    upsert=True,
+                )
+            except PyMongoError as e:
+                # ex.: réplica READ_ONLY com usuário só de leitura; a resposta segue sem cache
+                logger.debug("Cache não gravado (%s): %s", nome, e)
+        return resposta
+
+    if aquecer:
+        _aquecer.append(wrapper)
+    return wrapper
+
+
+def _chamar(handler: Callable, **valores: Any) -> Any:
+    """Chama o handler fora de uma requisição, com os mesmos padrões que o FastAPI resolveria."""
+    parametros: dict[str, Any] = {}
+    for nome, p in inspect.signature(handler).parameters.items():
+        if nome in valores:
+            parametros[nome] = valores[nome]
+        elif isinstance(p.default, Depends) and p.default.dependency is filtros_dimensao:
+            parametros[nome] = {}
+        elif isinstance(p.default, FieldInfo):
+            parametros[nome] = p.default.default
+        else:
+            parametros[nome] = p.default
+    return handler(**parametros)
+
+
+def _meses_antes(competencia: str, meses: int) -> str:
+    ano, mes = map(int, competencia.split("-"))
+    indice = ano * 12 + mes - 1 - meses
+    return f"{indice // 12:04d}-{indice % 12 + 1:02d}"
+
+
+def periodos_padrao(tipo: str, group_id: Optional[str]) -> list[tuple[Optional[str], Optional[str]]]:
+    """Intervalos (from_comp, to_comp) que o dashboard pede ao abrir: nenhum, tudo e últimos N meses."""
+    colecoes = [get_collection(tipo, group_id)] if group_id else colecoes_do_tipo(tipo)
+    filtro = {"group_id": group_id} if group_id else {}
+    competencias = sorted({c for col in colecoes for c in col.distinct("competencia", filtro) if c})
+    if not competencias:
+        return [(None, None)]
+    primeira, ultima = competencias[0], competencias[-1]
+    periodos = [(None, None), (primeira, ultima)]
+    recentes = (max(primeira, _meses_antes(ultima, CACHE_AQUECER_MESES - 1)), ultima)
+    if recentes not in periodos:
+        periodos.append(recentes)
+    return periodos
+
+
+def aquecer(tipo: str, group_id: Optional[str] = None) -> None:
+    """
+    Recalcula as visões padrão do tipo (para o group_id do upload e para a visão geral) depois de um
+    upload. Roda como tarefa em segundo plano; erros só vão para o log.
+    """
+    if not CACHE_CONSULTAS:
+        return
+    inicio = time.perf_counter()
+    visoes = 0
+    with ler_do_primario():
+        for grupo in dict.fromkeys((group_id, None)):
+            for from_comp, to_comp in periodos_padrao(tipo, grupo):
+                for handler in _aquecer:
+                    try:
+                        _chamar(handler, tipo=tipo, group_id=grupo, from_comp=from_comp, to_comp=to_comp)
+                        visoes += 1
+                    except Exception as e:
+                        logger.warning("Falha ao aquecer %s (%s, %s): %s", handler.__name__, tipo, grupo, e)
+    metricas.incrementar("cache_aquecimentos")
+    logger.info(
+        "Cache aquecido: %s, group_id=%s, %d visões em %.1f s", tipo, group_id, visoes, time.perf_counter() - inicio
+    )
@@ -0,0 +1,164 @@
+"""
+Trechos de pipeline compartilhados pelos endpoints de leitura.
+"""
+import datetime
+from typing import Any, Iterable, Literal, Optional
+
+from config import STORAGE_MODE, COLUNAS_POLPA, COLUNAS_EXTRATO
+from services.db import particoes
+
+Granularidade = Literal["dia", "semana", "mes"]
+
+_UNIDADE_DATA = {"dia": "day", "semana": "week"}
+
+
+def chave_periodo(granularidade: Granularidade) -> Any:
+    """
+    Expressão de agrupamento do período.
+    mes: competência (YYYY-MM). dia/semana: data_pedido truncada no servidor (YYYY-MM-DD;
+    semana começa na segunda-feira).
+    """
+    if granularidade == "mes":
+        return "$competencia"
+    return {
+        "$dateToString": {
+            "format": "%Y-%m-%d",
+            "date": {
+                "$dateTrunc": {
+                    "date": "$data_pedido",
+                    "unit": _UNIDADE_DATA[granularidade],
+                    "startOfWeek": "monday",
+                }
+            },
+        }
+    }
+
+
+def filtro_datas(
+    granularidade: Granularidade,
+    from_data: Optional[datetime.date] = None,
+    to_data: Optional[datetime.date] = None,
+) -> dict:
+    """
+    Filtro por data_pedido (BSON date, indexado). Em granularidade dia/semana descarta linhas sem data.
+    to_data é inclusivo (até o fim do dia).
+    """
+    match: dict = {}
+    if granularidade != "mes":
+        match["data_pedido"] = {"$type": "date"}
+    if from_data or to_data:
+        faixa = match.setdefault("data_pedido", {})
+        if from_data:
+            faixa["$gte"] = datetime.datetime.combine(from_data, datetime.time.min)
+        if to_data:
+            faixa["$lt"] = datetime.datetime.combine(to_data + datetime.timedelta(days=1), datetime.time.min)
+    return match
+
+
+# Campos guardados uma vez por bucket (STORAGE_MODE=buckets); o resto vem de "colunas"
+CAMPOS_BUCKET = ("tipo", "group_id", "competencia", "canal")
+
+
+def _colunas(tipo: str) -> list[str]:
+    return (COLUNAS_POLPA if tipo == "polpa" else COLUNAS_EXTRATO) + ["receita"]
+
+
+def _separar_match(match: dict) -> tuple[dict, dict]:
+    """Divide o filtro entre campos do bucket e campos de linha; faixa de data_pedido vira filtro em data_min/data_max."""
+    bucket = {k: v for k, v in match.items() if k in CAMPOS_BUCKET}
+    resto = {k: v for k, v in match.items() if k not in CAMPOS_BUCKET}
+    faixa = resto.get("data_pedido")
+    if isinstance(faixa, dict):
+        if "$gte" in faixa:
+            bucket["data_max"] = {"$gte": faixa["$gte"]}
+        if "$lt" in faixa:
+            bucket["data_min"] = {"$lt": faixa["$lt"]}
+    return bucket, resto
+
+
+def _todas_particoes(tipo: str, match: dict, estagios: list[dict]) -> list[dict]:
+    """
+    Com PARTICIONAMENTO e sem group_id no filtro, a consulta roda na coleção base e junta as
+    partições com $unionWith (cada uma filtrada pelos mesmos estágios, usando os próprios índices).
+    Com group_id, a rota já consulta a partição certa (get_read_collection(tipo, group_id)).
+    """
+    if "group_id" in match:
+        return estagios
+    return estagios + [{"$unionWith": {"coll": nome, "pipeline": estagios}} for nome in particoes(tipo)]
+
+
+def estagios_iniciais(tipo: str, match: dict, campos: Optional[Iterable[str]] = None) -> list[dict]:
+    """
+    Primeiros estágios de um pipeline de leitura: filtro + documentos no formato de linha.
+    Em STORAGE_MODE=buckets, desempacota só os campos em `campos` (None = todas as colunas).
+    """
+    return _todas_particoes(tipo, match, _estagios_linhas(tipo, match, campos))
+
+
+def _estagios_linhas(tipo: str, match: dict, campos: Optional[Iterable[str]]) -> list[dict]:
+    if STORAGE_MODE != "buckets":
+        return [{"$match": match}]
+    bucket_match, resto = _separar_match(match)
+    nomes = [c for c in (_colunas(tipo) if campos is None else campos) if c not in CAMPOS_BUCKET]
+    # campos filtrados por linha (dimensões, data_pedido) também precisam ser desempacotados
+    nomes += [c for c in resto if c not in nomes and not c.startswith("$")]
+    estagios: list[dict] = [
+        {"$match": bucket_match},
+        {
+            "$project": {
+                **{k: 1 for k in CAMPOS_BUCKET},
+                "linha": {
+                    "$map": {
+                        "input": {"$range": [0, "$n"]},
+                        "as": "i",
+                        "in": {c: {"$arrayElemAt": [f"$colunas.{c}", "$$i"]} for c in nomes},
+                    }
+                },
+            }
+        },
+        {"$unwind": "$linha"},
+        {"$replaceRoot": {"newRoot": {"$mergeObjects": [{k: f"${k}" for k in CAMPOS_BUCKET}, "$linha"]}}},
+    ]
+    if resto:
+        estagios.append({"$match": resto})
+    return estagios
+
+
+def estagios_resumo(tipo: str, match: dict, somas: Iterable[str] = ()) -> list[dict]:
+    """
+    Para pipelines que só agrupam por campos do bucket (competencia, canal, group_id) com $sum:
+    em buckets, cada bucket vira um documento com a soma de cada coluna em `somas`, sem $unwind.
+    A contagem de registros deve usar soma_registros().
+    """
+    if STORAGE_MODE != "buckets":
+        return _todas_particoes(tipo, match, [{"$match": match}])
+    bucket_match, resto = _separar_match(match)
+    if resto:
+        # filtro por linha (ex.: faixa de data_pedido): desempacota as somas e os campos filtrados
+        campos = [*somas, *(c for c in resto if c not in somas)]
+        return estagios_iniciais(tipo, match, campos) + [{"$set": {"_linhas": 1}}]
+    estagios = [
+        {"$match": bucket_match},
+        {
+            "$project": {
+                **{k: 1 for k in CAMPOS_BUCKET},
+                "_linhas": "$n",
+                **{c: {"$sum": f"$colunas.{c}"} for c in somas},
+            }
+        },
+    ]
+    return _todas_particoes(tipo, match, estagios)
+
+
+def soma_registros() -> dict:
+    """Acumulador de contagem de linhas compatível com estagios_resumo."""
+    if STORAGE_MODE == "buckets":
+        return {"$sum": "$_linhas"}
+    return {"$sum": 1}
+
+
+def estagios_periodo(tipo: str, match: dict, granularidade: Granularidade, somas: Iterable[str]) -> list[dict]:
+    """Estágios iniciais de séries temporais com $sum: mês usa o resumo por bucket; dia/semana precisa de data_pedido."""
+    if granularidade == "mes":
+        return estagios_resumo(tipo, match, somas)
+    return estagios_iniciais(tipo, match, ["data_pedido", *somas])
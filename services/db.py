@@ -1,37 +1,375 @@
 """
 Conexão com MongoDB.
+
+Um único MongoClient por processo, configurado via config.py (pool, timeouts,
+compressão). Uploads usam o primário; leituras analíticas usam a preferência
+de leitura configurada (secundários com staleness limitado).
+
+Com PARTICIONAMENTO, cada group_id (ou faixa de hash) tem a própria coleção física;
+get_collection/get_read_collection roteiam pelo group_id.
+
+Fork-safe: cada worker (processo filho) cria o próprio cliente após o fork.
 """
-from pymongo import MongoClient
+import contextlib
+import contextvars
+import os
+import re
+import threading
+import time
+import zlib
+
+from pymongo import ASCENDING, DESCENDING, MongoClient, monitoring, read_preferences
 from pymongo.database import Database
+from pymongo.errors import CollectionInvalid
 from pymongo.collection import Collection
-from config import MONGODB_URL, DB_NAME, POLPA_COLLECTION, EXTRATO_COLLECTION, UPLOADS_LOG_COLLECTION
+from config import (
+    MONGODB_URL,
+    DB_NAME,
+    POLPA_COLLECTION,
+    EXTRATO_COLLECTION,
+    UPLOADS_LOG_COLLECTION,
+    UPLOADS_LOG_ARQUIVO_COLLECTION,
+    SKETCHES_COLLECTION,
+    ANOMALIAS_COLLECTION,
+    EVENTOS_COLLECTION,
+    VERSOES_COLLECTION,
+    EVENTOS_CAPPED_BYTES,
+    CACHE_COLLECTION,
+    CACHE_TTL_S,
+    STORAGE_MODE,
+    PARTICIONAMENTO,
+    PARTICOES_HASH,
+    POLPA_BUCKETS_COLLECTION,
+    EXTRATO_BUCKETS_COLLECTION,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_COMPRESSORS,
+    MONGO_APP_NAME,
+    MONGO_READ_PREFERENCE,
+    MONGO_MAX_STALENESS_S,
+)
+from services.perfil import ouvinte_comandos
 
 _client: MongoClient | None = None
+_client_pid: int | None = None
+_lock = threading.Lock()
+_indices_garantidos: set[str] = set()
+_particoes_cache: dict[str, tuple[float, list[str]]] = {}
+_PARTICOES_TTL_S = 5
+_MODOS_PARTICIONAMENTO = ("nenhum", "group_id", "hash")
+_leitura_primaria: contextvars.ContextVar[bool] = contextvars.ContextVar("leitura_primaria", default=False)
+
+
+class _PoolStats(monitoring.ConnectionPoolListener):
+    """Contadores de uso do pool de conexões (todas as réplicas do cliente)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.abertas = 0
+        self.em_uso = 0
+        self.esperas_timeout = 0
+
+    def _add(self, campo: str, delta: int) -> None:
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + delta)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "abertas": self.abertas,
+                "em_uso": self.em_uso,
+                "max": MONGO_MAX_POOL_SIZE,
+                "esperas_timeout": self.esperas_timeout,
+            }
+
+    def connection_created(self, event):
+        self._add("abertas", 1)
+
+    def connection_closed(self, event):
+        self._add("abertas", -1)
+
+    def connection_check_out_failed(self, event):
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            self._add("esperas_timeout", 1)
+
+    def connection_checked_out(self, event):
+        self._add("em_uso", 1)
+
+    def connection_checked_in(self, event):
+        self._add("em_uso", -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+_pool_stats = _PoolStats()
+
+
+def _reset_apos_fork() -> None:
+    """
+    No processo filho o cliente herdado (sockets, threads de monitoramento) não é utilizável.
+    Descarta a referência sem fechar: o pai continua dono das conexões.
+    """
+    global _client, _client_pid, _lock, _pool_stats
+    _client = None
+    _client_pid = None
+    _lock = threading.Lock()
+    _pool_stats = _PoolStats()
+
+
+os.register_at_fork(after_in_child=_reset_apos_fork)
+
+_READ_PREFERENCES = {
+    "primary": read_preferences.Primary,
+    "primarypreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondarypreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+
+def read_preference_leitura():
+    """Preferência de leitura das consultas analíticas (config MONGO_READ_PREFERENCE)."""
+    cls = _READ_PREFERENCES.get(MONGO_READ_PREFERENCE.lower())
+    if cls is None:
+        raise ValueError(f"MONGO_READ_PREFERENCE inválido: {MONGO_READ_PREFERENCE}")
+    if cls is read_preferences.Primary:
+        return cls()
+    return cls(max_staleness=MONGO_MAX_STALENESS_S)
+
+
+def _criar_cliente() -> MongoClient:
+    return MongoClient(
+        MONGODB_URL,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        compressors=MONGO_COMPRESSORS or None,
+        appname=MONGO_APP_NAME,
+        retryWrites=True,
+        retryReads=True,
+        event_listeners=[_pool_stats, ouvinte_comandos],
+    )
+
+
+def get_client() -> MongoClient:
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = _criar_cliente()
+                _client_pid = pid
+    return _client
 
 
 def get_db() -> Database:
-    global _client
-    if _client is None:
-        _client = MongoClient(MONGODB_URL)
-    return _client[DB_NAME]
+    """Banco com preferência primária (escritas e leituras consistentes)."""
+    return get_client()[DB_NAME]
+
+
+def conectar() -> None:
+    """Aquecimento na subida da aplicação: cria o cliente e valida o servidor com ping."""
+    get_db().command("ping")
+
+
+def garantir_indices_colecao(col: Collection) -> None:
+    """Índices de uma coleção de linhas/buckets (base ou partição); uma vez por processo."""
+    if col.name in _indices_garantidos:
+        return
+    if STORAGE_MODE == "buckets":
+        col.create_index([("group_id", ASCENDING), ("competencia", ASCENDING), ("canal", ASCENDING)])
+        col.create_index([("competencia", ASCENDING)])
+        col.create_index([("group_id", ASCENDING), ("data_max", ASCENDING)])
+    else:
+        col.create_index([("group_id", ASCENDING), ("competencia", ASCENDING)])
+        col.create_index([("competencia", ASCENDING)])
+        col.create_index([("group_id", ASCENDING), ("data_pedido", ASCENDING)])
+        col.create_index([("data_pedido", ASCENDING)])
+    _indices_garantidos.add(col.name)
+
+
+def garantir_indices() -> None:
+    """Cria (idempotente) os índices usados pelos filtros do dashboard e pelos uploads."""
+    for tipo in ("polpa", "extrato"):
+        for col in colecoes_do_tipo(tipo):
+            _indices_garantidos.discard(col.name)
+            garantir_indices_colecao(col)
+    get_sketches_collection().create_index(
+        [("tipo", ASCENDING), ("dimensao", ASCENDING), ("competencia", ASCENDING), ("group_id", ASCENDING)]
+    )
+    get_anomalias_collection().create_index(
+        [("tipo", ASCENDING), ("group_id", ASCENDING), ("competencia", DESCENDING)]
+    )
+    uploads_log = get_uploads_log_collection()
+    uploads_log.create_index([("uploaded_at", DESCENDING), ("_id", DESCENDING)])
+    uploads_log.create_index([("tipo", ASCENDING), ("uploaded_at", DESCENDING), ("_id", DESCENDING)])
+    uploads_log.create_index([("group_id", ASCENDING), ("uploaded_at", DESCENDING), ("_id", DESCENDING)])
+    for campo in ("competencia", "source_file", "sheet_name"):
+        uploads_log.create_index([(campo, ASCENDING), ("uploaded_at", DESCENDING), ("_id", DESCENDING)])
+    uploads_log.create_index([("arquivo_lote", ASCENDING)], sparse=True)
+    get_cache_collection().create_index([("criado_em", ASCENDING)], expireAfterSeconds=CACHE_TTL_S)
+    db = get_db()
+    if EVENTOS_COLLECTION not in db.list_collection_names():
+        try:
+            db.create_collection(EVENTOS_COLLECTION, capped=True, size=EVENTOS_CAPPED_BYTES)
+        except CollectionInvalid:
+            pass  # outro worker criou ao mesmo tempo
+
+
+def fechar() -> None:
+    """Fecha o cliente (shutdown da aplicação)."""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def status_db() -> dict:
+    """Readiness do MongoDB: latência de um ping e uso do pool."""
+    inicio = time.perf_counter()
+    try:
+        get_db().command("ping")
+    except Exception as e:
+        return {"ok": False, "erro": str(e), "pool": _pool_stats.snapshot()}
+    latencia_ms = (time.perf_counter() - inicio) * 1000
+    return {"ok": True, "latencia_ms": round(latencia_ms, 2), "pool": _pool_stats.snapshot()}
 
 
 def get_polpa_collection() -> Collection:
-    return get_db()[POLPA_COLLECTION]
+    return get_collection("polpa")
 
 
 def get_extrato_collection() -> Collection:
-    return get_db()[EXTRATO_COLLECTION]
+    return get_collection("extrato")
 
 
-def get_collection(tipo: str):
-    """Retorna a coleção para o tipo (polpa ou extrato)."""
+def nome_colecao(tipo: str, group_id: str | None = None, storage_mode: str = STORAGE_MODE) -> str:
+    """
+    Coleção física do tipo para o group_id, conforme PARTICIONAMENTO:
+    nenhum -> polpa/extrato (ou *_buckets); group_id -> polpa__<group_id>; hash -> polpa__h07.
+    Linhas sem group_id ficam sempre na coleção base.
+    """
     if tipo == "polpa":
-        return get_polpa_collection()
-    if tipo == "extrato":
-        return get_extrato_collection()
-    raise ValueError(f"tipo inválido: {tipo}. Use 'polpa' ou 'extrato'.")
+        base = POLPA_BUCKETS_COLLECTION if storage_mode == "buckets" else POLPA_COLLECTION
+    elif tipo == "extrato":
+        base = EXTRATO_BUCKETS_COLLECTION if storage_mode == "buckets" else EXTRATO_COLLECTION
+    else:
+        raise ValueError(f"tipo inválido: {tipo}. Use 'polpa' ou 'extrato'.")
+    if PARTICIONAMENTO not in _MODOS_PARTICIONAMENTO:
+        raise ValueError(f"PARTICIONAMENTO inválido: {PARTICIONAMENTO}")
+    if not group_id or PARTICIONAMENTO == "nenhum":
+        return base
+    if PARTICIONAMENTO == "hash":
+        return f"{base}__h{zlib.crc32(group_id.encode()) % PARTICOES_HASH:02d}"
+    sufixo = re.sub(r"[^A-Za-z0-9_-]", "_", group_id)[:60]
+    if sufixo != group_id:
+        sufixo += f"_{zlib.crc32(group_id.encode()):08x}"  # evita colisão entre nomes normalizados
+    return f"{base}__{sufixo}"
+
+
+def get_collection(tipo: str, group_id: str | None = None) -> Collection:
+    """
+    Coleção do tipo (polpa ou extrato), conforme STORAGE_MODE (linhas ou buckets) e, com
+    particionamento, a partição do group_id. Sem group_id: a coleção base.
+    """
+    return get_db()[nome_colecao(tipo, group_id)]
+
+
+def colecoes_do_tipo(tipo: str, storage_mode: str = STORAGE_MODE) -> list[Collection]:
+    """Coleção base + todas as partições existentes do tipo (manutenção, migrações)."""
+    base = nome_colecao(tipo, storage_mode=storage_mode)
+    db = get_db()
+    nomes = db.list_collection_names(filter={"name": {"$regex": f"^{re.escape(base)}__"}})
+    return [db[base], *(db[n] for n in sorted(nomes))]
+
+
+def particoes(tipo: str) -> list[str]:
+    """
+    Nomes das partições do tipo (sem a base), para as leituras sem group_id juntarem tudo.
+    A lista de coleções é relida a cada _PARTICOES_TTL_S segundos.
+    """
+    if PARTICIONAMENTO == "nenhum":
+        return []
+    agora = time.monotonic()
+    base = nome_colecao(tipo)
+    em_cache = _particoes_cache.get(base)
+    if em_cache is None or agora - em_cache[0] > _PARTICOES_TTL_S:
+        em_cache = (agora, [c.name for c in colecoes_do_tipo(tipo)[1:]])
+        _particoes_cache[base] = em_cache
+    return em_cache[1]
+
+
+@contextlib.contextmanager
+def ler_do_primario():
+    """Dentro do bloco, get_read_collection lê do primário (ex.: recalcular logo depois de um upload)."""
+    token = _leitura_primaria.set(True)
+    try:
+        yield
+    finally:
+        _leitura_primaria.reset(token)
+
+
+def lendo_do_primario() -> bool:
+    return _leitura_primaria.get() or isinstance(read_preference_leitura(), read_preferences.Primary)
+
+
+def get_read_collection(tipo: str, group_id: str | None = None) -> Collection:
+    """Coleção (ou partição) do tipo para consultas do dashboard, roteada conforme MONGO_READ_PREFERENCE."""
+    if _leitura_primaria.get():
+        return get_collection(tipo, group_id)
+    return get_collection(tipo, group_id).with_options(read_preference=read_preference_leitura())
 
 
 def get_uploads_log_collection() -> Collection:
     return get_db()[UPLOADS_LOG_COLLECTION]
+
+
+def get_uploads_log_arquivo_collection() -> Collection:
+    return get_db()[UPLOADS_LOG_ARQUIVO_COLLECTION]
+
+
+def get_sketches_collection() -> Collection:
+    return get_db()[SKETCHES_COLLECTION]
+
+
+def get_anomalias_collection() -> Collection:
+    return get_db()[ANOMALIAS_COLLECTION]
+
+
+def get_eventos_collection() -> Collection:
+    return get_db()[EVENTOS_COLLECTION]
+
+
+def get_versoes_collection() -> Collection:
+    return get_db()[VERSOES_COLLECTION]
+
+
+def get_cache_collection() -> Collection:
+    return get_db()[CACHE_COLLECTION]
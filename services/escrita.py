@@ -0,0 +1,90 @@
+"""
+Gravação em massa dos documentos de uma competência (uploads e scripts de carga).
+
+Os documentos são divididos em lotes de INSERCAO_LOTE, enviados como insert_many não ordenado
+por INSERCAO_THREADS conexões do pool ao mesmo tempo, com o write concern de INSERCAO_W/INSERCAO_J
+(sem eles, o padrão do servidor). Lote que falhar por erro transitório (rede, troca de primário,
+timeout do write concern) é reenviado; documentos que já tinham sido gravados na tentativa anterior
+voltam como chave duplicada e são ignorados. Antes de cada lote, services.admissao.aguardar_lote aplica o limite de
+vazão (INSERCAO_DOCS_POR_S) e a prioridade das leituras do worker.
+"""
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError
+from pymongo.write_concern import WriteConcern
+
+from config import INSERCAO_J, INSERCAO_LOTE, INSERCAO_TENTATIVAS, INSERCAO_THREADS, INSERCAO_W
+from services.admissao import aguardar_lote
+
+ESPERA_BASE_S = 0.5
+
+
+def write_concern() -> Optional[WriteConcern]:
+    """Write concern de INSERCAO_W/INSERCAO_J; None (o da coleção/servidor) se nenhum for definido."""
+    if not INSERCAO_W and not INSERCAO_J:
+        return None
+    w: Any = (int(INSERCAO_W) if INSERCAO_W.isdigit() else INSERCAO_W) or None
+    j: Optional[bool] = INSERCAO_J.lower() in ("1", "true", "sim") if INSERCAO_J else None
+    return WriteConcern(w=w, j=j)
+
+
+def _gravar_lote(collection, docs: list[dict[str, Any]]) -> tuple[int, float]:
+    """Grava um lote; devolve quantas vezes precisou reenviar e os segundos de espera pela admissão."""
+    espera = aguardar_lote(len(docs))
+    for tentativa in range(INSERCAO_TENTATIVAS):
+        try:
+            collection.insert_many(docs, ordered=False)
+            return tentativa, espera
+        except BulkWriteError as e:
+            erros = [err for err in e.details.get("writeErrors", []) if err["code"] != 11000]
+            if erros:
+                raise  # documento rejeitado (validação etc.): reenviar não resolve
+            if not e.details.get("writeConcernErrors"):
+                return tentativa, espera  # só duplicados: o lote já estava gravado
+            if tentativa == INSERCAO_TENTATIVAS - 1:
+                raise
+        except AutoReconnect:
+            if tentativa == INSERCAO_TENTATIVAS - 1:
+                raise
+        time.sleep(ESPERA_BASE_S * 2 ** tentativa)
+    return INSERCAO_TENTATIVAS - 1, espera
+
+
+def inserir_em_lotes(
+    collection,
+    docs: list[dict[str, Any]],
+    lote: int = INSERCAO_LOTE,
+    threads: int = INSERCAO_THREADS,
+) -> dict[str, Any]:
+    """
+    Insere docs em lotes paralelos. Retorna documentos, lotes, reenvios, segundos, docs_por_s e
+    espera_s (tempo parado pelo limite de vazão/leituras, somado entre os lotes).
+    Levanta a exceção do primeiro lote que não pôde ser gravado.
+    """
+    inicio = time.perf_counter()
+    wc = write_concern()
+    colecao = collection.with_options(write_concern=wc) if wc else collection
+    lotes = [docs[i:i + lote] for i in range(0, len(docs), lote)]
+    for d in docs:
+        if "_id" not in d:
+            d["_id"] = ObjectId()  # fixo entre tentativas: o reenvio de um lote não duplica documentos
+    if len(lotes) <= 1 or threads <= 1:
+        resultados = [_gravar_lote(colecao, parte) for parte in lotes]
+    else:
+        with ThreadPoolExecutor(max_workers=min(threads, len(lotes))) as pool:
+            # cada lote roda com o contexto da requisição (perfil, se ativo)
+            futuros = [pool.submit(contextvars.copy_context().run, _gravar_lote, colecao, parte) for parte in lotes]
+            resultados = [f.result() for f in futuros]
+    segundos = time.perf_counter() - inicio
+    return {
+        "documentos": len(docs),
+        "lotes": len(lotes),
+        "reenvios": sum(r for r, _ in resultados),
+        "segundos": round(segundos, 3),
+        "docs_por_s": round(len(docs) / segundos) if segundos > 0 else None,
+        "espera_s": round(sum(e for _, e in resultados), 3),
+    }
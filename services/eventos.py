@@ -0,0 +1,148 @@
+"""
+Eventos de atualização dos dados (uploads concluídos) e versão dos dados por tipo.
+
+Cada upload incrementa a versão do tipo (coleção versoes_dados) e grava um evento compacto na
+coleção capped "eventos". Em cada worker, uma thread acompanha essa coleção com cursor tailable
+e repassa os eventos para as conexões SSE abertas (/api/events), então todos os workers recebem
+os uploads feitos em qualquer um deles.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from bson import ObjectId
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import PyMongoError
+
+from services.db import get_eventos_collection, get_versoes_collection
+
+logger = logging.getLogger(__name__)
+
+
+def proxima_versao(tipo: str) -> int:
+    doc = get_versoes_collection().find_one_and_update(
+        {"_id": tipo},
+        {"$inc": {"versao": 1}, "$set": {"atualizado_em": datetime.datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc["versao"]
+
+
+def versao_atual(tipo: str) -> int:
+    return estado_versao(tipo)[0]
+
+
+def estado_versao(tipo: str) -> tuple[int, Optional[datetime.datetime]]:
+    """(versão, quando mudou) dos dados do tipo."""
+    doc = get_versoes_collection().find_one({"_id": tipo})
+    return (doc["versao"], doc.get("atualizado_em")) if doc else (0, None)
+
+
+def publicar_upload(
+    tipo: str,
+    competencia: str,
+    group_id: Optional[str],
+    linhas_importadas: int,
+    linhas_substituidas: int,
+    kpis: Optional[dict] = None,
+) -> dict[str, Any]:
+    """Nova versão do tipo + evento "upload" (com os KPIs da competência antes/depois, se informados)."""
+    evento: dict[str, Any] = {
+        "evento": "upload",
+        "tipo": tipo,
+        "group_id": group_id,
+        "competencia": competencia,
+        "versao": proxima_versao(tipo),
+        "linhas_importadas": linhas_importadas,
+        "linhas_substituidas": linhas_substituidas,
+        "criado_em": datetime.datetime.utcnow(),
+    }
+    if kpis:
+        evento["kpis"] = kpis
+    get_eventos_collection().insert_one(evento)
+    return evento
+
+
+def desde(ultimo_id: ObjectId) -> list[dict[str, Any]]:
+    """
+    Eventos gravados depois de ultimo_id na coleção capped (reconexão com Last-Event-ID).
+    A posição vem da ordem de inserção ($natural), não da comparação de _ids: os ObjectIds são
+    gerados em cada cliente e não crescem em ordem entre workers e scripts. Se ultimo_id já saiu
+    da coleção, todos os eventos restantes são posteriores a ele.
+    """
+    retidos = list(get_eventos_collection().find({}).sort("$natural", 1))
+    for i, evento in enumerate(retidos):
+        if evento["_id"] == ultimo_id:
+            return retidos[i + 1:]
+    return retidos
+
+
+class _Transmissor:
+    """Uma thread por worker lendo a coleção capped; cada assinante é uma asyncio.Queue."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assinantes: dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def assinar(self) -> asyncio.Queue:
+        fila: asyncio.Queue = asyncio.Queue(maxsize=100)
+        with self._lock:
+            self._assinantes[fila] = asyncio.get_running_loop()
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._acompanhar, name="eventos-sse", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+        return fila
+
+    def cancelar(self, fila: asyncio.Queue) -> None:
+        with self._lock:
+            self._assinantes.pop(fila, None)
+
+    def _entregar(self, evento: dict[str, Any]) -> None:
+        with self._lock:
+            assinantes = list(self._assinantes.items())
+        for fila, loop in assinantes:
+            # assinante lento perde eventos em vez de segurar a thread; o cliente refaz as consultas
+            try:
+                loop.call_soon_threadsafe(lambda f=fila: f.full() or f.put_nowait(evento))
+            except RuntimeError:
+                # loop do assinante já fechado (shutdown ou reload do worker)
+                self.cancelar(fila)
+
+    def _acompanhar(self) -> None:
+        col = get_eventos_collection()
+        ultimo = None  # _id do último evento entregue; a posição na coleção é o que conta
+        iniciado = False
+        while True:
+            try:
+                if not iniciado:
+                    # só os eventos gravados daqui em diante (coleção vazia: todos)
+                    mais_recente = next(col.find({}, {"_id": 1}).sort("$natural", -1).limit(1), None)
+                    ultimo = mais_recente["_id"] if mais_recente else None
+                    iniciado = True
+                # o cursor tailable percorre a coleção em ordem de inserção; pula até o último entregue
+                # (se ele já saiu da coleção, todos os eventos restantes são novos)
+                pulando = ultimo is not None and col.count_documents({"_id": ultimo}, limit=1) > 0
+                cursor = col.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    for evento in cursor:
+                        if pulando:
+                            pulando = evento["_id"] != ultimo
+                            continue
+                        ultimo = evento["_id"]
+                        self._entregar(evento)
+                    time.sleep(0.1)
+            except PyMongoError as e:
+                logger.warning("Falha ao acompanhar eventos: %s", e)
+            # coleção vazia ou cursor encerrado: tenta de novo em seguida
+            time.sleep(1)
+
+
+transmissor = _Transmissor()
@@ -3,6 +3,7 @@ Leitura, validação e normalização de planilhas Excel para importação (polp
 """
 import io
 import datetime
+import numpy as np
 import pandas as pd
 from typing import Any, Literal
 
@@ -10,7 +11,9 @@ from config import (
     COLUNAS_POLPA,
     COLUNAS_EXTRATO,
     ALLOWED_EXTENSIONS,
+    ERROS_LINHA_MAX,
 )
+from services.receita import receita_linha, receita_serie, versao_formula
 
 TipoPlanilha = Literal["polpa", "extrato"]
 
@@ -78,17 +81,22 @@ def _extrair_tipo_da_aba(nome_aba: str) -> TipoPlanilha | None:
     return None
 
 
-def ler_excel(content: bytes, filename: str) -> tuple[pd.DataFrame | None, list[str]]:
+def ler_excel(
+    content: bytes,
+    filename: str,
+    max_linhas: int | None = None,
+) -> tuple[pd.DataFrame | None, list[str]]:
     """
     Lê o Excel/CSV (primeira aba no caso de xlsx).
     Normaliza nomes das colunas para minúsculas.
+    max_linhas limita a leitura às primeiras linhas (prévia/amostra).
     """
     erros: list[str] = []
     try:
         if filename.lower().endswith(".csv"):
-            df = pd.read_csv(io.BytesIO(content), encoding="utf-8")
+            df = pd.read_csv(io.BytesIO(content), encoding="utf-8", nrows=max_linhas)
         else:
-            df = pd.read_excel(io.BytesIO(content), sheet_name=0)
+            df = pd.read_excel(io.BytesIO(content), sheet_name=0, nrows=max_linhas)
     except Exception as e:
         erros.append(f"Erro ao ler arquivo: {e}")
         return None, erros
@@ -105,11 +113,13 @@ def ler_excel_todas_abas(
     content: bytes,
     filename: str,
     year: int,
+    max_linhas: int | None = None,
 ) -> list[tuple[str, pd.DataFrame, TipoPlanilha, str]]:
     """
     Lê todas as abas do Excel. Para cada aba: infere tipo (Polpa/Extrato) e mês pelo nome.
     Retorna lista de (nome_aba, df, tipo, competencia).
     Abas cujo nome não contiver 'polpa' ou 'extrato', ou não tiver mês (Jan-Dez), são ignoradas.
+    max_linhas limita a leitura às primeiras linhas de cada aba (prévia/amostra).
     """
     if filename.lower().endswith(".csv"):
         return []
@@ -124,7 +134,7 @@ def ler_excel_todas_abas(
         if tipo is None or mes is None:
             continue
         try:
-            df = pd.read_excel(xl, sheet_name=sheet_name)
+            df = pd.read_excel(xl, sheet_name=sheet_name, nrows=max_linhas)
         except Exception:
             continue
         if df is None or df.empty:
@@ -135,44 +145,177 @@ def ler_excel_todas_abas(
     return result
 
 
-def limpar_e_normalizar(df: pd.DataFrame, tipo: TipoPlanilha) -> pd.DataFrame:
+def contar_linhas_abas(content: bytes, filename: str) -> dict[str, int | None]:
+    """
+    Linhas de dados (sem cabeçalho) por aba, sem ler as células.
+    CSV: conta quebras de linha (chave ""). xlsx: dimensão gravada em cada aba (None se ausente).
+    """
+    if filename.lower().endswith(".csv"):
+        linhas = content.count(b"\n") + (0 if content.endswith(b"\n") else 1)
+        return {"": max(linhas - 1, 0)}
+    try:
+        import openpyxl
+        wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True)
+    except Exception:
+        return {}
+    try:
+        return {ws.title: (ws.max_row - 1 if ws.max_row else None) for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+
+def abas_reconhecidas(content: bytes, filename: str, year: int) -> list[tuple[str, TipoPlanilha, str]]:
+    """(nome_aba, tipo, competencia) das abas que ler_excel_todas_abas importaria, sem ler as células."""
+    abas: list[tuple[str, TipoPlanilha, str]] = []
+    for sheet_name in contar_linhas_abas(content, filename):
+        tipo = _extrair_tipo_da_aba(sheet_name)
+        mes = _extrair_mes_da_aba(sheet_name)
+        if tipo is not None and mes is not None:
+            abas.append((sheet_name, tipo, f"{year:04d}-{mes:02d}"))
+    return abas
+
+
+# Colunas numéricas por tipo
+NUMERICAS: dict[str, list[str]] = {
+    "polpa": [
+        "quantidade_kg", "preco_unitario_brl_kg", "logistica_brl", "desconto_brl",
+        "indice_qualidade_1a10", "perda_processamento_pct", "nps_0a10",
+    ],
+    "extrato": [
+        "quantidade_litros", "preco_unitario_brl_l", "concentracao_ativa_pct",
+        "indice_cor_1a10", "indice_pureza_1a10", "nps_0a10",
+    ],
+}
+
+# Faixas válidas das notas (validação; o valor é mantido)
+FAIXAS_NOTAS: dict[str, tuple[float, float]] = {
+    "indice_qualidade_1a10": (1, 10),
+    "indice_cor_1a10": (1, 10),
+    "indice_pureza_1a10": (1, 10),
+    "nps_0a10": (0, 10),
+}
+
+QUANTIDADES = ("quantidade_kg", "quantidade_litros")
+
+
+def _relatorio_vazio() -> dict[str, Any]:
+    return {"total": 0, "celulas": 0, "itens": [], "truncado": False}
+
+
+def limpar_e_validar(
+    df: pd.DataFrame,
+    tipo: TipoPlanilha,
+    aba: str | None = None,
+) -> tuple[pd.DataFrame, dict[str, Any]]:
     """
     Mantém apenas colunas do contrato do tipo, remove linhas vazias,
-    converte numéricos e troca NaN por None.
+    converte numéricos e datas e troca NaN por None.
+
+    Retorna também o relatório de erros por linha (sem loops por linha):
+    { total (linhas com erro), celulas (células com erro), itens: [{aba, linha, coluna, motivo, valor}],
+    truncado }, com no máximo ERROS_LINHA_MAX itens (um por célula).
+    Motivos: nao_numerico, fora_da_faixa (notas 1-10 / NPS 0-10), quantidade_negativa, data_invalida.
+    `linha` é a linha na planilha (cabeçalho = linha 1).
     """
-    obrigatorias = _colunas_obrigatorias(tipo)
-    cols_presentes = [c for c in df.columns if _normalizar_nome_coluna(c) in [x.lower() for x in obrigatorias]]
+    obrigatorias = {c.lower() for c in _colunas_obrigatorias(tipo)}
+    cols_presentes = [c for c in df.columns if _normalizar_nome_coluna(c) in obrigatorias]
     if not cols_presentes:
-        return pd.DataFrame()
-    df = df[cols_presentes].copy()
-
-    df = df.dropna(how="all")
-    df = df[df.astype(str).ne("").any(axis=1)]
-
-    # Colunas numéricas por tipo
-    if tipo == "polpa":
-        numericas = [
-            "quantidade_kg", "preco_unitario_brl_kg", "logistica_brl", "desconto_brl",
-            "indice_qualidade_1a10", "perda_processamento_pct", "nps_0a10",
-        ]
-    else:
-        numericas = [
-            "quantidade_litros", "preco_unitario_brl_l", "concentracao_ativa_pct",
-            "indice_cor_1a10", "indice_pureza_1a10", "nps_0a10",
-        ]
-    for col in numericas:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
+        return pd.DataFrame(), _relatorio_vazio()
+    df = df[cols_presentes]
+
+    # Célula vazia = NaN ou texto "" (só nas colunas de texto; sem astype(str) da planilha inteira)
+    vazias = df.isna()
+    for col in df.columns[df.dtypes == object]:
+        vazias[col] |= df[col].eq("")
+    manter = ~vazias.all(axis=1)
+    df = df[manter].copy()
+    vazias = vazias[manter]
+
+    ocorrencias: list[tuple[np.ndarray, str, str]] = []
+
+    def _registrar(col: str, motivo: str, mascara: pd.Series) -> None:
+        posicoes = np.flatnonzero(mascara.to_numpy())
+        if posicoes.size:
+            ocorrencias.append((posicoes, col, motivo))
+
+    originais: dict[str, pd.Series] = {}
+    for col in NUMERICAS[tipo]:
+        if col not in df.columns:
+            continue
+        originais[col] = df[col]
+        convertida = pd.to_numeric(df[col], errors="coerce")
+        _registrar(col, "nao_numerico", convertida.isna() & ~vazias[col])
+        if col in FAIXAS_NOTAS:
+            minimo, maximo = FAIXAS_NOTAS[col]
+            _registrar(col, "fora_da_faixa", (convertida < minimo) | (convertida > maximo))
+        if col in QUANTIDADES:
+            _registrar(col, "quantidade_negativa", convertida < 0)
+        df[col] = convertida
+
+    # data_pedido vira data nativa (BSON date); texto aceita ISO ou dd/mm/aaaa
+    if "data_pedido" in df.columns:
+        originais["data_pedido"] = df["data_pedido"]
+        datas = pd.to_datetime(df["data_pedido"], errors="coerce", format="mixed", dayfirst=True)
+        _registrar("data_pedido", "data_invalida", datas.isna() & ~vazias["data_pedido"])
+        df["data_pedido"] = datas
+
+    relatorio = _relatorio_vazio()
+    if ocorrencias:
+        posicoes = np.concatenate([o[0] for o in ocorrencias])
+        ids_ocorrencia = np.repeat(np.arange(len(ocorrencias)), [o[0].size for o in ocorrencias])
+        ordem = np.argsort(posicoes, kind="stable")[:ERROS_LINHA_MAX]
+        numeros_linha = df.index.to_numpy()
+        itens = []
+        for pos, oc in zip(posicoes[ordem].tolist(), ids_ocorrencia[ordem].tolist()):
+            _, col, motivo = ocorrencias[oc]
+            itens.append({
+                "aba": aba,
+                "linha": int(numeros_linha[pos]) + 2 if isinstance(numeros_linha[pos], (int, np.integer)) else None,
+                "coluna": col,
+                "motivo": motivo,
+                "valor": str(originais[col].iloc[pos]),
+            })
+        relatorio = {
+            "total": int(np.unique(posicoes).size),
+            "celulas": int(posicoes.size),
+            "itens": itens,
+            "truncado": posicoes.size > len(itens),
+        }
 
     df = df.where(pd.notna(df), None)
-    return df
+    return df, relatorio
+
+
+def limpar_e_normalizar(df: pd.DataFrame, tipo: TipoPlanilha) -> pd.DataFrame:
+    """
+    Mantém apenas colunas do contrato do tipo, remove linhas vazias,
+    converte numéricos e troca NaN por None.
+    """
+    df_limpo, _ = limpar_e_validar(df, tipo)
+    return df_limpo
+
+
+def juntar_relatorios(relatorios: list[dict[str, Any]]) -> dict[str, Any]:
+    """Combina relatórios de erros de várias abas respeitando ERROS_LINHA_MAX."""
+    celulas = sum(r["celulas"] for r in relatorios)
+    itens = [item for r in relatorios for item in r["itens"]][:ERROS_LINHA_MAX]
+    return {
+        "total": sum(r["total"] for r in relatorios),
+        "celulas": celulas,
+        "itens": itens,
+        "truncado": celulas > len(itens),
+    }
 
 
 def _valor_nativo(v: Any) -> Any:
-    if v is None or (isinstance(v, float) and pd.isna(v)):
+    if v is None or v is pd.NaT or (isinstance(v, float) and pd.isna(v)):
         return None
-    if isinstance(v, (pd.Timestamp, datetime.datetime)):
-        return v.isoformat() if hasattr(v, "isoformat") else str(v)
+    if isinstance(v, pd.Timestamp):
+        return v.tz_convert(None).to_pydatetime() if v.tzinfo else v.to_pydatetime()
+    if isinstance(v, datetime.datetime):
+        return v
+    if isinstance(v, datetime.date):
+        return datetime.datetime.combine(v, datetime.time.min)
     if hasattr(v, "item"):
         return v.item()
     if isinstance(v, (int, float, str, bool)):
@@ -180,27 +323,6 @@ def _valor_nativo(v: Any) -> Any:
     return str(v)
 
 
-def _calcular_receita(row: dict, tipo: TipoPlanilha) -> float | None:
-    """Calcula receita para KPIs/gráficos (armazenada no documento)."""
-    try:
-        if tipo == "polpa":
-            q = row.get("quantidade_kg")
-            p = row.get("preco_unitario_brl_kg")
-            log = row.get("logistica_brl") or 0
-            desc = row.get("desconto_brl") or 0
-            if q is None or p is None:
-                return None
-            return float(q) * float(p) - float(log) - float(desc)
-        else:
-            q = row.get("quantidade_litros")
-            p = row.get("preco_unitario_brl_l")
-            if q is None or p is None:
-                return None
-            return float(q) * float(p)
-    except (TypeError, ValueError):
-        return None
-
-
 def dataframe_para_documentos(
     df: pd.DataFrame,
     competencia: str,
@@ -209,15 +331,18 @@ def dataframe_para_documentos(
     group_id: str | None = None,
 ) -> list[dict[str, Any]]:
     """
-    Converte cada linha em documento MongoDB com metadados e campo receita (calculado).
+    Converte cada linha em documento MongoDB com metadados e campo receita (calculado pela
+    fórmula atual do tipo, registrada em receita_versao).
     """
     uploaded_at = datetime.datetime.utcnow()
+    versao = versao_formula(tipo)
     docs: list[dict[str, Any]] = []
     for _, row in df.iterrows():
         d = {k: _valor_nativo(v) for k, v in row.to_dict().items()}
-        receita = _calcular_receita(d, tipo)
+        receita = receita_linha(d, tipo)
         if receita is not None:
             d["receita"] = round(receita, 2)
+        d["receita_versao"] = versao
         d["competencia"] = competencia
         d["source_file"] = source_file
         d["uploaded_at"] = uploaded_at
@@ -226,3 +351,31 @@ def dataframe_para_documentos(
             d["group_id"] = group_id
         docs.append(d)
     return docs
+
+
+def estatisticas_previa(
+    df: pd.DataFrame,
+    tipo: TipoPlanilha,
+    linhas_totais: int | None = None,
+    linhas_lidas: int | None = None,
+) -> dict[str, Any]:
+    """
+    Estatísticas da prévia (dry run) de uma planilha já limpa.
+    Amostra: só quando a leitura parou no limite de linhas. linhas_lidas são as linhas lidas antes da
+    limpeza e linhas_totais as do arquivo; linhas, receita e quantidade são extrapoladas pela razão.
+    """
+    n = len(df)
+    amostra = bool(linhas_totais and linhas_lidas and linhas_totais > linhas_lidas)
+    fator = linhas_totais / linhas_lidas if amostra else 1.0
+    total = round(n * fator)
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
+    receita = float(receita_serie(df, tipo).sum())
+    quantidade = float(pd.to_numeric(df[campo_qtd], errors="coerce").sum()) if campo_qtd in df.columns else 0.0
+    return {
+        "linhas_lidas": n,
+        "linhas_estimadas": total,
+        "amostra": amostra,
+        "receita_total": round(receita * fator, 2),
+        campo_qtd: round(quantidade * fator, 2),
+        "nulos_pct": {c: round(float(v) * 100, 2) for c, v in df.isna().mean().items()},
+    }
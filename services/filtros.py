@@ -0,0 +1,50 @@
+"""
+Filtros de dimensão aceitos pelos endpoints de leitura (canal, regiao_destino, cliente_segmento,
+tipo_solvente, certificacao_exigida). Vários valores na mesma dimensão = OU; dimensões diferentes = E.
+"(não informado)" seleciona as linhas sem valor.
+"""
+from typing import Optional
+
+from fastapi import Query
+
+from config import STORAGE_MODE, BITMAP_INDEX
+from services import bitmaps
+
+NAO_INFORMADO = "(não informado)"
+
+
+def filtros_dimensao(
+    canal: Optional[list[str]] = Query(None, description="Filtrar por canal (repetir para vários)"),
+    regiao_destino: Optional[list[str]] = Query(None, description="Filtrar por região de destino"),
+    cliente_segmento: Optional[list[str]] = Query(None, description="Filtrar por segmento de cliente"),
+    tipo_solvente: Optional[list[str]] = Query(None, description="Extrato: filtrar por tipo de solvente"),
+    certificacao_exigida: Optional[list[str]] = Query(None, description="Extrato: filtrar por certificação"),
+) -> dict[str, list]:
+    """Dependência FastAPI: {dimensão: [valores]} só com as dimensões informadas."""
+    informados = {
+        "canal": canal,
+        "regiao_destino": regiao_destino,
+        "cliente_segmento": cliente_segmento,
+        "tipo_solvente": tipo_solvente,
+        "certificacao_exigida": certificacao_exigida,
+    }
+    return {
+        dim: [None if v == NAO_INFORMADO else v for v in valores]
+        for dim, valores in informados.items()
+        if valores
+    }
+
+
+def filtro_dimensoes(tipo: str, match: dict, filtros: dict[str, list]) -> dict:
+    """
+    Condições extras para o $match. Com o índice de bitmaps (STORAGE_MODE=linhas), a conjunção é
+    resolvida em memória e vira {"_id": {"$in": [...]}}; seleções grandes, ou em buckets, usam
+    os próprios campos ({"canal": {"$in": [...]}, ...}).
+    """
+    if not filtros:
+        return {}
+    if BITMAP_INDEX and STORAGE_MODE != "buckets":
+        ids = bitmaps.selecionar(tipo, match, filtros)
+        if ids is not None:
+            return {"_id": {"$in": ids}}
+    return {dim: {"$in": valores} for dim, valores in filtros.items()}
@@ -0,0 +1,130 @@
+"""
+Histórico de uploads (uploads_log): paginação por cursor e retenção.
+
+A linha do tempo é ordenada por (uploaded_at, _id) decrescente e paginada por keyset: o cursor
+guarda a última posição lida, então cada página é uma varredura curta no índice, qualquer que seja
+o tamanho do histórico. Entradas mais antigas que UPLOADS_RETENCAO_DIAS são resumidas em
+uploads_log_arquivo (um documento por tipo/group_id/competência) e removidas do log.
+
+O arquivamento é idempotente: as entradas são marcadas com o lote da execução antes de serem
+resumidas, cada resumo registra os lotes já somados e só as entradas do lote são removidas. Uma
+execução interrompida é concluída pela próxima sem somar nada duas vezes.
+"""
+import base64
+import datetime
+from typing import Any, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from services.db import get_uploads_log_arquivo_collection, get_uploads_log_collection
+
+ORDEM = [("uploaded_at", -1), ("_id", -1)]
+
+
+def codificar_cursor(doc: dict[str, Any]) -> str:
+    texto = f"{doc['uploaded_at'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(texto.encode()).decode()
+
+
+def filtro_cursor(cursor: str) -> dict[str, Any]:
+    """Condição para os uploads depois (mais antigos) da posição do cursor. ValueError se inválido."""
+    try:
+        data, _, id_texto = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        uploaded_at = datetime.datetime.fromisoformat(data)
+        ultimo_id = ObjectId(id_texto)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise ValueError("cursor inválido") from e
+    return {
+        "$or": [
+            {"uploaded_at": {"$lt": uploaded_at}},
+            {"uploaded_at": uploaded_at, "_id": {"$lt": ultimo_id}},
+        ]
+    }
+
+
+def filtro_historico(
+    tipo: Optional[str] = None,
+    group_id: Optional[str] = None,
+    from_comp: Optional[str] = None,
+    to_comp: Optional[str] = None,
+    source_file: Optional[str] = None,
+    sheet_name: Optional[str] = None,
+) -> dict[str, Any]:
+    match: dict[str, Any] = {}
+    if tipo:
+        match["tipo"] = tipo
+    if group_id:
+        match["group_id"] = group_id
+    if from_comp or to_comp:
+        match["competencia"] = {}
+        if from_comp:
+            match["competencia"]["$gte"] = from_comp
+        if to_comp:
+            match["competencia"]["$lte"] = to_comp
+    if source_file:
+        match["source_file"] = source_file
+    if sheet_name:
+        match["sheet_name"] = sheet_name
+    return match
+
+
+def arquivar_uploads(dias: int) -> dict[str, int]:
+    """
+    Resume no arquivo as entradas do log com mais de `dias` dias (quantidade de uploads, primeiro e
+    último upload, linhas e arquivos por tipo/group_id/competência) e as remove do uploads_log.
+    Pode rodar de novo: os resumos são somados aos que já existem, uma vez por lote.
+    """
+    limite = datetime.datetime.utcnow() - datetime.timedelta(days=dias)
+    log = get_uploads_log_collection()
+    log.update_many(
+        {"uploaded_at": {"$lt": limite}, "arquivo_lote": {"$exists": False}},
+        {"$set": {"arquivo_lote": ObjectId()}},
+    )
+    total_resumos = removidos = 0
+    # inclui lotes de execuções interrompidas
+    for lote in log.distinct("arquivo_lote"):
+        total_resumos += _somar_lote(lote)
+        removidos += log.delete_many({"arquivo_lote": lote}).deleted_count
+    return {"resumos": total_resumos, "removidos": removidos}
+
+
+def _somar_lote(lote: ObjectId) -> int:
+    """Soma as entradas do lote nos resumos que ainda não o registram."""
+    resumos = get_uploads_log_collection().aggregate([
+        {"$match": {"arquivo_lote": lote}},
+        {
+            "$group": {
+                "_id": {"tipo": "$tipo", "group_id": "$group_id", "competencia": "$competencia"},
+                "uploads": {"$sum": 1},
+                "primeiro_upload": {"$min": "$uploaded_at"},
+                "ultimo_upload": {"$max": "$uploaded_at"},
+                "linhas_importadas": {"$sum": "$linhas_importadas"},
+                "linhas_com_erro": {"$sum": "$linhas_com_erro"},
+                "arquivos": {"$addToSet": "$source_file"},
+            }
+        },
+    ])
+    operacoes = [
+        UpdateOne(
+            {"_id": r["_id"], "lotes": {"$ne": lote}},
+            {
+                "$inc": {k: r[k] for k in ("uploads", "linhas_importadas", "linhas_com_erro")},
+                "$min": {"primeiro_upload": r["primeiro_upload"]},
+                "$max": {"ultimo_upload": r["ultimo_upload"]},
+                "$addToSet": {"arquivos": {"$each": r["arquivos"]}, "lotes": lote},
+            },
+            upsert=True,
+        )
+        for r in resumos
+    ]
+    if operacoes:
+        try:
+            get_uploads_log_arquivo_collection().bulk_write(operacoes, ordered=False)
+        except BulkWriteError as e:
+            # chave duplicada no upsert = resumo que já tem o lote (somado antes da interrupção)
+            if any(err["code"] != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+    return len(operacoes)
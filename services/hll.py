@@ -0,0 +1,59 @@
+"""
+HyperLogLog para contagem aproximada de valores distintos (ex.: lote_id).
+
+Registradores são bytes (um por registrador); mesclar sketches é o máximo elemento a elemento,
+então meses, canais e tenants se combinam sem reler as linhas. Erro padrão ≈ 1,04/√m.
+"""
+import numpy as np
+
+# 2^14 registradores (16 KB por sketch), erro padrão ≈ 0,81%. Não alterar sem reconstruir os sketches.
+PRECISAO = 14
+M = 1 << PRECISAO
+ERRO_PADRAO = 1.04 / np.sqrt(M)
+
+_BITS_RESTO = 64 - PRECISAO
+
+
+def registradores(valores, grupos: np.ndarray | None = None, n_grupos: int = 1) -> np.ndarray:
+    """
+    Registradores HLL de uma Series pandas (nulos ignorados), vetorizado.
+    Com `grupos` (código 0..n_grupos-1 por linha) devolve uma matriz (n_grupos, M), um sketch por grupo.
+    """
+    import pandas as pd
+
+    regs = np.zeros((n_grupos, M), dtype=np.uint8)
+    validos = valores.notna().to_numpy()
+    if not validos.any():
+        return regs if grupos is not None else regs[0]
+    h = pd.util.hash_pandas_object(valores[validos].astype(str), index=False).to_numpy(dtype=np.uint64)
+    idx = (h >> np.uint64(_BITS_RESTO)).astype(np.int64)
+    resto = h & np.uint64((1 << _BITS_RESTO) - 1)
+    # posição do primeiro bit 1 nos bits restantes; frexp dá o bit_length exato (resto < 2^53)
+    _, bit_length = np.frexp(resto.astype(np.float64))
+    rho = (_BITS_RESTO - bit_length + 1).astype(np.uint8)
+    if grupos is not None:
+        idx = grupos[validos].astype(np.int64) * M + idx
+    np.maximum.at(regs.reshape(-1), idx, rho)
+    return regs if grupos is not None else regs[0]
+
+
+def para_bytes(regs: np.ndarray) -> bytes:
+    return regs.astype(np.uint8).tobytes()
+
+
+def de_bytes(dados: bytes) -> np.ndarray:
+    return np.frombuffer(dados, dtype=np.uint8)
+
+
+def mesclar(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.maximum(a, b)
+
+
+def estimar(regs: np.ndarray) -> int:
+    """Estimativa de cardinalidade com correção para poucos valores (linear counting)."""
+    alfa = 0.7213 / (1 + 1.079 / M)
+    estimativa = alfa * M * M / float(np.sum(np.ldexp(1.0, -regs.astype(np.int64))))
+    vazios = int(np.count_nonzero(regs == 0))
+    if estimativa <= 2.5 * M and vazios:
+        estimativa = M * np.log(M / vazios)
+    return int(round(estimativa))
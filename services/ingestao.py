@@ -0,0 +1,55 @@
+"""
+Gravação de uma competência já validada e limpa: documentos, regra de duplicidade
+e estruturas derivadas (sketches, anomalias). Usado pelos uploads e pelos scripts de carga.
+"""
+import time
+from typing import Any
+
+from services.anomalias import detectar_anomalias, gravar_anomalias
+from services.armazenamento import substituir_competencia, totais_competencia
+from services.db import ler_do_primario
+from services.excel_service import TipoPlanilha, dataframe_para_documentos, estatisticas_previa
+from services.sketches import gravar_sketches
+
+
+def importar_competencia(
+    df,
+    tipo: TipoPlanilha,
+    competencia: str,
+    source_file: str,
+    group_id: str | None = None,
+) -> dict[str, Any]:
+    """
+    Substitui a competência (+ group_id) pelas linhas de df. Retorna linhas importadas/substituídas,
+    os KPIs da competência antes e depois (usados no evento de upload), o tempo de cada etapa (ms),
+    a vazão da gravação (escrita: lotes, reenvios, docs_por_s) e as anomalias em relação ao histórico.
+    """
+    marcas = [time.perf_counter()]
+    with ler_do_primario():  # secundário pode não ter o upload anterior da mesma competência
+        antes = totais_competencia(tipo, competencia, group_id)
+    marcas.append(time.perf_counter())
+    docs = dataframe_para_documentos(df, competencia, source_file, tipo, group_id)
+    marcas.append(time.perf_counter())
+    deleted_count, linhas, escrita = substituir_competencia(tipo, competencia, group_id, docs)
+    marcas.append(time.perf_counter())
+    sketches = gravar_sketches(df, tipo, competencia, group_id)
+    marcas.append(time.perf_counter())
+    anomalias = detectar_anomalias(tipo, competencia, group_id, sketches)
+    gravar_anomalias(tipo, competencia, group_id, source_file, anomalias)
+    marcas.append(time.perf_counter())
+    etapas = ("kpis", "documentos", "gravacao", "sketches", "anomalias")
+    novo = estatisticas_previa(df, tipo)
+    campo_qtd = "quantidade_kg" if tipo == "polpa" else "quantidade_litros"
+    depois = {"registros": linhas, "receita_total": novo["receita_total"], campo_qtd: novo[campo_qtd]}
+    return {
+        "linhas_importadas": linhas,
+        "linhas_substituidas": deleted_count,
+        "kpis": {
+            "antes": antes,
+            "depois": depois,
+            "delta": {k: round(depois[k] - antes[k], 2) for k in depois},
+        },
+        "etapas_ms": {e: round((fim - ini) * 1000, 1) for e, ini, fim in zip(etapas, marcas, marcas[1:])},
+        "escrita": escrita,
+        "anomalias": anomalias["anomalias"],
+    }
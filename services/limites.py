@@ -0,0 +1,143 @@
+"""
+Limites de execução das consultas de leitura.
+
+Toda agregação dos endpoints passa por agregar()/buscar(): maxTimeMS conforme o orçamento da rota,
+allowDiskUse e um comment com o id da requisição. Se o cliente HTTP desconectar antes da resposta,
+CancelarAoDesconectar encerra (killOp) as operações marcadas com esse id no servidor.
+"""
+import asyncio
+import contextvars
+import logging
+import uuid
+from typing import Any
+
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+from starlette.concurrency import run_in_threadpool
+
+from config import QUERY_MAX_TIME_MS, QUERY_MAX_TIME_MS_ROTAS, QUERY_ALLOW_DISK_USE
+from services import metricas
+from services.db import get_client, read_preference_leitura
+
+logger = logging.getLogger(__name__)
+
+# scope ASGI da requisição em andamento (a rota só é conhecida depois do roteamento)
+_scope: contextvars.ContextVar[dict | None] = contextvars.ContextVar("scope_consulta", default=None)
+
+_PREFIXO_COMENTARIO = "dashboard-mangas:"
+
+# Rotas de streaming sem consulta longa (o StreamingResponse já encerra ao desconectar)
+_ROTAS_IGNORADAS = ("/api/events",)
+
+
+def _contexto() -> tuple[int, str | None]:
+    """(maxTimeMS, comment) da requisição atual; fora de requisição, só o limite padrão."""
+    scope = _scope.get()
+    if scope is None:
+        return QUERY_MAX_TIME_MS, None
+    route = scope.get("route")
+    limite = QUERY_MAX_TIME_MS_ROTAS.get(route.path, QUERY_MAX_TIME_MS) if route else QUERY_MAX_TIME_MS
+    return limite, scope.get("consulta_id")
+
+
+def agregar(collection: Collection, pipeline: list[dict], **kwargs: Any):
+    """collection.aggregate com maxTimeMS, allowDiskUse e comment da requisição."""
+    limite, comentario = _contexto()
+    kwargs.setdefault("maxTimeMS", limite)
+    kwargs.setdefault("allowDiskUse", QUERY_ALLOW_DISK_USE)
+    if comentario:
+        kwargs.setdefault("comment", comentario)
+    return collection.aggregate(pipeline, **kwargs)
+
+
+def buscar(collection: Collection, filtro: dict, projecao: dict | None = None):
+    """collection.find com os mesmos limites de agregar()."""
+    limite, comentario = _contexto()
+    return collection.find(filtro, projecao, max_time_ms=limite, comment=comentario)
+
+
+def encerrar_operacoes(comentario: str) -> int:
+    """
+    killOp nas operações com este comment. Procura no primário e no membro da preferência de leitura
+    (onde as leituras analíticas rodam); o maxTimeMS continua valendo como limite se o membro for outro.
+    """
+    admin = get_client().admin
+    filtro = {"$or": [{"command.comment": comentario}, {"cursor.originatingCommand.comment": comentario}]}
+    encerradas = 0
+    alvos = [admin.read_preference]
+    if read_preference_leitura() != admin.read_preference:
+        alvos.append(read_preference_leitura())
+    for read_preference in alvos:
+        try:
+            ops = admin.with_options(read_preference=read_preference).aggregate(
+                [{"$currentOp": {"allUsers": True}}, {"$match": filtro}]
+            )
+            for op in ops:
+                admin.command("killOp", op=op["opid"], read_preference=read_preference)
+                encerradas += 1
+        except PyMongoError as e:
+            logger.warning("Falha ao encerrar operações de %s: %s", comentario, e)
+    return encerradas
+
+
+class CancelarAoDesconectar:
+    """
+    Middleware ASGI para GET /api/*: marca as consultas da requisição e, se o cliente desconectar
+    antes da resposta, encerra as operações no MongoDB e cancela o handler.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or not scope["path"].startswith("/api/")
+            or scope["path"] in _ROTAS_IGNORADAS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        scope["consulta_id"] = f"{_PREFIXO_COMENTARIO}{uuid.uuid4().hex}"
+        mensagens: asyncio.Queue = asyncio.Queue()
+        desconectou = asyncio.Event()
+
+        async def escutar():
+            while True:
+                mensagem = await receive()
+                mensagens.put_nowait(mensagem)
+                if mensagem["type"] == "http.disconnect":
+                    desconectou.set()
+                    return
+
+        async def receber():
+            mensagem = await mensagens.get()
+            if mensagem["type"] == "http.disconnect":
+                mensagens.put_nowait(mensagem)
+            return mensagem
+
+        token = _scope.set(scope)
+        try:
+            ouvinte = asyncio.create_task(escutar())
+            handler = asyncio.create_task(self.app(scope, receber, send))
+            espera = asyncio.create_task(desconectou.wait())
+        finally:
+            _scope.reset(token)
+
+        try:
+            await asyncio.wait({handler, espera}, return_when=asyncio.FIRST_COMPLETED)
+            if handler.done():
+                await handler
+                return
+            # cliente saiu: para a consulta no servidor e descarta a resposta
+            metricas.incrementar("consultas_canceladas")
+            await run_in_threadpool(encerrar_operacoes, scope["consulta_id"])
+            handler.cancel()
+            try:
+                await handler
+            except (asyncio.CancelledError, Exception):
+                pass
+        finally:
+            ouvinte.cancel()
+            espera.cancel()
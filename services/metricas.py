@@ -0,0 +1,134 @@
+"""
+Métricas em memória por processo (worker): contadores e latências por rota.
+
+Com vários workers, cada processo publica um snapshot em METRICAS_DIR e
+qualquer worker consegue devolver a visão agregada.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+
+from config import METRICAS_DIR, METRICAS_JANELA, METRICAS_INTERVALO_S
+
+_lock = threading.Lock()
+_contadores: dict[str, int] = defaultdict(int)
+_latencias: dict[str, deque] = defaultdict(lambda: deque(maxlen=METRICAS_JANELA))
+_inicio = time.time()
+_pid = os.getpid()
+_inicializacao: dict[str, float] = {}
+
+
+def _reset_apos_fork() -> None:
+    """Worker novo não herda contadores do processo pai."""
+    global _lock, _inicio, _pid
+    _lock = threading.Lock()
+    _contadores.clear()
+    _latencias.clear()
+    _inicio = time.time()
+    _pid = os.getpid()
+
+
+os.register_at_fork(after_in_child=_reset_apos_fork)
+
+
+def incrementar(nome: str, valor: int = 1) -> None:
+    with _lock:
+        _contadores[nome] += valor
+
+
+def registrar_latencia(nome: str, ms: float) -> None:
+    with _lock:
+        _latencias[nome].append(ms)
+
+
+def registrar_inicializacao(**etapas_ms: float) -> None:
+    """Tempos de subida do worker (ex.: importacao_ms, pronto_ms)."""
+    _inicializacao.update({k: round(v, 1) for k, v in etapas_ms.items()})
+
+
+def _rss_mb() -> float | None:
+    """Memória residente atual do processo (Linux, /proc/self/statm)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _percentil(valores: list[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return round(ordenados[idx], 2)
+
+
+def snapshot() -> dict:
+    """Métricas do worker atual."""
+    with _lock:
+        contadores = dict(_contadores)
+        latencias = {k: list(v) for k, v in _latencias.items()}
+    return {
+        "pid": _pid,
+        "uptime_s": round(time.time() - _inicio, 1),
+        "inicializacao_ms": dict(_inicializacao),
+        "rss_mb": _rss_mb(),
+        # stack de ingestão carregada neste worker (só depois do primeiro upload)
+        "pandas_carregado": "pandas" in sys.modules,
+        "contadores": contadores,
+        "latencias_ms": {
+            nome: {
+                "n": len(v),
+                "p50": _percentil(v, 50),
+                "p95": _percentil(v, 95),
+                "p99": _percentil(v, 99),
+            }
+            for nome, v in latencias.items()
+        },
+    }
+
+
+def _arquivo_worker() -> Path | None:
+    if not METRICAS_DIR:
+        return None
+    return Path(METRICAS_DIR) / f"worker-{_pid}.json"
+
+
+def publicar() -> None:
+    """Grava o snapshot do worker em METRICAS_DIR (chamado periodicamente)."""
+    arquivo = _arquivo_worker()
+    if arquivo is None:
+        return
+    arquivo.parent.mkdir(parents=True, exist_ok=True)
+    tmp = arquivo.with_suffix(".tmp")
+    tmp.write_text(json.dumps(snapshot()))
+    tmp.replace(arquivo)
+
+
+def remover_publicacao() -> None:
+    arquivo = _arquivo_worker()
+    if arquivo is not None and arquivo.exists():
+        arquivo.unlink()
+
+
+def snapshot_workers() -> list[dict]:
+    """Snapshots de todos os workers publicados em METRICAS_DIR (inclui o atual, atualizado)."""
+    atual = snapshot()
+    if not METRICAS_DIR or not Path(METRICAS_DIR).is_dir():
+        return [atual]
+    workers = [atual]
+    for arquivo in sorted(Path(METRICAS_DIR).glob("worker-*.json")):
+        try:
+            # Arquivo antigo = worker encerrado sem limpar (ex.: SIGKILL)
+            if time.time() - arquivo.stat().st_mtime > 3 * METRICAS_INTERVALO_S:
+                continue
+            dados = json.loads(arquivo.read_text())
+        except (OSError, ValueError):
+            continue
+        if dados.get("pid") != atual["pid"]:
+            workers.append(dados)
+    return workers
@@ -0,0 +1,105 @@
+"""
+Migrações de dados já gravados nas coleções polpa e extrato.
+"""
+from typing import Iterable, Optional
+
+from config import STORAGE_MODE
+from services.db import colecoes_do_tipo
+from services.receita import expressao_receita, versao_formula
+
+
+def migrar_data_pedido(tipo: str) -> dict:
+    """
+    Converte data_pedido gravado como texto ISO (uploads antigos) para data nativa (BSON date).
+    Roda no servidor (update com pipeline), uma competência por vez para limitar o tamanho de cada operação.
+    Valores que não são data válida ficam como estavam.
+    """
+    filtro_texto = {"data_pedido": {"$type": "string"}}
+    convertidos = restantes = 0
+    competencias: set[str] = set()
+    for col in colecoes_do_tipo(tipo):
+        convertidos += _migrar_colecao(col, filtro_texto, competencias)
+        restantes += col.count_documents(filtro_texto)
+    return {"tipo": tipo, "competencias": len(competencias), "convertidos": convertidos, "nao_convertidos": restantes}
+
+
+def _migrar_colecao(col, filtro_texto: dict, competencias: set[str]) -> int:
+    convertidos = 0
+    pendentes = col.distinct("competencia", filtro_texto)
+    competencias.update(pendentes)
+    for competencia in sorted(pendentes):
+        res = col.update_many(
+            {**filtro_texto, "competencia": competencia},
+            [
+                {
+                    "$set": {
+                        "data_pedido": {
+                            "$dateFromString": {
+                                "dateString": "$data_pedido",
+                                "onError": "$data_pedido",
+                                "onNull": None,
+                            }
+                        }
+                    }
+                }
+            ],
+        )
+        convertidos += res.modified_count
+    return convertidos
+
+
+def _pipeline_receita(tipo: str) -> list[dict]:
+    """Update com pipeline que grava a receita da fórmula atual (nos buckets, o array colunas.receita)."""
+    versao = versao_formula(tipo)
+    if STORAGE_MODE != "buckets":
+        return [{"$set": {"receita": expressao_receita(tipo), "receita_versao": versao}}]
+    por_linha = expressao_receita(tipo, lambda c: {"$arrayElemAt": [f"$colunas.{c}", "$$i"]}, None)
+    return [
+        {
+            "$set": {
+                "colunas.receita": {"$map": {"input": {"$range": [0, "$n"]}, "as": "i", "in": por_linha}},
+                "receita_versao": versao,
+            }
+        }
+    ]
+
+
+def recalcular_receita(
+    tipo: str,
+    competencias: Optional[Iterable[str]] = None,
+    forcar: bool = False,
+    lote: int = 5000,
+) -> dict:
+    """
+    Reaplica a fórmula atual da receita (services.receita) nos documentos gravados com outra versão
+    (todos, com forcar). Roda no servidor (update com pipeline), uma competência por vez e em lotes
+    de até `lote` documentos por faixa de _id; interrompido, basta rodar de novo.
+    Retorna os documentos atualizados e as competências alteradas (para refazer os sketches).
+    """
+    pipeline = _pipeline_receita(tipo)
+    filtro = {} if forcar else {"receita_versao": {"$ne": versao_formula(tipo)}}
+    if competencias is not None:
+        filtro["competencia"] = {"$in": sorted(competencias)}
+    atualizados = lotes = 0
+    alteradas: set[str] = set()
+    for col in colecoes_do_tipo(tipo):
+        for competencia in sorted(col.distinct("competencia", filtro)):
+            ultimo = None
+            while True:
+                filtro_lote = {**filtro, "competencia": competencia}
+                if ultimo is not None:
+                    filtro_lote["_id"] = {"$gt": ultimo}
+                ids = [d["_id"] for d in col.find(filtro_lote, {"_id": 1}).sort("_id", 1).limit(lote)]
+                if not ids:
+                    break
+                atualizados += col.update_many({"_id": {"$in": ids}}, pipeline).modified_count
+                lotes += 1
+                ultimo = ids[-1]
+            alteradas.add(competencia)
+    return {
+        "tipo": tipo,
+        "versao": versao_formula(tipo),
+        "documentos": atualizados,
+        "lotes": lotes,
+        "competencias": sorted(alteradas),
+    }
@@ -0,0 +1,371 @@
+"""
+Perfil de uma requisição (?profile=1 com o cabeçalho X-Perfil-Token = PERFIL_TOKEN).
+
+- Python: amostras das pilhas das threads enquanto trabalham para a requisição (a do handler
+  síncrono, via RotaPerfilada; as do executor da ingestão; as que enviam comandos ao MongoDB,
+  durante o comando), a cada PERFIL_INTERVALO_MS;
+- MongoDB: cada comando com a duração medida pelo driver e o resumo do explain (estágios,
+  índices, chaves/documentos examinados e retornados);
+- ingestão: tempo de cada etapa das competências importadas (registrar_etapas).
+
+O perfil vai no log e, se a resposta for um objeto JSON, na chave "_perfil". Com o perfil ativo
+o cache das consultas é ignorado, para medir as consultas de fato.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Optional
+from urllib.parse import parse_qs
+
+from bson import SON, json_util
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+from starlette.concurrency import run_in_threadpool
+
+from config import PERFIL_INTERVALO_MS, PERFIL_MAX_EXPLAIN, PERFIL_TOKEN
+
+logger = logging.getLogger(__name__)
+
+_perfil: contextvars.ContextVar[Optional["Perfil"]] = contextvars.ContextVar("perfil", default=None)
+
+# Campos que o driver acrescenta ao comando e que não são aceitos dentro de explain
+COMANDO_META = {"lsid", "$db", "$clusterTime", "$readPreference", "readConcern", "$readConcern", "txnNumber"}
+_EXPLICAVEIS = ("aggregate", "find", "distinct", "count")
+_ROTAS_IGNORADAS = ("/api/events",)
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_TOP_FUNCOES = 15
+
+
+def comando_para_explain(comando: dict) -> SON:
+    return SON((k, v) for k, v in comando.items() if k not in COMANDO_META)
+
+
+def resumo_explain(explain: dict) -> dict[str, Any]:
+    """Estágios e índices do plano vencedor e totais de chaves/documentos examinados e retornados."""
+    estagios: set[str] = set()
+    indices: set[str] = set()
+    totais = {"chaves": 0, "docs": 0, "retornados": 0}
+
+    def visitar(no: Any, no_plano: bool) -> None:
+        if isinstance(no, list):
+            for v in no:
+                visitar(v, no_plano)
+            return
+        if not isinstance(no, dict):
+            return
+        if no_plano and "stage" in no:
+            estagios.add(no["stage"])
+            if no.get("indexName"):
+                indices.add(no["indexName"])
+        stats = no.get("executionStats")
+        if isinstance(stats, dict) and "totalKeysExamined" in stats:
+            totais["chaves"] += stats["totalKeysExamined"]
+            totais["docs"] += stats["totalDocsExamined"]
+            totais["retornados"] += stats["nReturned"]
+        for k, v in no.items():
+            if k in ("rejectedPlans", "allPlansExecution", "executionStats"):
+                continue
+            visitar(v, no_plano or k == "winningPlan")
+
+    visitar(explain, False)
+    return {"estagios": sorted(estagios), "indices": sorted(indices), **totais}
+
+
+def _nome(code) -> str:
+    arquivo = code.co_filename
+    if arquivo.startswith(_RAIZ) and "site-packages" not in arquivo:
+        arquivo = os.path.relpath(arquivo, _RAIZ)
+    elif "site-packages" in arquivo:
+        arquivo = arquivo.split("site-packages" + os.sep, 1)[1]
+    else:
+        arquivo = os.path.basename(arquivo)
+    return f"{arquivo}:{code.co_name}"
+
+
+def _do_projeto(nome: str) -> bool:
+    arquivo = nome.split(":", 1)[0]
+    # o próprio perfil (wrapper da thread) apareceria em 100% das amostras
+    return arquivo.split(os.sep, 1)[0] in ("routes", "services", "main.py") and arquivo != os.path.join("services", "perfil.py")
+
+
+def _ocioso(frame) -> bool:
+    """Thread esperando trabalho (event loop no select, worker do pool parado), não atendendo a requisição."""
+    arquivo, funcao = frame.f_code.co_filename, frame.f_code.co_name
+    return (arquivo.endswith("selectors.py") and funcao in ("select", "poll")) or (
+        arquivo.endswith("threading.py") and funcao == "wait"
+    )
+
+
+class Perfil:
+    def __init__(self) -> None:
+        self.inicio = time.perf_counter()
+        self._threads: Counter = Counter()  # thread -> trechos em andamento desta requisição
+        self.comandos: list[dict[str, Any]] = []
+        self.etapas: list[dict[str, Any]] = []
+        self._pendentes: dict[int, dict[str, Any]] = {}
+        self._amostras = 0
+        self._proprio: Counter = Counter()
+        self._acumulado: Counter = Counter()
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._amostrador = threading.Thread(target=self._amostrar, name="perfil", daemon=True)
+
+    def iniciar(self) -> None:
+        self._amostrador.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+        self._amostrador.join()
+        self.duracao_ms = round((time.perf_counter() - self.inicio) * 1000, 1)
+
+    def entrar(self, tid: int) -> None:
+        with self._lock:
+            self._threads[tid] += 1
+
+    def sair(self, tid: int) -> None:
+        with self._lock:
+            self._threads[tid] -= 1
+            if self._threads[tid] <= 0:
+                del self._threads[tid]
+
+    def _amostrar(self) -> None:
+        while not self._parar.wait(PERFIL_INTERVALO_MS / 1000):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads)
+            for tid in threads:
+                frame = frames.get(tid)
+                if frame is None or _ocioso(frame):
+                    continue
+                pilha = []
+                while frame is not None:
+                    pilha.append(_nome(frame.f_code))
+                    frame = frame.f_back
+                self._amostras += 1
+                self._proprio[pilha[0]] += 1
+                self._acumulado.update(set(pilha))
+
+    def comando_iniciado(self, event) -> None:
+        colecao = event.command.get(event.command_name)
+        tid = threading.get_ident()
+        self.entrar(tid)
+        with self._lock:
+            self._pendentes[event.request_id] = {
+                "_thread": tid,
+                "comando": event.command_name,
+                "colecao": colecao if isinstance(colecao, str) else event.command.get("collection"),
+                "banco": event.database_name,
+                "_explain": comando_para_explain(event.command) if event.command_name in _EXPLICAVEIS else None,
+            }
+
+    def comando_concluido(self, event, erro: Optional[str] = None) -> None:
+        with self._lock:
+            item = self._pendentes.pop(event.request_id, None)
+        if item is None:
+            return
+        self.sair(item.pop("_thread"))
+        with self._lock:
+            item["duracao_ms"] = round(event.duration_micros / 1000, 2)
+            if erro:
+                item["erro"] = erro
+            self.comandos.append(item)
+
+    def explicar(self) -> None:
+        """explain(executionStats) dos comandos de leitura (os repetidos compartilham o resultado)."""
+        # importado aqui: services.db registra o ouvinte deste módulo no MongoClient
+        from services.db import get_client, read_preference_leitura
+
+        feitos: dict[str, dict[str, Any]] = {}
+        for item in self.comandos:
+            comando = item.pop("_explain", None)
+            if comando is None:
+                continue
+            chave = json_util.dumps(comando)
+            if chave not in feitos:
+                if len(feitos) >= PERFIL_MAX_EXPLAIN:
+                    continue
+                try:
+                    explain = get_client()[item["banco"]].command(
+                        SON([("explain", comando), ("verbosity", "executionStats")]),
+                        read_preference=read_preference_leitura(),
+                    )
+                    feitos[chave] = resumo_explain(explain)
+                except PyMongoError as e:
+                    feitos[chave] = {"erro": str(e)}
+            item["explain"] = feitos[chave]
+
+    def relatorio(self) -> dict[str, Any]:
+        def pct(n: int) -> float:
+            return round(100 * n / self._amostras, 1) if self._amostras else 0.0
+
+        return {
+            "duracao_ms": self.duracao_ms,
+            "python": {
+                "intervalo_ms": PERFIL_INTERVALO_MS,
+                "amostras": self._amostras,
+                "proprio": [{"funcao": f, "pct": pct(n)} for f, n in self._proprio.most_common(_TOP_FUNCOES)],
+                "acumulado": [
+                    {"funcao": f, "pct": pct(n)}
+                    for f, n in self._acumulado.most_common()
+                    if _do_projeto(f)
+                ][:_TOP_FUNCOES],
+            },
+            "mongo": {
+                "comandos": [{k: v for k, v in c.items() if k != "_explain"} for c in self.comandos],
+                "total_ms": round(sum(c["duracao_ms"] for c in self.comandos), 2),
+            },
+            "etapas": self.etapas,
+        }
+
+
+def ativo() -> bool:
+    return _perfil.get() is not None
+
+
+@contextlib.contextmanager
+def thread_da_requisicao():
+    """Dentro do bloco, a thread atual é amostrada no perfil da requisição (se houver)."""
+    perfil = _perfil.get()
+    if perfil is None:
+        yield
+        return
+    tid = threading.get_ident()
+    perfil.entrar(tid)
+    try:
+        yield
+    finally:
+        perfil.sair(tid)
+
+
+def na_thread_da_requisicao(funcao):
+    """Decorator: a chamada inteira de funcao é amostrada (ver thread_da_requisicao)."""
+
+    @functools.wraps(funcao)
+    def wrapper(*args, **kwargs):
+        with thread_da_requisicao():
+            return funcao(*args, **kwargs)
+
+    return wrapper
+
+
+class RotaPerfilada(APIRoute):
+    """route_class dos routers: handlers síncronos registram a thread do threadpool no perfil."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = na_thread_da_requisicao(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def registrar_etapas(descricao: str, etapas_ms: dict[str, float]) -> None:
+    """Tempos das etapas de uma importação, se a requisição estiver sendo perfilada."""
+    perfil = _perfil.get()
+    if perfil is not None:
+        perfil.etapas.append({"descricao": descricao, "etapas_ms": etapas_ms})
+
+
+class _OuvinteComandos(monitoring.CommandListener):
+    """Registrado no MongoClient: repassa os comandos ao perfil da requisição atual, se houver."""
+
+    def started(self, event):
+        perfil = _perfil.get()
+        if perfil is not None:
+            perfil.comando_iniciado(event)
+
+    def succeeded(self, event):
+        perfil = _perfil.get()
+        if perfil is not None:
+            perfil.comando_concluido(event)
+
+    def failed(self, event):
+        perfil = _perfil.get()
+        if perfil is not None:
+            perfil.comando_concluido(event, str(event.failure))
+
+
+ouvinte_comandos = _OuvinteComandos()
+
+
+def _pediu_perfil(scope) -> bool:
+    valores = parse_qs(scope.get("query_string", b"").decode()).get("profile", [])
+    return bool(valores) and valores[-1].lower() in ("1", "true", "sim")
+
+
+def _autorizado(scope) -> bool:
+    token = dict(scope["headers"]).get(b"x-perfil-token", b"").decode()
+    return hmac.compare_digest(token, PERFIL_TOKEN)
+
+
+async def _responder_json(send, status: int, conteudo: dict) -> None:
+    corpo = json.dumps(conteudo).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(corpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": corpo})
+
+
+class PerfilarRequisicao:
+    """Middleware ASGI: ?profile=1 em /api/* (exceto o fluxo SSE), com X-Perfil-Token válido."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not PERFIL_TOKEN
+            or scope["type"] != "http"
+            or not scope["path"].startswith("/api/")
+            or scope["path"] in _ROTAS_IGNORADAS
+            or not _pediu_perfil(scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+        if not _autorizado(scope):
+            await _responder_json(send, 403, {"erros": ["profile=1 exige o cabeçalho X-Perfil-Token válido."]})
+            return
+
+        mensagens: list[dict] = []
+
+        async def guardar(mensagem):
+            mensagens.append(mensagem)
+
+        perfil = Perfil()
+        token = _perfil.set(perfil)
+        perfil.iniciar()
+        try:
+            await self.app(scope, receive, guardar)
+        finally:
+            _perfil.reset(token)
+            perfil.parar()
+
+        await run_in_threadpool(perfil.explicar)
+        relatorio = perfil.relatorio()
+        logger.info("Perfil %s %s: %s", scope["method"], scope["path"], json.dumps(relatorio, default=str))
+
+        inicio = next((m for m in mensagens if m["type"] == "http.response.start"), None)
+        corpo = b"".join(m.get("body", b"") for m in mensagens if m["type"] == "http.response.body")
+        if inicio and dict(inicio["headers"]).get(b"content-type", b"").startswith(b"application/json"):
+            try:
+                conteudo = json.loads(corpo)
+            except ValueError:
+                conteudo = None
+            if isinstance(conteudo, dict):
+                conteudo["_perfil"] = relatorio
+                corpo = json.dumps(conteudo, default=str).encode()
+                headers = [(k, v) for k, v in inicio["headers"] if k != b"content-length"]
+                inicio = {**inicio, "headers": headers + [(b"content-length", str(len(corpo)).encode())]}
+        if inicio:
+            await send(inicio)
+        await send({"type": "http.response.body", "body": corpo})
@@ -0,0 +1,153 @@
+"""
+Previsão mensal de receita e quantidade por suavização exponencial (ETS aditivo), em NumPy.
+
+Todas as séries (grupos x métricas) e todas as combinações de parâmetros da grade são ajustadas
+de uma vez: o laço é só no tempo, cada passo é uma operação em arrays (séries x parâmetros).
+Por série fica o melhor entre Holt (nível + tendência) e Holt-Winters aditivo (sazonalidade de
+12 meses, com pelo menos 24 meses de histórico), pelo AIC. Séries com menos de MIN_MESES meses
+usam a média. Os intervalos vêm da variância do erro h passos à frente do modelo ETS.
+
+Os modelos ajustados ficam em memória (por worker) até a próxima mudança de versão do tipo.
+"""
+import threading
+from collections import OrderedDict
+from statistics import NormalDist
+from typing import Any, Callable, Hashable
+
+import numpy as np
+
+SAZONALIDADE = 12
+MIN_MESES = 4
+_ALFAS = np.linspace(0.05, 0.95, 10)
+_BETAS = np.array([0.0, 0.05, 0.1, 0.2, 0.35, 0.5])  # fração de alfa aplicada à tendência
+_GAMAS = np.array([0.0, 0.05, 0.15, 0.3])
+_MAX_MODELOS = 64
+
+_modelos: "OrderedDict[Hashable, dict[str, Any]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _grade(sazonal: bool) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    a, b, g = np.meshgrid(_ALFAS, _BETAS, _GAMAS if sazonal else np.zeros(1), indexing="ij")
+    a, b, g = a.ravel(), b.ravel(), g.ravel()
+    return a, b, np.minimum(g, 1 - a)  # gama <= 1 - alfa
+
+
+def _ets(y: np.ndarray, sazonal: bool, inicio_comparacao: int) -> dict[str, np.ndarray]:
+    """
+    Ajusta ETS(A,A,N) ou ETS(A,A,A) em y (séries x meses) para toda a grade; devolve, por série,
+    os parâmetros de menor erro quadrático a um passo, o estado final e o erro a partir de inicio_comparacao.
+    """
+    m = SAZONALIDADE
+    series, meses = y.shape
+    alfa, beta, gama = _grade(sazonal)
+    if sazonal:
+        media0 = y[:, :m].mean(axis=1)
+        tendencia0 = (y[:, m:2 * m].mean(axis=1) - media0) / m
+        # índices do 1º ano sem a tendência; nível no último mês do 1º ano
+        sazonal0 = y[:, :m] - media0[:, None] - np.outer(tendencia0, np.arange(m) - (m - 1) / 2)
+        nivel0 = media0 + tendencia0 * (m - 1) / 2
+        inicio = m
+    else:
+        nivel0, tendencia0, sazonal0 = y[:, 0], y[:, 1] - y[:, 0], np.zeros((series, m))
+        inicio = 1
+    p = alfa.size
+    nivel = np.repeat(nivel0[:, None], p, axis=1)
+    tendencia = np.repeat(tendencia0[:, None], p, axis=1)
+    sazon = np.repeat(sazonal0[:, None, :], p, axis=1)
+    sse = np.zeros((series, p))
+    sse_comparacao = np.zeros((series, p))
+    for t in range(inicio, meses):
+        i = t % m
+        erro = y[:, t:t + 1] - (nivel + tendencia + sazon[:, :, i])
+        sse += erro ** 2
+        if t >= inicio_comparacao:
+            sse_comparacao += erro ** 2
+        nivel = nivel + tendencia + alfa * erro
+        tendencia = tendencia + alfa * beta * erro
+        if sazonal:
+            sazon[:, :, i] += gama * erro
+
+    melhor = sse.argmin(axis=1)
+    linhas = np.arange(series)
+    return {
+        "alfa": alfa[melhor],
+        "beta": beta[melhor],
+        "gama": gama[melhor],
+        "nivel": nivel[linhas, melhor],
+        "tendencia": tendencia[linhas, melhor],
+        "sazonal": sazon[linhas, melhor],
+        "sse": sse_comparacao[linhas, melhor],
+        "n": np.full(series, meses - inicio_comparacao),
+        # parâmetros de suavização; os estados iniciais saem do 1º ano, fora da janela comparada
+        "k": np.full(series, 3 if sazonal else 2),
+    }
+
+
+def ajustar(y: np.ndarray) -> dict[str, Any]:
+    """Ajusta as séries (linhas de y, meses consecutivos nas colunas) e escolhe o modelo de cada uma."""
+    series, meses = y.shape
+    if meses < MIN_MESES:
+        return {
+            "modelo": np.full(series, "media"),
+            "nivel": y.mean(axis=1) if meses else np.zeros(series),
+            "sigma": y.std(axis=1, ddof=1) if meses > 1 else np.full(series, np.nan),
+            "meses": meses,
+        }
+
+    sazonal = meses >= 2 * SAZONALIDADE
+    holt = _ets(y, False, SAZONALIDADE if sazonal else 1)
+    escolhido = {k: v.copy() for k, v in holt.items()}
+    modelo = np.full(series, "holt", dtype=object)
+    if sazonal:
+        hw = _ets(y, True, SAZONALIDADE)
+
+        def aic(r: dict) -> np.ndarray:
+            return r["n"] * np.log(r["sse"] / r["n"] + 1e-12) + 2 * r["k"]
+
+        usar_hw = aic(hw) < aic(holt)
+        for k in escolhido:
+            escolhido[k][usar_hw] = hw[k][usar_hw]
+        modelo[usar_hw] = "holt_winters"
+    escolhido["sigma"] = np.sqrt(escolhido["sse"] / np.maximum(escolhido["n"] - 1, 1))
+    escolhido["modelo"] = modelo
+    escolhido["meses"] = meses
+    return escolhido
+
+
+def prever(ajuste: dict[str, Any], horizonte: int, nivel_confianca: float) -> dict[str, np.ndarray]:
+    """Previsão pontual e intervalo (limite inferior em 0) para h = 1..horizonte, por série."""
+    h = np.arange(1, horizonte + 1)
+    z = NormalDist().inv_cdf(0.5 + nivel_confianca / 2)
+    if ajuste["meses"] < MIN_MESES:
+        valor = np.repeat(ajuste["nivel"][:, None], horizonte, axis=1)
+        margem = z * ajuste["sigma"][:, None] * np.sqrt(1 + 1 / max(ajuste["meses"], 1)) * np.ones(horizonte)
+    else:
+        meses = ajuste["meses"]
+        indice_sazonal = (meses - 1 + h) % SAZONALIDADE
+        valor = (
+            ajuste["nivel"][:, None]
+            + h * ajuste["tendencia"][:, None]
+            + ajuste["sazonal"][:, indice_sazonal]
+        )
+        # variância do erro h passos à frente: sigma² (1 + soma_{j<h} c_j²), c_j = α(1 + jβ) + γ·[j múltiplo de 12]
+        j = np.arange(1, horizonte)
+        alfa, beta, gama = (ajuste[k][:, None] for k in ("alfa", "beta", "gama"))
+        c = alfa * (1 + j * beta) + gama * (j % SAZONALIDADE == 0)
+        variancia = 1 + np.concatenate([np.zeros((c.shape[0], 1)), np.cumsum(c ** 2, axis=1)], axis=1)
+        margem = z * ajuste["sigma"][:, None] * np.sqrt(variancia)
+    return {"valor": valor, "inferior": np.maximum(valor - margem, 0), "superior": valor + margem}
+
+
+def modelo_em_cache(chave: Hashable, ajustar_modelo: Callable[[], dict[str, Any]]) -> dict[str, Any]:
+    """Modelo ajustado para a chave (que inclui a versão dos dados); ajusta e guarda se não houver."""
+    with _lock:
+        if chave in _modelos:
+            _modelos.move_to_end(chave)
+            return _modelos[chave]
+    modelo = ajustar_modelo()
+    with _lock:
+        _modelos[chave] = modelo
+        while len(_modelos) > _MAX_MODELOS:
+            _modelos.popitem(last=False)
+    return modelo
@@ -0,0 +1,99 @@
+"""
+Fórmula da receita, versionada por tipo.
+
+A receita é calculada na ingestão e gravada em cada documento junto com receita_versao. Para mudar
+a regra, acrescente uma versão em FORMULAS (as existentes não mudam: os documentos registram a
+versão aplicada) e rode scripts.recalcular_receita, que reaplica a fórmula no próprio servidor.
+
+Cada versão é declarativa (quantidade × preço − deduções) e dela saem as três formas usadas: por
+linha (documentos do upload), vetorizada (pandas: prévia e sketches) e expressão de agregação
+(update com pipeline no MongoDB). As três tratam igual os valores ausentes: sem quantidade ou
+preço não há receita; dedução ausente vale 0.
+"""
+from typing import Any, Callable, NamedTuple, Optional
+
+
+class Formula(NamedTuple):
+    quantidade: str
+    preco: str
+    deducoes: tuple[str, ...]
+    descricao: str
+
+
+FORMULAS: dict[str, dict[int, Formula]] = {
+    "polpa": {
+        1: Formula(
+            "quantidade_kg",
+            "preco_unitario_brl_kg",
+            ("logistica_brl", "desconto_brl"),
+            "quantidade_kg × preco_unitario_brl_kg − logistica_brl − desconto_brl",
+        ),
+    },
+    "extrato": {
+        1: Formula("quantidade_litros", "preco_unitario_brl_l", (), "quantidade_litros × preco_unitario_brl_l"),
+    },
+}
+
+
+def versao_formula(tipo: str) -> int:
+    """Versão atual (a maior) da fórmula do tipo."""
+    return max(FORMULAS[tipo])
+
+
+def formula(tipo: str, versao: Optional[int] = None) -> Formula:
+    return FORMULAS[tipo][versao or versao_formula(tipo)]
+
+
+def campos_receita(tipo: str) -> list[str]:
+    """Colunas lidas pela fórmula atual."""
+    f = formula(tipo)
+    return [f.quantidade, f.preco, *f.deducoes]
+
+
+def receita_linha(row: dict, tipo: str) -> float | None:
+    """Receita de uma linha (dict); None se faltar quantidade ou preço."""
+    f = formula(tipo)
+    try:
+        q = row.get(f.quantidade)
+        p = row.get(f.preco)
+        if q is None or p is None:
+            return None
+        return float(q) * float(p) - sum(float(row.get(c) or 0) for c in f.deducoes)
+    except (TypeError, ValueError):
+        return None
+
+
+def receita_serie(df, tipo: str):
+    """Mesma regra de receita_linha sobre o DataFrame inteiro (pd.Series; NaN sem quantidade/preço)."""
+    import numpy as np
+    import pandas as pd
+
+    def col(nome: str) -> pd.Series:
+        if nome in df.columns:
+            return pd.to_numeric(df[nome], errors="coerce")
+        return pd.Series(np.nan, index=df.index)
+
+    f = formula(tipo)
+    receita = col(f.quantidade) * col(f.preco)
+    for c in f.deducoes:
+        receita = receita - col(c).fillna(0)
+    return receita
+
+
+def expressao_receita(
+    tipo: str,
+    campo: Callable[[str], Any] = lambda c: f"${c}",
+    ausente: Any = "$$REMOVE",
+) -> dict:
+    """
+    Expressão de agregação da fórmula atual, arredondada a 2 casas como na ingestão.
+    campo(nome) dá a expressão de cada coluna; ausente é o resultado sem quantidade ou preço
+    ($$REMOVE tira o campo do documento; nos buckets, None mantém o array alinhado).
+    """
+    f = formula(tipo)
+    q, p = campo(f.quantidade), campo(f.preco)
+    valor: Any = {"$multiply": [q, p]}
+    if f.deducoes:
+        deducoes = [{"$cond": [{"$isNumber": campo(c)}, campo(c), 0]} for c in f.deducoes]
+        valor = {"$subtract": [valor, {"$add": deducoes}]}
+    return {"$cond": [{"$and": [{"$isNumber": q}, {"$isNumber": p}]}, {"$round": [valor, 2]}, ausente]}
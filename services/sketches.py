@@ -0,0 +1,257 @@
+"""
+Histogramas mescláveis por competência, construídos no upload.
+
+Cada (tipo, group_id, competencia, dimensao, valor) guarda, para NPS e índices de qualidade,
+a contagem de respostas por faixa fixa. Faixas fixas tornam os histogramas somáveis entre meses,
+canais e tenants: NPS real (% promotores − % detratores), percentis e histogramas saem da soma
+dos sketches, sem varrer as linhas. Campos de identificador (lote_id) ganham um HyperLogLog
+para contagem aproximada de distintos. Cada documento traz também os totais da linha da
+dimensão (linhas, receita, quantidade, soma dos preços unitários), base da detecção de anomalias.
+"""
+from typing import Any, Iterable, Optional
+
+import numpy as np
+from bson import Binary
+
+from services import hll
+from services.consultas import estagios_iniciais
+from services.db import colecoes_do_tipo, get_collection, get_sketches_collection
+from services.limites import buscar
+from services.receita import campos_receita, receita_serie
+
+# campo -> (início, fim, largura da faixa). Valores fora do intervalo caem na primeira/última faixa.
+HISTOGRAMAS: dict[str, tuple[float, float, float]] = {
+    "nps_0a10": (0, 11, 1),
+    "indice_qualidade_1a10": (0, 10, 0.1),
+    "indice_cor_1a10": (0, 10, 0.1),
+    "indice_pureza_1a10": (0, 10, 0.1),
+    "perda_processamento_pct": (0, 100, 0.5),
+}
+
+# Campos com contagem de distintos (HyperLogLog)
+DISTINTOS = ("lote_id",)
+
+# Teto da escala quando a última faixa é um valor discreto (NPS 10 ocupa a faixa [10, 11))
+VALOR_MAXIMO = {"nps_0a10": 10}
+
+# Dimensões materializadas; "total" é a competência inteira
+DIMENSOES_SKETCH = ("canal", "cliente_segmento", "regiao_destino")
+
+# tipo -> (campo de quantidade, campo de preço unitário) somados em "totais"
+CAMPOS_TOTAIS = {
+    "polpa": ("quantidade_kg", "preco_unitario_brl_kg"),
+    "extrato": ("quantidade_litros", "preco_unitario_brl_l"),
+}
+
+
+def _n_faixas(campo: str) -> int:
+    inicio, fim, largura = HISTOGRAMAS[campo]
+    return int(round((fim - inicio) / largura))
+
+
+def _indices_faixa(campo: str, valores: np.ndarray) -> np.ndarray:
+    inicio, _, largura = HISTOGRAMAS[campo]
+    idx = np.floor((valores - inicio) / largura + 1e-9).astype(np.int64)
+    return np.clip(idx, 0, _n_faixas(campo) - 1)
+
+
+def _valor_bson(v: Any) -> Any:
+    if v is None or (isinstance(v, float) and np.isnan(v)):
+        return None
+    return v.item() if hasattr(v, "item") else v
+
+
+def construir_sketches(df, tipo: str) -> list[dict[str, Any]]:
+    """
+    Histogramas e totais da planilha limpa, vetorizados: por campo, uma bincount sobre
+    (código da dimensão × faixa). Retorna documentos sem as chaves tipo/competencia/group_id.
+    """
+    import pandas as pd
+
+    campos = [c for c in HISTOGRAMAS if c in df.columns]
+    dimensoes: list[tuple[str, np.ndarray, list]] = [("total", np.zeros(len(df), dtype=np.int64), [None])]
+    for dim in DIMENSOES_SKETCH:
+        if dim in df.columns:
+            codigos, valores = pd.factorize(df[dim], use_na_sentinel=False)
+            dimensoes.append((dim, codigos.astype(np.int64), [_valor_bson(v) for v in valores]))
+
+    def numerico(serie) -> np.ndarray:
+        return pd.to_numeric(serie, errors="coerce").to_numpy(dtype=float)
+
+    campo_qtd, campo_preco = CAMPOS_TOTAIS[tipo]
+    ausente = pd.Series(np.nan, index=df.index)
+    receita = numerico(receita_serie(df, tipo))
+    quantidade = numerico(df.get(campo_qtd, ausente))
+    preco = numerico(df.get(campo_preco, ausente))
+
+    por_chave: dict[tuple, dict[str, Any]] = {}
+    for dim, codigos, valores in dimensoes:
+        n = len(valores)
+        linhas = np.bincount(codigos, minlength=n)
+        somas = {
+            "receita": np.bincount(codigos, weights=np.nan_to_num(receita), minlength=n),
+            "quantidade": np.bincount(codigos, weights=np.nan_to_num(quantidade), minlength=n),
+            "preco_soma": np.bincount(codigos, weights=np.nan_to_num(preco), minlength=n),
+            "preco_n": np.bincount(codigos, weights=~np.isnan(preco), minlength=n),
+        }
+        for i, valor in enumerate(valores):
+            if not linhas[i]:
+                continue
+            totais = {"linhas": int(linhas[i]), **{k: round(float(v[i]), 2) for k, v in somas.items()}}
+            totais["preco_n"] = int(totais["preco_n"])
+            por_chave[(dim, valor)] = {"dimensao": dim, "valor": valor, "histogramas": {}, "totais": totais}
+
+    for campo in campos:
+        serie = pd.to_numeric(df[campo], errors="coerce").to_numpy(dtype=float)
+        validos = ~np.isnan(serie)
+        idx_faixas = _indices_faixa(campo, serie[validos])
+        n_faixas = _n_faixas(campo)
+        for dim, codigos, valores in dimensoes:
+            cod = codigos[validos]
+            contagens = np.bincount(cod * n_faixas + idx_faixas, minlength=len(valores) * n_faixas)
+            contagens = contagens.reshape(len(valores), n_faixas)
+            somas = np.bincount(cod, weights=serie[validos], minlength=len(valores))
+            for i, valor in enumerate(valores):
+                n = int(contagens[i].sum())
+                if not n:
+                    continue
+                doc = por_chave.setdefault((dim, valor), {"dimensao": dim, "valor": valor, "histogramas": {}})
+                doc["histogramas"][campo] = {"contagens": contagens[i].tolist(), "n": n, "soma": float(somas[i])}
+
+    for campo in (c for c in DISTINTOS if c in df.columns):
+        for dim, codigos, valores in dimensoes:
+            regs = hll.registradores(df[campo], codigos, len(valores))
+            for i, valor in enumerate(valores):
+                if not regs[i].any():
+                    continue
+                doc = por_chave.setdefault((dim, valor), {"dimensao": dim, "valor": valor, "histogramas": {}})
+                doc.setdefault("hll", {})[campo] = Binary(hll.para_bytes(regs[i]))
+    return list(por_chave.values())
+
+
+def gravar_sketches(df, tipo: str, competencia: str, group_id: str | None) -> list[dict[str, Any]]:
+    """Substitui os sketches da competência (mesma regra de duplicidade do upload); retorna os gravados."""
+    col = get_sketches_collection()
+    query: dict[str, Any] = {"tipo": tipo, "competencia": competencia}
+    if group_id:
+        query["group_id"] = group_id
+    col.delete_many(query)
+    docs = construir_sketches(df, tipo)
+    for d in docs:
+        d.update({"tipo": tipo, "competencia": competencia})
+        if group_id:
+            d["group_id"] = group_id
+    if docs:
+        col.insert_many(docs)
+    return docs
+
+
+def reconstruir_sketches(tipo: str, competencias: Optional[Iterable[str]] = None) -> dict:
+    """Recalcula os sketches das competências (todas, se None; e seus group_ids) já gravadas de um tipo."""
+    import pandas as pd
+
+    campos = list(dict.fromkeys([
+        *HISTOGRAMAS, *DISTINTOS, *DIMENSOES_SKETCH, *CAMPOS_TOTAIS[tipo], *campos_receita(tipo)
+    ]))
+    filtro = {"competencia": {"$in": sorted(competencias)}} if competencias is not None else {}
+    chaves = [
+        c["_id"]
+        for col in colecoes_do_tipo(tipo)
+        for c in col.aggregate([
+            {"$match": filtro},
+            {"$group": {"_id": {"competencia": "$competencia", "group_id": "$group_id"}}},
+        ])
+    ]
+    reconstruidas = sketches = 0
+    for chave in sorted(chaves, key=lambda k: (k.get("competencia") or "", k.get("group_id") or "")):
+        match = {"competencia": chave.get("competencia"), "group_id": chave.get("group_id")}
+        pipeline = [*estagios_iniciais(tipo, match, campos), {"$project": {"_id": 0, **{c: 1 for c in campos}}}]
+        df = pd.DataFrame(list(get_collection(tipo, match["group_id"]).aggregate(pipeline)))
+        sketches += len(gravar_sketches(df, tipo, match["competencia"], match["group_id"]))
+        reconstruidas += 1
+    return {"tipo": tipo, "competencias": reconstruidas, "sketches": sketches}
+
+
+def mesclar(
+    tipo: str,
+    campo: str,
+    dimensao: str,
+    agrupar_por_periodo: bool,
+    match_periodo: dict,
+) -> dict[Any, dict[str, Any]]:
+    """
+    Soma os histogramas de `campo` (filtrados por competência/group_id) agrupando por
+    valor da dimensão ou por competência. Retorna {chave: {"contagens": ndarray, "n", "soma"}}.
+    """
+    filtro = {"tipo": tipo, "dimensao": dimensao, f"histogramas.{campo}": {"$exists": True}, **match_periodo}
+    projecao = {"competencia": 1, "valor": 1, f"histogramas.{campo}": 1, "_id": 0}
+    n_faixas = _n_faixas(campo)
+    resultado: dict[Any, dict[str, Any]] = {}
+    for doc in buscar(get_sketches_collection(), filtro, projecao):
+        chave = doc["competencia"] if agrupar_por_periodo else doc.get("valor")
+        h = doc["histogramas"][campo]
+        acc = resultado.setdefault(chave, {"contagens": np.zeros(n_faixas, dtype=np.int64), "n": 0, "soma": 0.0})
+        acc["contagens"] += np.asarray(h["contagens"], dtype=np.int64)
+        acc["n"] += h["n"]
+        acc["soma"] += h["soma"]
+    return resultado
+
+
+def mesclar_distintos(
+    tipo: str,
+    campo: str,
+    dimensao: str,
+    agrupar_por_periodo: bool,
+    match_periodo: dict,
+) -> dict[Any, np.ndarray]:
+    """Une (máximo dos registradores) os HyperLogLog de `campo` por valor da dimensão ou por competência."""
+    filtro = {"tipo": tipo, "dimensao": dimensao, f"hll.{campo}": {"$exists": True}, **match_periodo}
+    projecao = {"competencia": 1, "valor": 1, f"hll.{campo}": 1, "_id": 0}
+    resultado: dict[Any, np.ndarray] = {}
+    for doc in buscar(get_sketches_collection(), filtro, projecao):
+        chave = doc["competencia"] if agrupar_por_periodo else doc.get("valor")
+        regs = hll.de_bytes(doc["hll"][campo])
+        resultado[chave] = hll.mesclar(resultado[chave], regs) if chave in resultado else regs
+    return resultado
+
+
+def nps(contagens: np.ndarray) -> dict[str, float]:
+    """NPS = % promotores (9-10) − % detratores (0-6)."""
+    total = int(contagens.sum())
+    if not total:
+        return {"nps": 0.0, "promotores_pct": 0.0, "neutros_pct": 0.0, "detratores_pct": 0.0, "respostas": 0}
+    promotores = contagens[9:].sum() / total * 100
+    detratores = contagens[:7].sum() / total * 100
+    return {
+        "nps": round(float(promotores - detratores), 2),
+        "promotores_pct": round(float(promotores), 2),
+        "neutros_pct": round(float(100 - promotores - detratores), 2),
+        "detratores_pct": round(float(detratores), 2),
+        "respostas": total,
+    }
+
+
+def percentis(campo: str, contagens: np.ndarray, ps: Iterable[float]) -> dict[str, float | None]:
+    """Percentis por interpolação linear dentro da faixa (erro máximo = largura da faixa)."""
+    inicio, fim, largura = HISTOGRAMAS[campo]
+    teto = VALOR_MAXIMO.get(campo, fim)
+    total = contagens.sum()
+    acumulado = np.cumsum(contagens)
+    out: dict[str, float | None] = {}
+    for p in ps:
+        if not total:
+            out[f"p{p:g}"] = None
+            continue
+        alvo = p / 100 * total
+        i = int(np.searchsorted(acumulado, alvo, side="left"))
+        i = min(i, len(contagens) - 1)
+        antes = acumulado[i - 1] if i > 0 else 0
+        fracao = (alvo - antes) / contagens[i] if contagens[i] else 0
+        out[f"p{p:g}"] = round(float(min(inicio + (i + fracao) * largura, teto)), 3)
+    return out
+
+
+def faixas(campo: str) -> list[float]:
+    """Início de cada faixa do histograma de `campo`."""
+    inicio, _, largura = HISTOGRAMAS[campo]
+    return [round(inicio + i * largura, 3) for i in range(_n_faixas(campo))]
@@ -0,0 +1,114 @@
+import pytest
+
+from services import anomalias
+
+HISTORICO = [f"2024-{m:02d}" for m in range(1, 7)]
+
+
+def _sketch(competencia, dimensao, valor, linhas, receita, preco=10.0):
+    return {
+        "competencia": competencia,
+        "dimensao": dimensao,
+        "valor": valor,
+        "totais": {
+            "linhas": linhas,
+            "receita": receita,
+            "quantidade": receita / preco,
+            "preco_soma": preco * linhas,
+            "preco_n": linhas,
+        },
+    }
+
+
+def _competencia(competencia, canais: dict[str, tuple[int, float]]):
+    """Sketch total + um por canal ({canal: (linhas, receita)})."""
+    linhas = sum(n for n, _ in canais.values())
+    receita = sum(r for _, r in canais.values())
+    return [
+        _sketch(competencia, "total", None, linhas, receita),
+        *(_sketch(competencia, "canal", c, n, r) for c, (n, r) in canais.items()),
+    ]
+
+
+@pytest.fixture
+def historico(monkeypatch):
+    """Histórico estável: Varejo ~800 linhas / 80 mil, Online ~200 linhas / 20 mil."""
+    docs = []
+    for i, competencia in enumerate(HISTORICO):
+        variacao = 1 + 0.01 * (i % 3 - 1)
+        docs += _competencia(competencia, {
+            "Varejo": (int(800 * variacao), 80_000 * variacao),
+            "Online": (int(200 * variacao), 20_000 * variacao),
+        })
+    monkeypatch.setattr(anomalias, "get_sketches_collection", lambda: None)
+    monkeypatch.setattr(
+        anomalias, "buscar", lambda col, filtro, projecao: [d for d in docs if d["competencia"] < filtro["competencia"]["$lt"]]
+    )
+    return docs
+
+
+def _detectar(atuais):
+    return anomalias.detectar_anomalias("polpa", "2024-07", None, atuais)
+
+
+def _regras(resultado):
+    return {(a["regra"], a["dimensao"], a["valor"], a["metrica"]) for a in resultado["anomalias"]}
+
+
+def test_competencia_normal_sem_anomalias(historico):
+    resultado = _detectar(_competencia("2024-07", {"Varejo": (805, 80_500.0), "Online": (198, 19_900.0)}))
+    assert resultado["historico"] == HISTORICO
+    assert resultado["anomalias"] == []
+
+
+def test_receita_dobrada_e_desvio(historico):
+    resultado = _detectar(_competencia("2024-07", {"Varejo": (800, 160_000.0), "Online": (200, 20_000.0)}))
+    regras = _regras(resultado)
+    assert ("desvio", "canal", "Varejo", "receita") in regras
+    assert ("desvio", "total", None, "receita") in regras
+    assert not any(v == "Online" for _, _, v, _ in regras)
+    varejo = next(a for a in resultado["anomalias"] if a["valor"] == "Varejo" and a["metrica"] == "receita")
+    assert varejo["z"] > anomalias.ANOMALIAS_Z
+    assert varejo["mediana"] == pytest.approx(80_000.0)
+    assert varejo["variacao_pct"] == pytest.approx(100.0)
+
+
+def test_variacao_pequena_fica_abaixo_do_piso_de_ruido(historico):
+    # histórico quase constante (MAD pequeno): 4% a mais não passa do piso de escala
+    resultado = _detectar(_competencia("2024-07", {"Varejo": (800, 83_200.0), "Online": (200, 20_000.0)}))
+    assert resultado["anomalias"] == []
+
+
+def test_canal_ausente(historico):
+    resultado = _detectar(_competencia("2024-07", {"Varejo": (800, 80_000.0)}))
+    assert ("ausente", "canal", "Online", "linhas") in _regras(resultado)
+
+
+def test_canal_novo_com_participacao_relevante(historico):
+    resultado = _detectar(
+        _competencia("2024-07", {"Varejo": (800, 80_000.0), "Online": (200, 20_000.0), "Atacado": (100, 10_000.0)})
+    )
+    assert ("novo", "canal", "Atacado", "linhas") in _regras(resultado)
+
+
+def test_canal_novo_pequeno_nao_e_sinalizado(historico):
+    resultado = _detectar(
+        _competencia("2024-07", {"Varejo": (800, 80_000.0), "Online": (200, 20_000.0), "Atacado": (10, 1_000.0)})
+    )
+    assert not any(a["valor"] == "Atacado" for a in resultado["anomalias"])
+
+
+def test_celula_pequena_nao_e_comparada(monkeypatch):
+    docs = [d for c in HISTORICO for d in _competencia(c, {"Online": (20, 2_000.0)})]
+    monkeypatch.setattr(anomalias, "get_sketches_collection", lambda: None)
+    monkeypatch.setattr(anomalias, "buscar", lambda col, filtro, projecao: docs)
+    resultado = _detectar(_competencia("2024-07", {"Online": (20, 20_000.0)}))
+    assert resultado["anomalias"] == []
+
+
+def test_historico_curto_nao_compara(monkeypatch):
+    docs = [d for c in HISTORICO[:2] for d in _competencia(c, {"Varejo": (800, 80_000.0)})]
+    monkeypatch.setattr(anomalias, "get_sketches_collection", lambda: None)
+    monkeypatch.setattr(anomalias, "buscar", lambda col, filtro, projecao: docs)
+    resultado = _detectar(_competencia("2024-07", {"Varejo": (800, 800_000.0)}))
+    assert resultado == {"historico": HISTORICO[:2], "anomalias": []}
@@ -0,0 +1,31 @@
+import datetime
+
+from services import consultas
+
+
+def test_resumo_em_buckets_desempacota_data_pedido(monkeypatch):
+    monkeypatch.setattr(consultas, "STORAGE_MODE", "buckets")
+    match = {
+        "competencia": "2025-01",
+        **consultas.filtro_datas("mes", datetime.date(2025, 1, 10), datetime.date(2025, 1, 20)),
+    }
+    estagios = consultas.estagios_resumo("polpa", match, ["receita", "quantidade_kg"])
+
+    assert estagios[0] == {
+        "$match": {
+            "competencia": "2025-01",
+            "data_max": {"$gte": datetime.datetime(2025, 1, 10)},
+            "data_min": {"$lt": datetime.datetime(2025, 1, 21)},
+        }
+    }
+    desempacotados = estagios[1]["$project"]["linha"]["$map"]["in"]
+    assert set(desempacotados) == {"receita", "quantidade_kg", "data_pedido"}
+    assert {"$match": {"data_pedido": match["data_pedido"]}} in estagios
+
+
+def test_resumo_em_buckets_sem_filtro_de_linha_nao_desempacota(monkeypatch):
+    monkeypatch.setattr(consultas, "STORAGE_MODE", "buckets")
+    estagios = consultas.estagios_resumo("polpa", {"competencia": "2025-01"}, ["receita"])
+
+    assert estagios[1]["$project"]["receita"] == {"$sum": "$colunas.receita"}
+    assert not any("$unwind" in e for e in estagios)
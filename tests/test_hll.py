@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services import hll
+
+
+def _lotes(inicio: int, fim: int) -> pd.Series:
+    return pd.Series([f"L{i}" for i in range(inicio, fim)], dtype=object)
+
+
+@pytest.mark.parametrize("n", [1, 10, 100, 1_000])
+def test_poucos_valores_quase_exatos(n):
+    # linear counting: com poucos registradores ocupados a estimativa é praticamente exata
+    assert abs(hll.estimar(hll.registradores(_lotes(0, n))) - n) <= max(1, 0.005 * n)
+
+
+@pytest.mark.parametrize("n", [20_000, 50_000, 200_000])
+def test_erro_dentro_de_tres_erros_padrao(n):
+    # 20k fica abaixo de 2,5·M (linear counting); 50k e 200k usam o estimador bruto
+    estimativa = hll.estimar(hll.registradores(_lotes(0, n)))
+    assert abs(estimativa / n - 1) < 3 * hll.ERRO_PADRAO
+
+
+def test_50k_estimativa_conhecida():
+    assert hll.estimar(hll.registradores(_lotes(0, 50_000))) == 50_609
+
+
+def test_vazio_e_nulos_ignorados():
+    assert hll.estimar(hll.registradores(pd.Series([], dtype=object))) == 0
+    assert hll.estimar(hll.registradores(pd.Series(["x", "x", None, np.nan, "y"], dtype=object))) == 2
+
+
+def test_mesclar_equivale_a_uniao():
+    a, b = hll.registradores(_lotes(0, 30_000)), hll.registradores(_lotes(20_000, 50_000))
+    uniao = hll.registradores(_lotes(0, 50_000))
+    assert np.array_equal(hll.mesclar(a, b), uniao)
+
+
+def test_bytes_ida_e_volta():
+    regs = hll.registradores(_lotes(0, 5_000))
+    dados = hll.para_bytes(regs)
+    assert len(dados) == hll.M
+    assert np.array_equal(hll.de_bytes(dados), regs)
+
+
+def test_grupos_igual_a_um_sketch_por_grupo():
+    valores = _lotes(0, 3_000)
+    grupos = np.arange(3_000) % 3
+    por_grupo = hll.registradores(valores, grupos, 3)
+    assert por_grupo.shape == (3, hll.M)
+    for g in range(3):
+        assert np.array_equal(por_grupo[g], hll.registradores(valores[grupos == g]))
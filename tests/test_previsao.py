@@ -0,0 +1,74 @@
+from statistics import NormalDist
+
+import numpy as np
+import pytest
+
+from services import previsao
+
+
+def _sazonal(t: np.ndarray) -> np.ndarray:
+    return 100 + 2 * t + 20 * np.sin(2 * np.pi * t / 12)
+
+
+def test_holt_winters_reproduz_serie_sazonal():
+    t = np.arange(48)
+    ajuste = previsao.ajustar(_sazonal(t[:36])[None, :])
+    assert ajuste["modelo"][0] == "holt_winters"
+    resultado = previsao.prever(ajuste, 12, 0.9)
+    np.testing.assert_allclose(resultado["valor"][0], _sazonal(t[36:]), rtol=1e-6)
+
+
+def test_holt_continua_tendencia_linear():
+    ajuste = previsao.ajustar((50 + 3 * np.arange(10.0))[None, :])
+    assert ajuste["modelo"][0] == "holt"
+    np.testing.assert_allclose(previsao.prever(ajuste, 3, 0.9)["valor"][0], [80, 83, 86])
+
+
+def test_historico_curto_usa_media():
+    ajuste = previsao.ajustar(np.array([[10.0, 12.0, 14.0]]))
+    assert ajuste["modelo"][0] == "media"
+    resultado = previsao.prever(ajuste, 2, 0.9)
+    np.testing.assert_allclose(resultado["valor"][0], [12, 12])
+    margem = NormalDist().inv_cdf(0.95) * 2.0 * np.sqrt(1 + 1 / 3)
+    np.testing.assert_allclose(resultado["superior"][0] - resultado["valor"][0], [margem, margem])
+
+
+def test_variancia_h_passos():
+    # sigma² (1 + soma_{j<h} c_j²), c_j = α(1 + jβ) + γ·[j múltiplo de 12]
+    alfa, beta, gama, sigma = 0.5, 0.2, 0.1, 3.0
+    ajuste = {
+        "modelo": np.array(["holt_winters"], dtype=object),
+        "meses": 36,
+        "nivel": np.array([1000.0]),
+        "tendencia": np.array([0.0]),
+        "sazonal": np.zeros((1, 12)),
+        "alfa": np.array([alfa]),
+        "beta": np.array([beta]),
+        "gama": np.array([gama]),
+        "sigma": np.array([sigma]),
+    }
+    resultado = previsao.prever(ajuste, 14, 0.95)
+    z = NormalDist().inv_cdf(0.975)
+    esperado = []
+    for h in range(1, 15):
+        c = [alfa * (1 + j * beta) + (gama if j % 12 == 0 else 0) for j in range(1, h)]
+        esperado.append(z * sigma * np.sqrt(1 + sum(x * x for x in c)))
+    np.testing.assert_allclose(resultado["superior"][0] - resultado["valor"][0], esperado)
+    np.testing.assert_allclose(resultado["valor"][0] - resultado["inferior"][0], esperado)
+
+
+def test_limite_inferior_em_zero():
+    ajuste = previsao.ajustar(np.array([[5.0, 1.0, 9.0]]))
+    assert (previsao.prever(ajuste, 3, 0.99)["inferior"] >= 0).all()
+
+
+@pytest.mark.parametrize("semente", [1, 2])
+def test_series_juntas_igual_a_separadas(semente):
+    rng = np.random.default_rng(semente)
+    t = np.arange(36)
+    y = np.vstack([_sazonal(t) + rng.normal(0, 3, 36), 50 + rng.normal(0, 5, 36)])
+    juntas = previsao.prever(previsao.ajustar(y), 6, 0.9)
+    for i in range(len(y)):
+        sozinha = previsao.prever(previsao.ajustar(y[i:i + 1]), 6, 0.9)
+        for chave in ("valor", "inferior", "superior"):
+            np.testing.assert_allclose(juntas[chave][i], sozinha[chave][0])
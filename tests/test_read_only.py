@@ -0,0 +1,65 @@
+"""
+Réplica READ_ONLY: importar a aplicação e atender uma leitura filtrada (índice de bitmaps) não
+pode carregar pandas. Precisa de um MongoDB em MONGODB_URL; usa um banco descartável.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+RAIZ = Path(__file__).resolve().parent.parent
+DB_TESTE = "dashboard_mangas_teste_read_only"
+
+SCRIPT = """
+import sys
+from fastapi.testclient import TestClient
+import main
+from services import bitmaps
+
+with TestClient(main.app) as cliente:
+    r = cliente.get("/api/metrics", params={"tipo": "polpa", "canal": ["Varejo", "Online"]})
+assert r.status_code == 200, r.text
+assert r.json()["registros"] == 20, r.json()
+assert bitmaps._indices["polpa"].carregado
+print("pandas" in sys.modules)
+"""
+
+
+@pytest.fixture
+def banco():
+    url = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+    cliente = MongoClient(url, serverSelectionTimeoutMS=1000)
+    try:
+        cliente.admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"MongoDB indisponível em {url}")
+    cliente.drop_database(DB_TESTE)
+    canais = ["Varejo", "Atacado", "Online", None]
+    cliente[DB_TESTE]["polpa"].insert_many([
+        {"tipo": "polpa", "competencia": "2025-01", "canal": canais[i % 4], "receita": 10.0, "quantidade_kg": 1.0}
+        for i in range(40)
+    ])
+    yield url
+    cliente.drop_database(DB_TESTE)
+    cliente.close()
+
+
+def test_leitura_filtrada_nao_carrega_pandas(banco):
+    env = {
+        **os.environ,
+        "MONGODB_URL": banco,
+        "DB_NAME": DB_TESTE,
+        "READ_ONLY": "true",
+        "STORAGE_MODE": "linhas",
+        "BITMAP_INDEX": "true",
+        "CACHE_CONSULTAS": "false",
+    }
+    saida = subprocess.run(
+        [sys.executable, "-c", SCRIPT], cwd=RAIZ, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert saida.returncode == 0, saida.stderr
+    assert saida.stdout.strip().splitlines()[-1] == "False"